@@ -11,6 +11,12 @@ from shapely.ops import transform
 import country_converter as coco
 from itertools import product
 from functools import partial
+from difflib import SequenceMatcher
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from IaaGeoDataCleaning.CleaningUtils.xlsx_reader import read_xlsx
+from IaaGeoDataCleaning.CleaningUtils import geohash
 
 
 def process_shapefile(shapefile=None):
@@ -68,18 +74,20 @@ def get_projection(prj_file):
     return srider.get_epsg()
 
 
-def read_file(file_path):
+def read_file(file_path, cache_dir=None):
     """
     Generate a dataframe from .xlsx or .csv file.
 
     :param file_path:
     :type file_path: str.
+    :param cache_dir: directory for a cached columnar copy of .xlsx files (see :func:`read_xlsx`).
+    :type cache_dir: str.
     :return:
     :rtype: DataFrame.
     :raise TypeError: if the file extension is not .csv or .xlsx.
     """
     if file_path.endswith('.xlsx'):
-        data = pd.read_excel(file_path)
+        data = read_xlsx(file_path, cache_dir=cache_dir)
     elif file_path.endswith('.csv'):
         data = pd.read_csv(file_path)
     else:
@@ -305,7 +313,7 @@ def cross_check(data, first_col, second_col):
     return matched_df
 
 
-def to_gdf(data, lat_col, lng_col, prj=4326):
+def to_gdf(data, lat_col, lng_col, prj=4326, geohash_precision=None):
     """
     Generate a geopandas.GeoDataFrame.
 
@@ -317,12 +325,17 @@ def to_gdf(data, lat_col, lng_col, prj=4326):
     :type lng_col: str.
     :param prj: EPSG code for spatial projection.
     :type prj: int.
+    :param geohash_precision: if passed, a 'Geohash' column with geohashes of this length is added (see
+                              :func:`geohash.encode`).
+    :type geohash_precision: int.
     :return:
     :rtype: geopandas.GeoDataFrame.
     """
     df = read_data(data, {lat_col, lng_col})
     df.fillna({lat_col: 0, lng_col: 0}, inplace=True)
     geometry = [Point(coords) for coords in zip(df[lng_col], df[lat_col])]
+    if geohash_precision:
+        df['Geohash'] = geohash.encode(df[lat_col], df[lng_col], geohash_precision)
     crs = {'init': 'epsg:' + str(prj)}
 
     return gpd.GeoDataFrame(df, crs=crs, geometry=geometry)
@@ -480,7 +493,31 @@ def check_data_geom(eval_col, iso2_col, all_geodata, shapedata, shape_geom_col,
     return matched_data, remaining_data
 
 
-def geocode_coordinates(data, loc_col, ctry_col):
+def _geocode_location(pht, lwr, hgr):
+    """
+    Query Photon for a location and keep the first match in the preset country.
+
+    :param pht: Photon geocoder.
+    :param lwr: location (lower level) name.
+    :param hgr: location (higher level) name.
+    :return: latitude, longitude, address, and raw Photon result of the match, or None if there is no match.
+    :rtype: dict.
+    :raise GeocoderTimedOut: if Photon does not answer in time.
+    """
+    iso2 = coco.convert(hgr, to='ISO2')
+    matches = pht.geocode(lwr + ', ' + hgr, exactly_one=False)
+    if matches:
+        for match in matches:
+            match_country = match.address.split(',')[-1]
+            match_iso2 = coco.convert(match_country, to='ISO2')
+
+            if match_iso2 == iso2:
+                return {'latitude': match.latitude, 'longitude': match.longitude, 'address': match.address,
+                        'result': match.raw}
+    return None
+
+
+def geocode_coordinates(data, loc_col, ctry_col, cache=None):
     """
     Use Photon API to geocode entries based on their location and country to find their coordinates.
 
@@ -494,6 +531,9 @@ def geocode_coordinates(data, loc_col, ctry_col):
     :type loc_col: str.
     :param ctry_col: name of the location (higher level) column.
     :type ctry_col: str.
+    :param cache: stored geocoding results (e.g. from `Table.geocode_cache()`). Locations found in it are not sent to
+                  Photon again, and new results are added to it in bulk once all entries are geocoded.
+    :type cache: GeocodeCache.
     :return: two dataframes, one with all of the locations that Photon was able to find, and one with locations that
              could not be queried.
     :rtype: tuple of (DataFrame, DataFrame).
@@ -512,10 +552,9 @@ def geocode_coordinates(data, loc_col, ctry_col):
     """
     df = read_data(data, {ctry_col})
 
-    gdf = pd.DataFrame(columns=df.columns)
-
     pht = gp.Photon(timeout=3)
 
+    keys = []
     for index, row in df.iterrows():
         if pd.isnull(row[loc_col]):
             lwr = ''
@@ -525,25 +564,36 @@ def geocode_coordinates(data, loc_col, ctry_col):
             hgr = ''
         else:
             hgr = row[ctry_col]
-        iso2 = coco.convert(hgr, to='ISO2')
+        keys.append((str(lwr), str(hgr)))
 
-        try:
-            matches = pht.geocode(lwr + ', ' + hgr, exactly_one=False)
-            if matches:
-                for match in matches:
-                    match_country = match.address.split(',')[-1]
-                    match_iso2 = coco.convert(match_country, to='ISO2')
-
-                    if match_iso2 == iso2:
-                        row['Geocoded_Lat'] = match.latitude
-                        row['Geocoded_Lng'] = match.longitude
-                        row['Geocoded_Adr'] = match.address
-                        row['Type'] = 'Geocoded'
-                        gdf = gdf.append(row, ignore_index=True, sort=True)
-
-                        break
-        except GeocoderTimedOut:
-            continue
+    if cache is not None:
+        results = cache.lookup(keys, provider='photon')
+    else:
+        results = dict()
+    new_results = dict()
+
+    geocoded = []
+    for (index, row), key in zip(df.iterrows(), keys):
+        if key not in results:
+            try:
+                results[key] = _geocode_location(pht, key[0], key[1])
+            except GeocoderTimedOut:
+                continue
+            new_results[key] = results[key]
+
+        result = results[key]
+        if result is not None and result['latitude'] is not None:
+            row['Geocoded_Lat'] = result['latitude']
+            row['Geocoded_Lng'] = result['longitude']
+            row['Geocoded_Adr'] = result['address']
+            row['Type'] = 'Geocoded'
+            geocoded.append(row)
+
+    if cache is not None and len(new_results) > 0:
+        cache.store(new_results, provider='photon')
+
+    gdf = pd.DataFrame(geocoded, columns=sorted(set(df.columns).union(['Geocoded_Adr', 'Geocoded_Lat', 'Geocoded_Lng',
+                                                                       'Type']))).reset_index(drop=True)
 
     idf = df[~df[loc_col].isin(gdf[loc_col])]
 
@@ -644,6 +694,131 @@ def query_data(data, query_dict, excl=False):
     return res_df
 
 
+def _cell_pairs(a_starts, a_counts, b_starts, b_counts, ends, lo, hi):
+    """
+    List pairs `lo` to `hi` of the pairs of positions between runs of sorted points, numbered run after run, so that
+    the pairs of runs of any size can be listed in blocks.
+
+    :param ends: cumulative number of pairs at the end of each run.
+    :return: the first and second positions of the pairs.
+    :rtype: tuple of (numpy.ndarray, numpy.ndarray).
+    """
+    pair = np.arange(lo, hi)
+    run = np.searchsorted(ends, pair, side='right')
+    local = pair - (ends[run] - a_counts[run] * b_counts[run])
+    return a_starts[run] + local // b_counts[run], b_starts[run] + local % b_counts[run]
+
+
+def find_duplicates(data, loc_col, lat_col, lng_col, max_distance=1.0, min_similarity=None, max_pairs=5000000):
+    """
+    Find groups of entries that are likely the same place: entries within `max_distance` kilometers of each other
+    and, if `min_similarity` is passed, with similar location names. Entries linked through a chain of such pairs
+    form one group. Entries without coordinates, or at (0, 0) where missing coordinates are filled in, are skipped.
+
+    Points are bucketed into a grid of cells as wide as `max_distance` (over unit sphere coordinates, so it has no
+    seams at the poles or the antimeridian), and distances are only computed between points in the same or
+    neighbouring cells, `max_pairs` pairs at a time.
+
+    :param data: filepath (.csv or .xlsx extension) or dataframe.
+    :type data: str or DataFrame.
+    :param loc_col: name of the location column.
+    :type loc_col: str.
+    :param lat_col: name of the latitude column.
+    :type lat_col: str.
+    :param lng_col: name of the longitude column.
+    :type lng_col: str.
+    :param max_distance: distance (in kilometers) under which two entries may be duplicates.
+    :type max_distance: float.
+    :param min_similarity: if passed, the ratio (between 0 and 1) of matching characters two location names need
+                           for their entries to be duplicates.
+    :type min_similarity: float.
+    :param max_pairs: maximum number of candidate pairs compared at once.
+    :type max_pairs: int.
+    :return: all entries that have a duplicate, with the number of their group in a 'Duplicate_Group' column.
+    :rtype: DataFrame.
+
+    >>> import pandas as pd
+    >>> df = pd.DataFrame({'City': ['Nairobi', 'Nairobi City', 'Mombasa', 'Nairobi'],
+    ...                    'Latitude': [-1.2864, -1.2921, -4.0435, -1.2864], 'Longitude': [36.8172, 36.8219, 39.6682, 36.8172]})
+    >>> find_duplicates(data=df, loc_col='City', lat_col='Latitude', lng_col='Longitude')
+               City  Latitude  Longitude  Duplicate_Group
+    0       Nairobi   -1.2864    36.8172                0
+    1  Nairobi City   -1.2921    36.8219                0
+    3       Nairobi   -1.2864    36.8172                0
+    """
+    df = read_data(data, {loc_col, lat_col, lng_col})
+    lats = pd.to_numeric(df[lat_col], errors='coerce').to_numpy(dtype='float64')
+    lngs = pd.to_numeric(df[lng_col], errors='coerce').to_numpy(dtype='float64')
+    valid = np.flatnonzero(~(np.isnan(lats) | np.isnan(lngs) | ((lats == 0) & (lngs == 0))))
+    rlats = np.radians(lats[valid])
+    rlngs = np.radians(lngs[valid])
+    xyz = np.column_stack((np.cos(rlats) * np.cos(rlngs), np.cos(rlats) * np.sin(rlngs), np.sin(rlats)))
+
+    # Cells as wide as the straight-line distance between two points max_distance apart on the surface. Cells are
+    # never narrower than 1e-6 (about 6 m), so that the keys of the cells fit in 64 bits.
+    cell = max(2 * np.sin(min(max_distance / 6371.0, np.pi) / 2), 1e-6)
+    width = int(np.ceil(2 / cell)) + 3
+    coords = np.floor(xyz / cell).astype('int64') + width // 2
+    keys = (coords[:, 0] * width + coords[:, 1]) * width + coords[:, 2]
+
+    order = np.argsort(keys, kind='stable')
+    cells, starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+
+    # Pairs in the same cell, as one run per point with the points after it in its cell, then pairs with each of
+    # the 13 neighbouring cells that come after it.
+    positions = np.arange(len(valid))
+    after = np.repeat(starts + counts, counts) - positions - 1
+    runs = [(positions[after > 0], np.ones((after > 0).sum(), dtype='int64'), positions[after > 0] + 1,
+             after[after > 0])]
+    for dx, dy, dz in product((-1, 0, 1), repeat=3):
+        if (dx, dy, dz) > (0, 0, 0) and len(cells) > 0:
+            neighbours = cells + (dx * width + dy) * width + dz
+            found = np.minimum(np.searchsorted(cells, neighbours), len(cells) - 1)
+            has_neighbour = cells[found] == neighbours
+            runs.append((starts[has_neighbour], counts[has_neighbour], starts[found[has_neighbour]],
+                         counts[found[has_neighbour]]))
+
+    if min_similarity is not None:
+        names = df[loc_col].fillna('').astype(str).str.lower().str.strip().to_numpy()[valid]
+
+    # Groups are merged after every block, so only one block of pairs is held in memory at a time.
+    labels = np.arange(len(valid))
+    for a_starts, a_counts, b_starts, b_counts in runs:
+        ends = np.cumsum(a_counts * b_counts)
+        n_pairs = int(ends[-1]) if len(ends) > 0 else 0
+        for lo in range(0, n_pairs, max_pairs):
+            first, second = _cell_pairs(a_starts, a_counts, b_starts, b_counts, ends, lo, min(lo + max_pairs, n_pairs))
+            first = order[first]
+            second = order[second]
+
+            rlat0, rlat1 = rlats[first], rlats[second]
+            a = (np.sin((rlat1 - rlat0) / 2) ** 2 +
+                 np.cos(rlat0) * np.cos(rlat1) * np.sin((rlngs[second] - rlngs[first]) / 2) ** 2)
+            close = 2 * 6371.0 * np.arcsin(np.sqrt(np.clip(a, 0, 1))) <= max_distance
+            first, second = first[close], second[close]
+
+            if min_similarity is not None:
+                similar = np.array([SequenceMatcher(None, names[i], names[j]).ratio() >= min_similarity
+                                    for i, j in zip(first, second)], dtype=bool)
+                first, second = first[similar], second[similar]
+
+            if len(first) > 0:
+                graph = coo_matrix((np.ones(len(first)), (labels[first], labels[second])),
+                                   shape=(len(valid), len(valid)))
+                labels = connected_components(graph, directed=False)[1][labels]
+
+    labels = np.unique(labels, return_inverse=True)[1]
+    sizes = np.bincount(labels)
+    duplicated = sizes[labels] > 1
+    # Number the groups in the order of their first entry.
+    first_entries, groups = np.unique(labels[duplicated], return_index=True, return_inverse=True)[1:]
+    groups = np.argsort(np.argsort(first_entries))[groups]
+
+    res_df = df.iloc[valid[duplicated]].copy()
+    res_df['Duplicate_Group'] = groups
+    return res_df
+
+
 def convert_df_crs(df, out_crs=4326):
     """Change projection from input projection to provided crs (defaults to 4326)"""
     def get_formatted_crs(crs):
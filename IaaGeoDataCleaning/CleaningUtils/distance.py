@@ -0,0 +1,32 @@
+import numpy as np
+
+EARTH_RADIUS = 6371
+
+
+def haversine(lat0, lng0, lat1, lng1):
+    """
+    Calculate the distance between geographical points using the haversine formula (in kilometers).
+
+    Any argument may be an array, in which case the distances are computed element-wise.
+
+    :param lat0:
+    :type lat0: float or numpy.ndarray.
+    :param lng0:
+    :type lng0: float or numpy.ndarray.
+    :param lat1:
+    :type lat1: float or numpy.ndarray.
+    :param lng1:
+    :type lng1: float or numpy.ndarray.
+    :return: the distance in km.
+    :rtype: float or numpy.ndarray.
+
+    >>> round(float(haversine(28.68, 77.22, 30.01, 31.13)), 1)
+    4439.3
+    """
+    rlat0 = np.radians(lat0)
+    rlat1 = np.radians(lat1)
+    dlat = rlat1 - rlat0
+    dlng = np.radians(np.subtract(lng1, lng0))
+
+    a = np.sin(dlat / 2) ** 2 + np.cos(rlat0) * np.cos(rlat1) * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def encode(lats, lngs, precision=9):
+    """
+    Encode coordinates as geohashes. Entries sharing a geohash prefix lie in the same cell of the grid of that
+    prefix length, so geohashes can be grouped and searched with plain string operations.
+
+    :param lats:
+    :type lats: array-like of float.
+    :param lngs:
+    :type lngs: array-like of float.
+    :param precision: number of characters of the geohashes (at most 12).
+    :type precision: int.
+    :return: the geohash of every coordinate, or None where a coordinate is missing or out of range.
+    :rtype: numpy.ndarray of str.
+
+    >>> list(encode([57.64911, -25.382708], [10.40744, -49.215545], precision=11))
+    ['u4pruydqqvj', '6gmp854r48m']
+    """
+    precision = int(min(max(precision, 1), 12))
+    lats = pd.to_numeric(pd.Series(lats), errors='coerce').to_numpy(dtype='float64')
+    lngs = pd.to_numeric(pd.Series(lngs), errors='coerce').to_numpy(dtype='float64')
+    valid = (lats >= -90) & (lats <= 90) & (lngs >= -180) & (lngs <= 180)
+
+    # Bits alternate between longitude and latitude, starting with longitude.
+    n_bits = 5 * precision
+    lng_bits = (n_bits + 1) // 2
+    lat_bits = n_bits // 2
+    lat_ints = np.minimum(np.floor((np.where(valid, lats, 0) + 90) / 180 * 2 ** lat_bits), 2 ** lat_bits - 1).astype('uint64')
+    lng_ints = np.minimum(np.floor((np.where(valid, lngs, 0) + 180) / 360 * 2 ** lng_bits), 2 ** lng_bits - 1).astype('uint64')
+
+    codes = np.zeros(len(lats), dtype='uint64')
+    for bit in range(n_bits):
+        if bit % 2 == 0:
+            source = (lng_ints >> np.uint64(lng_bits - 1 - bit // 2)) & np.uint64(1)
+        else:
+            source = (lat_ints >> np.uint64(lat_bits - 1 - bit // 2)) & np.uint64(1)
+        codes = (codes << np.uint64(1)) | source
+
+    shifts = np.arange(precision - 1, -1, -1, dtype='uint64') * np.uint64(5)
+    digits = ((codes[:, None] >> shifts) & np.uint64(31)).astype('int64')
+    chars = np.frombuffer(BASE32.encode('ascii'), dtype='uint8')[digits]
+    hashes = np.ascontiguousarray(chars).view('S%d' % precision).ravel().astype(str).astype(object)
+    hashes[~valid] = None
+    return hashes
+
+
+def decode(geohash):
+    """
+    Decode a geohash into the center of its cell.
+
+    :param geohash:
+    :type geohash: str.
+    :return: the latitude and longitude of the center, and the half height and half width of the cell (in degrees).
+    :rtype: tuple of (float, float, float, float).
+
+    >>> [round(val, 5) for val in decode('u4pruydqqvj')[:2]]
+    [57.64911, 10.40744]
+    """
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    is_lng = True
+    for char in geohash.lower():
+        value = BASE32.index(char)
+        for shift in range(4, -1, -1):
+            bounds = lng_range if is_lng else lat_range
+            mid = (bounds[0] + bounds[1]) / 2
+            if (value >> shift) & 1:
+                bounds[0] = mid
+            else:
+                bounds[1] = mid
+            is_lng = not is_lng
+    return ((lat_range[0] + lat_range[1]) / 2, (lng_range[0] + lng_range[1]) / 2,
+            (lat_range[1] - lat_range[0]) / 2, (lng_range[1] - lng_range[0]) / 2)
+
+
+def neighbours(geohash):
+    """
+    Find the geohashes of the up to 8 cells around a geohash's cell, of the same length. Together with the geohash
+    itself they cover every point closer to its cell than the cell's size, for coarse neighbour queries by prefix.
+
+    :param geohash:
+    :type geohash: str.
+    :return:
+    :rtype: list of str.
+
+    >>> sorted(neighbours('u4pru'))
+    ['u4pre', 'u4prg', 'u4prs', 'u4prt', 'u4prv', 'u4r25', 'u4r2h', 'u4r2j']
+    """
+    lat, lng, lat_err, lng_err = decode(geohash)
+    lats = []
+    lngs = []
+    for dlat in (-1, 0, 1):
+        for dlng in (-1, 0, 1):
+            nlat = lat + 2 * dlat * lat_err
+            if (dlat, dlng) != (0, 0) and -90 < nlat < 90:
+                lats.append(nlat)
+                lngs.append((lng + 2 * dlng * lng_err + 180) % 360 - 180)
+    return sorted(set(encode(lats, lngs, len(geohash))) - {geohash})
+
+
+def group_by_prefix(data, geohash_col, precision):
+    """
+    Group entries by the first `precision` characters of their geohash, i.e. by cell of the geohash grid of that
+    precision.
+
+    :param data:
+    :type data: DataFrame.
+    :param geohash_col: name of the geohash column.
+    :type geohash_col: str.
+    :param precision: length of the prefix.
+    :type precision: int.
+    :return:
+    :rtype: pandas.core.groupby.DataFrameGroupBy.
+    """
+    return data.groupby(data[geohash_col].str[:precision].rename(geohash_col + '_' + str(precision)))
@@ -1,7 +1,13 @@
 #! python
 
 import os
+import csv
+import hashlib
+import numpy as np
 import pandas as pd
+import geopandas as gpd
+from shapely.geometry import Point
+from IaaGeoDataCleaning.CleaningUtils.distance import haversine
 
 """
 Created by Sammy Fritsche, Thy Nguyen 7/12/18.
@@ -11,6 +17,77 @@ Facilitates modification of data after cleaning. Can be run as main or imported
 a Modifier class.
 """
 
+# Decision codes recorded per row during a review.
+UNDECIDED, SAVE, TOSS, KEEP = 0, 1, 2, 3
+
+class Rule:
+    """
+    Declarative decision applied in bulk by :meth:`Modifier.run` to every modified row it matches, before any row is
+    shown at the prompt. All of the passed criteria must hold for a row to match.
+
+    :param command: command to apply to the matching rows: 'SAVE', 'TOSS', or 'KEEP'.
+    :param row_type: only match rows of this type ('Flipped' or 'Geocoded'). Defaults to both.
+    :param max_distance: only match rows whose suggested coordinates are within this many kilometers of the input
+        coordinates.
+    :param shapes: GeoDataFrame of country borders. If passed, only match rows whose suggested coordinates fall inside
+        the borders of their country.
+    :param shape_geom: name of the geometry column of shapes.
+    :param shape_iso2: name of the two-letter country code column of shapes.
+    :param iso2_col: name of the two-letter country code column of the rows.
+    :param min_inside_distance: with shapes, only match rows whose suggested coordinates are at least this far inside
+        the borders (in the units of the shapes' projection, e.g. degrees).
+    :param condition: function taking the rows as a DataFrame and returning a boolean Series of the rows to match.
+    :raises ValueError: if command is not one of the commands above.
+    """
+    def __init__(self, command, row_type=None, max_distance=None, shapes=None, shape_geom='geometry',
+                 shape_iso2='ISO2', iso2_col='ISO2', min_inside_distance=0, condition=None):
+        if command not in ('SAVE', 'TOSS', 'KEEP'):
+            raise ValueError("Rule command must be 'SAVE', 'TOSS', or 'KEEP', not " + repr(command) + ".")
+        self.command = command
+        self.row_type = row_type
+        self.max_distance = max_distance
+        self.shapes = shapes
+        self.shape_geom = shape_geom
+        self.shape_iso2 = shape_iso2
+        self.iso2_col = iso2_col
+        self.min_inside_distance = min_inside_distance
+        self.condition = condition
+
+    def mask(self, rows, lat_col, lng_col, rec_lat_col, rec_lng_col):
+        """
+        Find the rows matched by the rule.
+
+        :param rows: A pandas DataFrame of rows to review
+        :return: A boolean Series aligned with rows
+        """
+        matched = pd.Series(True, index=rows.index)
+        if self.row_type is not None:
+            matched &= rows['Type'] == self.row_type
+
+        rec_lats = pd.to_numeric(rows[rec_lat_col], errors='coerce')
+        rec_lngs = pd.to_numeric(rows[rec_lng_col], errors='coerce')
+        if self.max_distance is not None:
+            distances = haversine(pd.to_numeric(rows[lat_col], errors='coerce').to_numpy(), pd.to_numeric(
+                rows[lng_col], errors='coerce').to_numpy(), rec_lats.to_numpy(), rec_lngs.to_numpy())
+            matched &= pd.Series(distances <= self.max_distance, index=rows.index)
+
+        if self.shapes is not None:
+            borders = self.shapes.drop_duplicates(self.shape_iso2).set_index(self.shape_iso2)[self.shape_geom]
+            polygons = gpd.GeoSeries(borders.reindex(rows[self.iso2_col]).values)
+            points = gpd.GeoSeries([Point(xy) for xy in zip(rec_lngs.fillna(0), rec_lats.fillna(0))])
+            has_polygon = polygons.notnull().to_numpy()
+            inside = np.zeros(len(rows), dtype=bool)
+            if has_polygon.any():
+                inside[has_polygon] = (points[has_polygon].within(polygons[has_polygon]) &
+                                       (points[has_polygon].distance(polygons[has_polygon].boundary) >=
+                                        self.min_inside_distance)).to_numpy()
+            matched &= pd.Series(inside, index=rows.index) & rec_lats.notnull() & rec_lngs.notnull()
+
+        if self.condition is not None:
+            matched &= self.condition(rows).astype(bool)
+        return matched
+
+
 class Modifier:
     """
     Class acts as a command line tool for accepting/rejecting proposed data modifications and
@@ -66,12 +143,23 @@ class Modifier:
 
     def run(self, output_directory, lat_col='Latitude', lng_col='Longitude', rec_lat_col='Flipped_Lat',
             rec_lng_col='Flipped_Lng', country_col='Country', loc_col='Location',
-            geoc_rec_lng_col='Geocoded_Lat', geoc_rec_lat_col='Geocoded_Lng'):
+            geoc_rec_lng_col='Geocoded_Lng', geoc_rec_lat_col='Geocoded_Lat', rules=None, journal_path=None):
         """
         Iterate over cleaned data file and prompt user to confirm changes. Changes are then stored
         in a new file and the original data is left untouched.
 
         :params: Optional params to define column names
+        :param rules: List of Rule objects applied to all rows in bulk first. Only the rows matched by no rule, or
+            by rules with different commands, are shown at the prompt.
+        :param journal_path: File every decision is appended to as it is made. Defaults to
+            modifier_journal_<key>.csv in the output directory, where <key> is a hash of the contents of the three
+            input files. Running again on the same inputs reuses the decisions in it and only prompts for the
+            remaining rows.
+
+        The existing correct entries and the reviewed entries are written to correctlocation_<key>.csv in the output
+        directory, the reviewed entries being appended in the order they are decided. The entries left to check are
+        written to flipped_updated_<key>.csv and geocoded_updated_<key>.csv at the end. Reviews of different inputs
+        therefore never share files, and an existing output is never overwritten.
         """
 
         maker = self.make_commands()
@@ -97,101 +185,285 @@ class Modifier:
         print('===========')
         for i in range(len(command_list)):
             print(command_list[i] + ': ' + desc_list[i])
-        flipped_data = self.__run_loop(self.to_check, maker, command_list, desc_list,
-                                                               lat_col, lng_col, rec_lat_col, rec_lng_col, country_col,
-                                                               loc_col)
-
-        geocoded_data = self.__run_loop(self.to_check_geocoded, maker, command_list,
-                                                               desc_list, lat_col, lng_col, geoc_rec_lat_col,
-                                                               geoc_rec_lng_col, country_col, loc_col)
-        if not output_directory:
-            flipped_data[1].to_csv(path_or_buf=str(os.path.normpath(os.path.join(self.modded_path, 'flipped_updated.csv'))),
-                                   sep=',', index=False)
-            geocoded_data[1].to_csv(path_or_buf=str(os.path.normpath(os.path.join(self.modded_path, 'geocoded_updated.csv'))),
-                                   sep=',', index=False)
-        else:
-            flipped_data[1].to_csv(str(os.path.join(output_directory, 'flipped_updated.csv')), sep=',', index=False)
-            geocoded_data[1].to_csv(path_or_buf=str(os.path.join(output_directory, 'geocoded_updated.csv')), sep=',', index=False)
-        flipped_data = pd.DataFrame(flipped_data[0], columns=columns)
-        geocoded_data = pd.DataFrame(geocoded_data[0], columns=geoc_columns)
-        confirmed_data = flipped_data.append(geocoded_data, sort=True)
-
-        print('All rows checked. Saving.')
-        self.__save_file(confirmed_data, output_directory)
-
-    def __run_loop(self, this_check, maker, command_list, desc_list, lat_col, lng_col, rec_lat_col, rec_lng_col,
-                   country_col, loc_col):
-        """
-        Private method to construct and run the loop over entries that require validation.
 
-        :params: Uses column names defined in run()
+        session = self.__session_key()
+        directory = output_directory or self.modded_path
+        if not journal_path:
+            journal_path = os.path.join(directory, 'modifier_journal_' + session + '.csv')
+        journal = self.__read_journal(journal_path, session)
+        codes = {maker[0][0]: SAVE, maker[0][1]: TOSS, maker[0][4]: KEEP}
+
+        reviews = [('flipped', self.to_check, rec_lat_col, rec_lng_col),
+                   ('geocoded', self.to_check_geocoded, geoc_rec_lat_col, geoc_rec_lng_col)]
+        resumed = [self.__resume(this_check, [entry for entry in journal if entry[0] == source], codes)
+                   for (source, this_check, _, _) in reviews]
+
+        out_cols = sorted(set(self.corrects.columns).union(self.to_check.columns, self.to_check_geocoded.columns))
+        output_path = self.__prepare_output(directory, session, self.__journaled_output(
+            journal, reviews, codes, out_cols, lat_col, lng_col))
+
+        remaining = []
+        for (source, this_check, rec_lat, rec_lng), (fingerprints, decisions) in zip(reviews, resumed):
+            remaining.append(self.__review(this_check, decisions, fingerprints, rules, codes, maker, command_list,
+                                           desc_list, lat_col, lng_col, rec_lat, rec_lng, country_col, loc_col,
+                                           journal_path, session, source, output_path, out_cols))
+        remaining[0].to_csv(os.path.join(directory, 'flipped_updated_' + session + '.csv'), sep=',', index=False)
+        remaining[1].to_csv(os.path.join(directory, 'geocoded_updated_' + session + '.csv'), sep=',', index=False)
+
+        print('All rows checked. Confirmed entries are in ' + output_path + '.')
+
+    def __session_key(self):
+        """
+        Private method to identify a review by the contents of its input files, so that reviews of different files
+        never share a journal or an output.
+
+        :return: A hexadecimal hash of the correct, flipped, and geocoded entries
+        """
+        digest = hashlib.sha1()
+        for frame in (self.corrects, self.to_check, self.to_check_geocoded):
+            digest.update(str((list(frame.columns), len(frame))).encode('utf-8'))
+            digest.update(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes())
+        return digest.hexdigest()[:16]
+
+    def __resume(self, this_check, entries, codes):
+        """
+        Private method to reuse the journaled decisions of the rows that have not changed since they were made.
+
+        :param entries: Journal entries of the reviewed file, as returned by __read_journal()
+        :return: The hashes of the rows and the array of decision codes, one per row of this_check
+        """
+        decisions = np.full(len(this_check), UNDECIDED, dtype='int8')
+
+        # Rows are identified in the journal by position and a hash of their contents, so decisions are only reused
+        # for unchanged rows.
+        fingerprints = pd.util.hash_pandas_object(this_check, index=False).map('{:016x}'.format).to_numpy()
+        for source, position, fingerprint, command in entries:
+            if position < len(this_check) and fingerprints[position] == fingerprint and command in codes:
+                decisions[position] = codes[command]
+        return fingerprints, decisions
+
+    def __output_rows(self, rows, out_cols):
+        """
+        Private method to format rows the way they are written to the output.
+
+        :param rows: A pandas DataFrame of rows
+        :param out_cols: Columns of the output
+        :return: The rows as .csv text, without a header
+        """
+        return rows.reindex(columns=out_cols).to_csv(sep=',', header=False, index=False, lineterminator='\n')
+
+    def __journaled_output(self, journal, reviews, codes, out_cols, lat_col, lng_col):
+        """
+        Private method to generate the output the journaled decisions produce: the header, the existing correct
+        entries, then the reviewed entries in the order they were decided.
 
-        :return: The pandas DataFrame of confirmed locations up to this point as well as the modified
-        DataFrame for the incorrects/geocoded entries.
-        """
-        temp_confirmed = []
-        for (index, row) in this_check.iterrows():
-            if row['Type'] == 'Flipped' or row['Type'] == 'Geocoded':    # Only run if data has been modified.
-                print(row[loc_col] + ', ' + row[country_col])
-                print('Input Lat: ' + str(row[lat_col]) + '  Input Lng: ' + str(row[lng_col]))
-                print('Recorded Lat: ' + str(row[rec_lat_col]) + '  Recorded Lng: ' + str(row[rec_lng_col]))
-                user_input = input('Input command: ')
-
-                # If user chooses help or inputs valid input, loop until we get different.
-                while user_input not in command_list or user_input == maker[2]:
-                    if user_input == maker[2]:
-                        for i in range(len(command_list)):
-                            print(command_list[i] + ': ' + desc_list[i])
-                    else:
-                        print('Invalid command. Type "HELP" to see available commands.')
-                    user_input = input("Input command: ")
-
-                # At this point, a valid command has been input
-                if user_input == maker[0][0]:    # SAVE: Save the suggested value
-                    print('Saving')
-                    row[lat_col] = row[rec_lat_col]
-                    row[lng_col] = row[rec_lng_col]
-                    row['Type'] = 'Verified'
-                    temp_confirmed.append(row)
-                    this_check.drop(index, inplace=True)
-                elif user_input == maker[0][1]:     # TOSS: Don't use suggested value, but don't mark as correct. Keep it in the incorrects.
-                    print('Tossing')
-                    temp_confirmed.append(row)
-                elif user_input == maker[0][3]:     # KEEP: Don't use the suggested value, mark it as correct. Remove from incorrects.
-                    print('Keeping')
-                    row['Type'] = 'Verified'
-                    temp_confirmed.append(row)
-                    this_check.drop(index, inplace=True)
-                elif user_input == maker[0][2]:    # EXIT: Stop editing and save new file now.
-                    print('Stopping')
-                    break
-
-        # temp_confirmed = pd.DataFrame(data=temp_confirmed, columns=cols)
-
-        return temp_confirmed, this_check
-
-    def __save_file(self, confirmed_data, file_path):
-        """
-        Save the passed dataframe as a new .csv file.
-
-        :param confirmed_data: A pandas DataFrame representing all data validated as correct
-        :param file_path: File path including file name with .csv extension. Dictates where output is placed.
-        """
-        self.corrects = self.corrects.append(confirmed_data, sort=True)    # Append our validated data to the data
-        print(file_path)
-        unique = False
+        :param journal: Journal entries, as returned by __read_journal()
+        :param reviews: Name, entries, and suggested latitude and longitude columns of each reviewed file
+        :return: The output as .csv text
+        """
+        text = [','.join(out_cols) + '\n', self.__output_rows(self.corrects, out_cols)]
+        checks = dict((source, (this_check, rec_lat, rec_lng)) for (source, this_check, rec_lat, rec_lng) in reviews)
+        start = 0
+        # Consecutive entries of the same file are formatted together.
+        while start < len(journal):
+            source = journal[start][0]
+            end = start
+            while end < len(journal) and journal[end][0] == source:
+                end += 1
+            this_check, rec_lat, rec_lng = checks[source]
+            entries = [entry for entry in journal[start:end] if entry[1] < len(this_check) and entry[3] in codes]
+            decisions = np.array([codes[entry[3]] for entry in entries], dtype='int8')
+            text.append(self.__output_rows(self.__apply_decisions(
+                this_check.iloc[[entry[1] for entry in entries]], decisions, lat_col, lng_col, rec_lat, rec_lng)[0],
+                out_cols))
+            start = end
+        return ''.join(text)
+
+    def __prepare_output(self, directory, session, expected):
+        """
+        Private method to find the output of the session and bring it up to date with the journal. Reviewed entries
+        are appended to it as they are decided, so it is only completed when a run stopped between writing the
+        journal and the output. An existing file that does not match the journal is never overwritten: the output
+        is written to a new file next to it instead.
+
+        :param directory: Output directory
+        :param session: Key of the session, as returned by __session_key()
+        :param expected: The output the journal produces, as returned by __journaled_output()
+        :return: File path of the output
+        """
+        output_path = os.path.join(directory, 'correctlocation_' + session + '.csv')
+        written = ''
         i = 0
-        test_file_path=''
-        while not unique:  # Ensure we write to a new file and don't overwrite an existing one.
-            test_file_path = os.path.join(file_path, 'correctlocation_' + str(i) + '.csv')
-            if not os.path.exists(file_path):
-                unique = True
-                test_file_path = str(test_file_path)
+        while os.path.exists(output_path):
+            with open(output_path, newline='') as output_file:
+                written = output_file.read()
+            if expected.startswith(written):
+                if len(written) < len(expected):
+                    print('Completing ' + output_path + ' from the journal.')
+                break
+            print(output_path + ' does not match the journal and is left as is.')
+            output_path = os.path.join(directory, 'correctlocation_' + session + '_' + str(i) + '.csv')
+            written = ''
             i += 1
-        print('Creating file at ' + test_file_path)
-        self.corrects.to_csv(path_or_buf=test_file_path, sep=',', index=False)
+        with open(output_path, 'a', newline='') as output_file:
+            output_file.write(expected[len(written):])
+        return output_path
+
+    def __review(self, this_check, decisions, fingerprints, rules, codes, maker, command_list, desc_list, lat_col,
+                 lng_col, rec_lat_col, rec_lng_col, country_col, loc_col, journal_path, session, source, output_path,
+                 out_cols):
+        """
+        Private method to apply the rules to all entries that require validation and have no journaled decision, then
+        prompt for the rest. Decisions are recorded per row position and, as they are made, appended to the journal
+        and the confirmed entries among them to the output.
+
+        :params: Uses column names defined in run()
+        :param decisions: Array of decision codes, one per row of this_check, holding the journaled decisions
+        :param fingerprints: Hashes of the rows of this_check
+        :param journal_path: File the new decisions are appended to
+        :param session: Key of the session in the journal
+        :param source: Name of the reviewed file in the journal
+        :param output_path: File the confirmed entries are appended to
+        :param out_cols: Columns of the output
+
+        :return: The pandas DataFrame of the incorrects/geocoded entries left after the review.
+        """
+        modified = this_check['Type'].isin(['Flipped', 'Geocoded']).to_numpy()
+        journaled = decisions != UNDECIDED
+        if journaled.any():
+            print('Resuming ' + str(int(journaled.sum())) + ' decisions from ' + journal_path + '.')
+
+        def record(positions, commands):
+            positions = np.asarray(positions)
+            self.__write_journal(journal_path, session, source, positions, fingerprints, commands)
+            confirmed = self.__apply_decisions(this_check.iloc[positions], decisions[positions], lat_col, lng_col,
+                                               rec_lat_col, rec_lng_col)[0]
+            with open(output_path, 'a', newline='') as output_file:
+                output_file.write(self.__output_rows(confirmed, out_cols))
+
+        ambiguous = np.zeros(len(this_check), dtype=bool)
+        for rule in rules or []:
+            matched = rule.mask(this_check, lat_col, lng_col, rec_lat_col, rec_lng_col).to_numpy() & modified & ~journaled
+            code = codes[rule.command]
+            # Rows matched by rules with different commands are left for the prompt.
+            ambiguous |= matched & (decisions != UNDECIDED) & (decisions != code)
+            decisions[matched & (decisions == UNDECIDED)] = code
+        decisions[ambiguous] = UNDECIDED
+
+        by_rules = (decisions != UNDECIDED) & ~journaled
+        if by_rules.any():
+            names = dict((code, command) for command, code in codes.items())
+            record(np.flatnonzero(by_rules), [names[code] for code in decisions[by_rules]])
+            print('Rules decided ' + str(int((decisions[by_rules] == SAVE).sum())) + ' SAVE, ' +
+                  str(int((decisions[by_rules] == TOSS).sum())) + ' TOSS, and ' +
+                  str(int((decisions[by_rules] == KEEP).sum())) + ' KEEP.')
+
+        self.__run_loop(this_check, decisions, np.flatnonzero(modified & (decisions == UNDECIDED)), codes, record,
+                        maker, command_list, desc_list, lat_col, lng_col, rec_lat_col, rec_lng_col, country_col,
+                        loc_col)
+
+        return self.__apply_decisions(this_check, decisions, lat_col, lng_col, rec_lat_col, rec_lng_col)[1]
+
+    def __run_loop(self, this_check, decisions, positions, codes, record, maker, command_list, desc_list, lat_col,
+                   lng_col, rec_lat_col, rec_lng_col, country_col, loc_col):
+        """
+        Private method to construct and run the loop over entries that require validation. The command given for
+        each entry is recorded in decisions and passed to record as soon as it is given.
+
+        :params: Uses column names defined in run()
+        :param decisions: Array of decision codes, one per row of this_check
+        :param positions: Positions of the rows to prompt for, in order
+        :param record: Function taking row positions and their commands, called after every decision
+        """
+        values = dict((col, this_check[col].to_numpy()) for col in (lat_col, lng_col, rec_lat_col, rec_lng_col,
+                                                                      country_col, loc_col))
+        for position in positions:
+            print(str(values[loc_col][position]) + ', ' + str(values[country_col][position]))
+            print('Input Lat: ' + str(values[lat_col][position]) + '  Input Lng: ' + str(values[lng_col][position]))
+            print('Recorded Lat: ' + str(values[rec_lat_col][position]) + '  Recorded Lng: ' +
+                  str(values[rec_lng_col][position]))
+            user_input = input('Input command: ')
+
+            # If user chooses help or inputs valid input, loop until we get different.
+            while user_input not in command_list or user_input == maker[2]:
+                if user_input == maker[2]:
+                    for i in range(len(command_list)):
+                        print(command_list[i] + ': ' + desc_list[i])
+                else:
+                    print('Invalid command. Type "HELP" to see available commands.')
+                user_input = input("Input command: ")
+
+            # At this point, a valid command has been input
+            if user_input == maker[0][2]:    # EXIT: Stop editing and save new file now.
+                print('Stopping')
+                break
+            elif user_input == maker[0][0]:    # SAVE: Save the suggested value
+                print('Saving')
+            elif user_input == maker[0][1]:     # TOSS: Don't use suggested value, but don't mark as correct. Keep it in the incorrects.
+                print('Tossing')
+            elif user_input == maker[0][4]:     # KEEP: Don't use the suggested value, mark it as correct. Remove from incorrects.
+                print('Keeping')
+            decisions[position] = codes[user_input]
+            record([position], [user_input])
+
+    def __apply_decisions(self, this_check, decisions, lat_col, lng_col, rec_lat_col, rec_lng_col):
+        """
+        Private method to apply the recorded decisions to the entries at once.
 
-        print('Complete. Closing program.')
+        :params: Uses column names defined in run()
+        :param decisions: Array of decision codes, one per row of this_check
+
+        :return: The pandas DataFrame of confirmed locations, in their original order, as well as the
+        modified DataFrame for the incorrects/geocoded entries.
+        """
+        decided = decisions != UNDECIDED
+        confirmed = this_check[decided].copy()
+        saved = decisions[decided] == SAVE
+        verified = saved | (decisions[decided] == KEEP)
+        confirmed.loc[saved, lat_col] = confirmed.loc[saved, rec_lat_col]
+        confirmed.loc[saved, lng_col] = confirmed.loc[saved, rec_lng_col]
+        confirmed.loc[verified, 'Type'] = 'Verified'
+
+        remaining = this_check[(decisions != SAVE) & (decisions != KEEP)]
+        return confirmed, remaining
+
+    def __read_journal(self, journal_path, session):
+        """
+        Read the decisions of earlier runs of the session from the journal. Later entries for a row replace earlier
+        ones.
+
+        :param journal_path: File path of the journal
+        :param session: Key of the session, as returned by __session_key()
+        :return: List of the (file name, row position, fingerprint, command) of the session's decisions, in the order
+        they were made
+        """
+        journal = []
+        if os.path.exists(journal_path):
+            with open(journal_path, newline='') as journal_file:
+                for row in csv.DictReader(journal_file):
+                    if row['session'] == session:
+                        journal.append((row['source'], int(row['position']), row['fingerprint'], row['command']))
+        return journal
+
+    def __write_journal(self, journal_path, session, source, positions, fingerprints, commands):
+        """
+        Append decisions to the journal, creating it if needed.
+
+        :param journal_path: File path of the journal
+        :param session: Key of the session
+        :param source: Name of the reviewed file
+        :param positions: Row positions of the decisions
+        :param fingerprints: Hashes of the rows of the reviewed file
+        :param commands: Command given for each of the positions
+        """
+        is_new = not os.path.exists(journal_path)
+        with open(journal_path, 'a', newline='') as journal_file:
+            writer = csv.writer(journal_file)
+            if is_new:
+                writer.writerow(['session', 'source', 'position', 'fingerprint', 'command'])
+            writer.writerows((session, source, int(position), fingerprints[position], command)
+                             for position, command in zip(positions, commands))
+            journal_file.flush()
 
 def run_mod():
     print('Define data filepaths')
@@ -0,0 +1,112 @@
+import os
+import hashlib
+import pandas as pd
+from openpyxl import load_workbook
+
+
+def iter_xlsx(file_path, batch_size=10000, sheet_name=None):
+    """
+    Stream the rows of a .xlsx file as dataframes of at most `batch_size` rows.
+
+    The workbook is opened in read-only mode, so only the current batch is held in memory. Blank rows are skipped.
+
+    :param file_path: filepath to the .xlsx file.
+    :type file_path: str.
+    :param batch_size: maximum number of rows per dataframe.
+    :type batch_size: int.
+    :param sheet_name: name of the sheet to read. Defaults to the first sheet.
+    :type sheet_name: str.
+    :return: generator of dataframes sharing the header of the sheet's first row.
+    :rtype: generator of DataFrame.
+    """
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        if sheet_name:
+            sh = wb[sheet_name]
+        else:
+            sh = wb.worksheets[0]
+        rows = sh.iter_rows(values_only=True)
+
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [name if name is not None else 'Unnamed: ' + str(i) for i, name in enumerate(header)]
+
+        # Blank rows are skipped without ending the batch, so only the end of the sheet stops the reader.
+        batch = []
+        for row in rows:
+            if any(val is not None for val in row):
+                batch.append(row)
+                if len(batch) == batch_size:
+                    yield pd.DataFrame(data=batch, columns=columns)
+                    batch = []
+        if len(batch) > 0:
+            yield pd.DataFrame(data=batch, columns=columns)
+    finally:
+        wb.close()
+
+
+def xlsx_cache_path(file_path, cache_dir):
+    """
+    Generate the filepath of the cached columnar copy of a .xlsx file.
+
+    The name includes a hash of the file's absolute path, size, and modification time, so edited workbooks are
+    converted again.
+
+    :param file_path: filepath to the .xlsx file.
+    :type file_path: str.
+    :param cache_dir: directory holding the cached files.
+    :type cache_dir: str.
+    :return:
+    :rtype: str.
+    """
+    file_path = os.path.abspath(file_path)
+    stat = os.stat(file_path)
+    key = '|'.join((file_path, str(stat.st_size), str(stat.st_mtime)))
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(cache_dir, '.'.join((name, digest, 'parquet')))
+
+
+def read_xlsx(file_path, batch_size=10000, sheet_name=None, cache_dir=None):
+    """
+    Generate a dataframe from a .xlsx file by streaming its rows in batches.
+
+    If `cache_dir` is passed, the workbook is converted once into a .parquet file in that directory and later calls
+    read the cached copy instead of parsing the workbook again.
+
+    :param file_path: filepath to the .xlsx file.
+    :type file_path: str.
+    :param batch_size: number of rows read from the workbook at once.
+    :type batch_size: int.
+    :param sheet_name: name of the sheet to read. Defaults to the first sheet.
+    :type sheet_name: str.
+    :param cache_dir: directory for the cached columnar copy.
+    :type cache_dir: str.
+    :return:
+    :rtype: DataFrame.
+    """
+    cache_path = None
+    if cache_dir:
+        cache_path = xlsx_cache_path(file_path, cache_dir)
+        if os.path.exists(cache_path):
+            return pd.read_parquet(cache_path)
+
+    batches = list(iter_xlsx(file_path, batch_size, sheet_name))
+    if len(batches) > 0:
+        df = pd.concat(batches, ignore_index=True).infer_objects()
+    else:
+        df = pd.DataFrame()
+
+    if cache_path:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            df.to_parquet(cache_path, index=False)
+        except (ValueError, TypeError) as error:
+            # Columns mixing types (e.g. numbers and text) cannot be stored as parquet.
+            print('Unable to cache ' + file_path + '.')
+            print(error)
+            if os.path.exists(cache_path):
+                os.remove(cache_path)
+
+    return df
@@ -1,5 +1,6 @@
 import psycopg2 as psy
 from configparser import ConfigParser
+from IaaGeoDataCleaning.ConnectionUtils.GeocodeCache import GeocodeCache
 
 from tkinter import Tk, filedialog
 
@@ -7,6 +8,8 @@ from tkinter import Tk, filedialog
 class DatabaseConnector:
     def __init__(self):
         self.connection = None
+        # Server-side prepared statements belong to the connection, so every Table using it shares this record of them.
+        self.prepared = dict()
 
     def __set_config(self, file_path, section='postgresql'):
         """
@@ -102,6 +105,17 @@ class DatabaseConnector:
                 print('Connection closed.')
                 self.connection = None
 
+    def geocode_cache(self, table_name='geocode_cache'):
+        """
+        Get the geocode cache table shared by every worker using this database, creating it if needed.
+
+        :param table_name:
+        :return:
+        """
+        cache = GeocodeCache(self, table_name)
+        cache.create()
+        return cache
+
     def get_connection(self):
         return self.connection
 
@@ -0,0 +1,140 @@
+import re
+import unicodedata
+import psycopg2 as psy
+from psycopg2 import sql
+from psycopg2.extras import Json, execute_values
+
+
+def normalize_key(text):
+    """
+    Normalize a location or country name for use in a cache key: unicode normalized, case folded, with punctuation
+    and repeated whitespace removed.
+
+    :param text:
+    :return:
+    """
+    if text is None:
+        return ''
+    text = unicodedata.normalize('NFKC', str(text)).casefold()
+    text = re.sub(r'[^\w\s]', ' ', text)
+    return ' '.join(text.split())
+
+
+class GeocodeCache:
+    """
+    Geocoding results stored in a database table, so that every worker using the same database shares them. Entries
+    are keyed by the normalized (location, country) pair and keep the provider, the full provider result, and when
+    they were first and last stored. Locations the provider could not find are stored with no coordinates.
+    """
+    def __init__(self, databaseConnector, table_name='geocode_cache'):
+        self.table_name = table_name
+        self.connector = databaseConnector
+
+    def create(self):
+        """
+        Create the cache table if it does not exist yet.
+
+        :return:
+        """
+        command = sql.SQL("CREATE TABLE IF NOT EXISTS {} (location_key text NOT NULL, country_key text NOT NULL, "
+                          "location text, country text, latitude double precision, longitude double precision, "
+                          "address text, provider text, result jsonb, created_at timestamptz NOT NULL DEFAULT now(), "
+                          "updated_at timestamptz NOT NULL DEFAULT now(), PRIMARY KEY (location_key, country_key));").format(
+            self.__table())
+        try:
+            cur = self.connector.connection.cursor()
+            cur.execute(command)
+            cur.close()
+            self.connector.connection.commit()
+        except (Exception, psy.DatabaseError) as error:
+            self.connector.connection.rollback()
+            print("Unable to create geocode cache table.")
+            print(error)
+
+    def lookup(self, keys, provider=None, max_age=None):
+        """
+        Look up the stored results of the given (location, country) pairs in one query.
+
+        :param keys: (location, country) pairs.
+        :type keys: iterable of tuple of (str, str).
+        :param provider: if passed, only results from this provider are returned.
+        :param max_age: if passed, results last stored longer ago than this are ignored.
+        :type max_age: datetime.timedelta.
+        :return: dictionary mapping every passed pair that has a stored result to a dictionary with the latitude,
+                 longitude, address, provider, result, and updated_at of the entry.
+        :rtype: dict of {tuple: dict}.
+        """
+        keys = list(set(keys))
+        normalized = dict()
+        for key in keys:
+            normalized.setdefault((normalize_key(key[0]), normalize_key(key[1])), []).append(key)
+
+        found = dict()
+        if len(normalized) == 0:
+            return found
+
+        conditions = [sql.SQL("")]
+        params = [[key[0] for key in normalized], [key[1] for key in normalized]]
+        if provider is not None:
+            conditions.append(sql.SQL(" AND c.provider = %s"))
+            params.append(provider)
+        if max_age is not None:
+            conditions.append(sql.SQL(" AND c.updated_at >= now() - %s"))
+            params.append(max_age)
+        command = sql.SQL("SELECT c.location_key, c.country_key, c.latitude, c.longitude, c.address, c.provider, "
+                          "c.result, c.updated_at FROM {} AS c JOIN unnest(%s::text[], %s::text[]) AS k(location_key, "
+                          "country_key) ON c.location_key = k.location_key AND c.country_key = k.country_key{};").format(
+            self.__table(), sql.Composed(conditions))
+        try:
+            cur = self.connector.connection.cursor()
+            cur.execute(command, params)
+            for row in cur.fetchall():
+                entry = {'latitude': row[2], 'longitude': row[3], 'address': row[4], 'provider': row[5],
+                         'result': row[6], 'updated_at': row[7]}
+                for key in normalized[(row[0], row[1])]:
+                    found[key] = entry
+            cur.close()
+        except (Exception, psy.DatabaseError) as error:
+            self.connector.connection.rollback()
+            print("Failed to read geocode cache.")
+            print(error)
+        return found
+
+    def store(self, entries, provider, page_size=1000):
+        """
+        Insert or refresh the results of the given (location, country) pairs, page_size entries per statement.
+
+        :param entries: dictionary mapping (location, country) pairs to a dictionary with their latitude, longitude,
+                        address, and result, or to None if the provider could not find them.
+        :type entries: dict of {tuple: dict}.
+        :param provider: name of the geocoding provider.
+        :param page_size:
+        :return:
+        """
+        rows = dict()
+        for key, entry in entries.items():
+            entry = entry or {}
+            result = entry.get('result')
+            rows[(normalize_key(key[0]), normalize_key(key[1]))] = (
+                normalize_key(key[0]), normalize_key(key[1]), key[0], key[1], entry.get('latitude'),
+                entry.get('longitude'), entry.get('address'), provider, Json(result) if result is not None else None)
+        if len(rows) == 0:
+            return
+
+        command = sql.SQL("INSERT INTO {} (location_key, country_key, location, country, latitude, longitude, address, "
+                          "provider, result) VALUES %s ON CONFLICT (location_key, country_key) DO UPDATE SET "
+                          "location = EXCLUDED.location, country = EXCLUDED.country, latitude = EXCLUDED.latitude, "
+                          "longitude = EXCLUDED.longitude, address = EXCLUDED.address, provider = EXCLUDED.provider, "
+                          "result = EXCLUDED.result, updated_at = now();").format(self.__table())
+        try:
+            cur = self.connector.connection.cursor()
+            execute_values(cur, command.as_string(self.connector.connection), list(rows.values()), page_size=page_size)
+            cur.close()
+            self.connector.connection.commit()
+        except (Exception, psy.DatabaseError) as error:
+            self.connector.connection.rollback()
+            print("Failed to write geocode cache.")
+            print(error)
+
+    def __table(self):
+        return sql.Identifier(*[name.lower() for name in self.table_name.split('.')])
@@ -0,0 +1,73 @@
+import sqlite3
+import math
+
+
+def haversine(lat0, lng0, lat1, lng1):
+    """
+    Calculate the distance between two geographical points using the haversine formula (in meters).
+
+    Registered on every SQLiteConnector connection as the SQL function ``haversine``.
+
+    :param lat0:
+    :param lng0:
+    :param lat1:
+    :param lng1:
+    :return: the distance in meters, or None if any coordinate is missing.
+    """
+    if lat0 is None or lng0 is None or lat1 is None or lng1 is None:
+        return None
+    rlat0 = math.radians(float(lat0))
+    rlat1 = math.radians(float(lat1))
+    dlat = rlat1 - rlat0
+    dlng = math.radians(float(lng1) - float(lng0))
+
+    a = math.pow(math.sin(dlat / 2), 2) + math.cos(rlat0) * math.cos(rlat1) * math.pow(math.sin(dlng / 2), 2)
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    return 6371000 * c
+
+
+class SQLiteConnector:
+    """
+    Embedded counterpart to :class:`DatabaseConnector` that keeps the data in a local SQLite file, for use with
+    :class:`SQLiteTable`.
+    """
+    def __init__(self):
+        self.connection = None
+
+    def connect_to_file(self, file_path=':memory:'):
+        """
+        Open a SQLite database, creating it if it does not exist.
+
+        :param file_path: filepath to the database file. Defaults to an in-memory database.
+        :return:
+        """
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+        try:
+            self.connection = sqlite3.connect(file_path)
+            self.connection.create_function('haversine', 4, haversine)
+
+            cur = self.connection.cursor()
+            cur.execute("CREATE VIRTUAL TABLE temp.iaa_rtree_check USING rtree(id, min_x, max_x);")
+            cur.execute("DROP TABLE temp.iaa_rtree_check;")
+            cur.close()
+
+            return self.connection
+        except (Exception, sqlite3.DatabaseError) as error:
+            print('Unable to open SQLite database with R*Tree support.')
+            print(error)
+            if self.connection is not None:
+                self.connection.close()
+                print('Connection closed.')
+                self.connection = None
+
+    def get_connection(self):
+        return self.connection
+
+    def close_connection(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+            print("Connection closed.")
@@ -0,0 +1,413 @@
+import sqlite3
+import csv
+import math
+import pandas as pd
+import numpy as np
+from os import path
+
+from tkinter import Tk, filedialog
+
+from IaaGeoDataCleaning.CleaningUtils.xlsx_reader import iter_xlsx, read_xlsx
+
+
+class SQLiteTable:
+    """
+    Embedded counterpart to :class:`Table` backed by a :class:`SQLiteConnector`. It offers the same lookup and
+    maintenance methods, but runs in-process, and radius searches go through an R*Tree index instead of PostGIS.
+
+    Column names are folded to lower case, as they are for tables created through :class:`Table`.
+
+    :param tableName:
+    :param databaseConnector: a connected SQLiteConnector.
+    """
+    def __init__(self, tableName, databaseConnector):
+        self.table_name = tableName
+        self.connector = databaseConnector
+
+        if databaseConnector.connection is None:
+            print("Your connection does not exist. Please open a connection using the SQLiteConnector and try again.")
+
+    def __ident(self, name):
+        """
+        Quote a name for use in queries.
+
+        :param name:
+        :return:
+        """
+        return '"' + str(name).lower().replace('"', '""') + '"'
+
+    def __rtree_name(self, geomcol_name):
+        return self.table_name + '_' + geomcol_name + '_rtree'
+
+    def __to_db_values(self, vals_arr):
+        """
+        Convert values to types sqlite3 can bind, with missing values as NULL.
+
+        :param vals_arr:
+        :return:
+        """
+        vals = []
+        for val in vals_arr:
+            if val is None or (not isinstance(val, str) and np.ndim(val) == 0 and pd.isnull(val)):
+                vals.append(None)
+            elif isinstance(val, np.generic):
+                vals.append(val.item())
+            elif isinstance(val, pd.Timestamp):
+                vals.append(val.isoformat())
+            else:
+                vals.append(val)
+        return vals
+
+    def __read_batches(self, file_path, batch_size=10000):
+        if file_path.endswith('xlsx'):
+            return iter_xlsx(file_path, batch_size)
+        return pd.read_csv(file_path, chunksize=batch_size)
+
+    def table_from_file(self, file_path=False, chunk_size=10000, cache_dir=None):
+        """
+        Create a table in the database from a .xlsx or .csv file.
+
+        :param file_path:
+        :param chunk_size: number of rows inserted per statement batch.
+        :param cache_dir: directory for a cached columnar copy of .xlsx files.
+        :return:
+        """
+        if file_path is False or file_path == '':
+            Tk().withdraw()
+            file_path = filedialog.askopenfilename(title='Please select a .csv or .xlsx file')
+
+        if file_path.endswith('xlsx'):
+            tableFile = read_xlsx(file_path, cache_dir=cache_dir)
+        elif file_path.endswith('csv') or file_path.endswith('csv.gz'):
+            tableFile = pd.read_csv(file_path)
+        else:
+            print('This tool currently only supports .csv and .xlsx files.')
+            return
+
+        types = []
+        for name in tableFile.columns:
+            if pd.api.types.is_bool_dtype(tableFile[name]) or pd.api.types.is_integer_dtype(tableFile[name]):
+                types.append('INTEGER')
+            elif pd.api.types.is_float_dtype(tableFile[name]):
+                types.append('REAL')
+            else:
+                types.append('TEXT')
+        schema = ', '.join(self.__ident(tableFile.columns[i]) + ' ' + types[i] for i in range(len(types)))
+
+        try:
+            print("Creating table.")
+            cur = self.connector.connection.cursor()
+            cur.execute("CREATE TABLE " + self.__ident(self.table_name) + " (" + schema + ");")
+            insert = "INSERT INTO " + self.__ident(self.table_name) + " VALUES (" + \
+                     ", ".join(["?"] * len(tableFile.columns)) + ");"
+            for start in range(0, len(tableFile), chunk_size):
+                chunk = tableFile.iloc[start:start + chunk_size]
+                cur.executemany(insert, [self.__to_db_values(row) for row in chunk.itertuples(index=False, name=None)])
+            cur.close()
+            self.connector.connection.commit()
+        except (Exception, sqlite3.DatabaseError) as error:
+            self.connector.connection.rollback()
+            print("Building table failed.")
+            print(error)
+
+    def __key_column(self, cur):
+        """
+        Return the name of the table's INTEGER PRIMARY KEY column, adding an iaa_id column if it has none. Such a
+        column is an alias for the rowid whose values VACUUM keeps, unlike the implicit rowid. Adding the column
+        rebuilds the table, keeping the current rowids as the keys.
+
+        :param cur:
+        :return:
+        """
+        table = self.__ident(self.table_name)
+        cur.execute("PRAGMA table_info(" + table + ");")
+        cols = cur.fetchall()
+        keys = [col for col in cols if col[5] > 0]
+        if len(keys) == 1 and keys[0][2].upper() == 'INTEGER':
+            return keys[0][1]
+
+        key = 'iaa_id'
+        names = ", ".join(self.__ident(col[1]) for col in cols)
+        defs = ", ".join(self.__ident(col[1]) + " " + col[2] + (" NOT NULL" if col[3] else "") +
+                         ("" if col[4] is None else " DEFAULT " + col[4]) for col in cols)
+        rebuilt = self.__ident(self.table_name + '_iaa_rebuild')
+        cur.execute("CREATE TABLE " + rebuilt + " (" + defs + ", " + self.__ident(key) + " INTEGER PRIMARY KEY);")
+        cur.execute("INSERT INTO " + rebuilt + " (" + names + ", " + self.__ident(key) + ") SELECT " + names +
+                    ", rowid FROM " + table + ";")
+        cur.execute("DROP TABLE " + table + ";")
+        cur.execute("ALTER TABLE " + rebuilt + " RENAME TO " + table + ";")
+        return key
+
+    def make_spatial(self, lngcol_name='Longitude', latcol_name='Latitude', geomcol_name='geom'):
+        """
+        Index the table's coordinates in an R*Tree keyed on the table's INTEGER PRIMARY KEY column, which is added as
+        iaa_id if the table has none. Triggers keep the index in sync with later inserts, updates, and deletes.
+
+        :return:
+        """
+        table = self.__ident(self.table_name)
+        rtree = self.__ident(self.__rtree_name(geomcol_name))
+        lat = self.__ident(latcol_name)
+        lng = self.__ident(lngcol_name)
+        trigger = self.__rtree_name(geomcol_name)
+
+        try:
+            print("Adding spatial index to table.")
+            cur = self.connector.connection.cursor()
+            if not self.connector.connection.in_transaction:
+                cur.execute("BEGIN;")
+            key = self.__ident(self.__key_column(cur))
+            cur.execute("CREATE TABLE IF NOT EXISTS iaa_spatial_columns (table_name TEXT, geom_name TEXT, lng_col TEXT, "
+                        "lat_col TEXT, PRIMARY KEY (table_name, geom_name));")
+            cur.execute("INSERT OR REPLACE INTO iaa_spatial_columns VALUES (?, ?, ?, ?);",
+                        (self.table_name, geomcol_name, lngcol_name.lower(), latcol_name.lower()))
+            cur.execute("CREATE VIRTUAL TABLE " + rtree + " USING rtree(id, min_lat, max_lat, min_lng, max_lng);")
+            cur.execute("INSERT INTO " + rtree + " SELECT " + key + ", " + lat + ", " + lat + ", " + lng + ", " + lng +
+                        " FROM " + table + " WHERE " + lat + " IS NOT NULL AND " + lng + " IS NOT NULL;")
+            cur.execute("CREATE TRIGGER " + self.__ident(trigger + '_insert') + " AFTER INSERT ON " + table +
+                        " WHEN NEW." + lat + " IS NOT NULL AND NEW." + lng + " IS NOT NULL BEGIN INSERT INTO " + rtree +
+                        " VALUES (NEW." + key + ", NEW." + lat + ", NEW." + lat + ", NEW." + lng + ", NEW." + lng + "); END;")
+            cur.execute("CREATE TRIGGER " + self.__ident(trigger + '_update') + " AFTER UPDATE OF " + lat + ", " + lng +
+                        ", " + key + " ON " + table + " BEGIN DELETE FROM " + rtree + " WHERE id = OLD." + key +
+                        "; INSERT INTO " + rtree + " SELECT NEW." + key + ", NEW." + lat + ", NEW." + lat + ", NEW." +
+                        lng + ", NEW." + lng + " WHERE NEW." + lat + " IS NOT NULL AND NEW." + lng + " IS NOT NULL; END;")
+            cur.execute("CREATE TRIGGER " + self.__ident(trigger + '_delete') + " AFTER DELETE ON " + table +
+                        " BEGIN DELETE FROM " + rtree + " WHERE id = OLD." + key + "; END;")
+            cur.close()
+            self.connector.connection.commit()
+        except (Exception, sqlite3.DatabaseError) as error:
+            self.connector.connection.rollback()
+            print("Unable to alter table.")
+            print(error)
+
+    def __spatial_columns(self, geomcol_name='geom'):
+        """
+        Return the (longitude, latitude) column names indexed under geomcol_name, or None if the table is not spatial.
+
+        :param geomcol_name:
+        :return:
+        """
+        cur = self.connector.connection.cursor()
+        cur.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'iaa_spatial_columns';")
+        if cur.fetchone() is None:
+            cur.close()
+            return None
+        cur.execute("SELECT lng_col, lat_col FROM iaa_spatial_columns WHERE table_name = ? AND geom_name = ?;",
+                    (self.table_name, geomcol_name))
+        cols = cur.fetchone()
+        cur.close()
+        return cols
+
+    def is_spatial(self, geomcol_name='geom'):
+        """
+        Check if the given table is spatial.
+
+        :return:
+        """
+        return self.__spatial_columns(geomcol_name) is not None
+
+    def check_by_latlng(self, lat, lon, search_radius=300000, geomcol_name='geom'):
+        """
+        Check if an entry exists within search_radius meters of the given lat, lon. If so, return all rows that
+        match in a tuple where the first value is True or False for whether an entry exist, and the second value
+        is the rows.
+
+        Candidates are found with a bounding box query on the R*Tree and then filtered by great-circle distance.
+
+        :param lat:
+        :param lon:
+        :param search_radius: radius in meters.
+        :return:
+        """
+        found = False
+        rows = []
+        try:
+            cols = self.__spatial_columns(geomcol_name)
+            if cols is None:
+                print("Table is not spatial. Call make_spatial() first.")
+                return found, rows
+
+            lat = float(lat)
+            lon = float(lon)
+            dlat = math.degrees(search_radius / 6371000.0)
+            min_lat = max(lat - dlat, -90.0)
+            max_lat = min(lat + dlat, 90.0)
+            if min_lat <= -90.0 or max_lat >= 90.0:
+                # The search circle contains a pole.
+                lng_ranges = [(-180.0, 180.0)]
+            else:
+                dlng = math.degrees(math.asin(min(1.0, math.sin(math.radians(dlat)) / math.cos(math.radians(lat)))))
+                lng_ranges = [(lon - dlng, lon + dlng)]
+                # Split boxes that cross the antimeridian.
+                if lon - dlng < -180.0:
+                    lng_ranges = [(-180.0, lon + dlng), (lon - dlng + 360.0, 180.0)]
+                elif lon + dlng > 180.0:
+                    lng_ranges = [(lon - dlng, 180.0), (-180.0, lon + dlng - 360.0)]
+
+            command = "SELECT t.* FROM " + self.__ident(self.table_name) + " AS t JOIN " + \
+                      self.__ident(self.__rtree_name(geomcol_name)) + " AS r ON t.rowid = r.id WHERE r.max_lat >= ? " \
+                      "AND r.min_lat <= ? AND r.max_lng >= ? AND r.min_lng <= ? AND haversine(?, ?, t." + \
+                      self.__ident(cols[1]) + ", t." + self.__ident(cols[0]) + ") <= ?;"
+            cur = self.connector.connection.cursor()
+            for (min_lng, max_lng) in lng_ranges:
+                cur.execute(command, (min_lat, max_lat, min_lng, max_lng, lat, lon, search_radius))
+                rows.extend(cur.fetchall())
+            cur.close()
+
+            if len(rows) > 0:
+                print("Found")
+                found = True
+            else:
+                print("No matching entries found.")
+        except (Exception, sqlite3.DatabaseError) as error:
+            print("Failed to get entry.")
+            print(error)
+
+        return found, rows
+
+    def check_by_countryloc(self, country_name, location_name, countrycol_name='country', locationcol_name='location'):
+        """
+        Check if an entry exists with the given country and location. If so, return all rows that match in a
+        tuple where the first value is True or False for whether an entry exist, and the second value is the the rows.
+
+        :param country_name:
+        :param location_name:
+        :return:
+        """
+        try:
+            cur = self.connector.connection.cursor()
+            cur.execute("SELECT * FROM " + self.__ident(self.table_name) + " WHERE " + self.__ident(countrycol_name) +
+                        " = ? AND " + self.__ident(locationcol_name) + " = ?;", (country_name, location_name))
+            rows = cur.fetchall()
+            cur.close()
+            if len(rows) > 0:
+                return True, rows
+            else:
+                print("No matching entries found.")
+                return False, rows
+        except (Exception, sqlite3.DatabaseError) as error:
+            print("Failed to get entries.")
+            print(error)
+
+    def change_table(self, new_table):
+        """
+        Switch to a different table without creating a new SQLiteConnector.
+
+        :param new_table:
+        :return:
+        """
+        print("Active table is now " + new_table)
+        self.table_name = new_table
+
+    def update_entries(self, lngcol_name='longitude', latcol_name='latitude', countrycol_name='country', locationcol_name='location', file_path=False, batch_size=10000):
+        """
+        Insert or update entries from a .csv or .xlsx file. The file is streamed in batches of batch_size rows and
+        each batch is written in its own transaction. Every row runs under a savepoint, so a failing row is rolled
+        back and reported without losing the rest of its batch.
+
+        :param file_path:
+        :param batch_size: number of rows per transaction.
+        :return: the rejected rows with the database error in an 'Error' column.
+        :rtype: DataFrame.
+        """
+        if file_path is False or file_path == '':
+            Tk().withdraw()
+            file_path = filedialog.askopenfilename(title='Please select a file')
+
+        if not (file_path.endswith('xlsx') or file_path.endswith('csv')):
+            print('This tool currently only supports .csv and .xlsx files.')
+            return
+
+        table = self.__ident(self.table_name)
+        country = self.__ident(countrycol_name)
+        location = self.__ident(locationcol_name)
+        update_cmmnd = "UPDATE " + table + " SET " + self.__ident(latcol_name) + " = ?, " + self.__ident(lngcol_name) + \
+                       " = ? WHERE " + country + " = ? AND " + location + " = ?;"
+        rejected = []
+        try:
+            cur = self.connector.connection.cursor()
+            cur.execute("CREATE INDEX IF NOT EXISTS " + self.__ident(self.table_name + '_countryloc_idx') + " ON " +
+                        table + " (" + country + ", " + location + ");")
+            for batch in self.__read_batches(file_path, batch_size):
+                # An explicit transaction keeps the row savepoints from committing one by one.
+                if not self.connector.connection.in_transaction:
+                    cur.execute("BEGIN;")
+                insert_cmmnd = "INSERT INTO " + table + " (" + ", ".join(self.__ident(col) for col in batch.columns) + \
+                               ") VALUES (" + ", ".join(["?"] * len(batch.columns)) + ");"
+                for (index, row) in batch.iterrows():
+                    cur.execute("SAVEPOINT update_entry;")
+                    try:
+                        cur.execute("SELECT 1 FROM " + table + " WHERE " + country + " = ? AND " + location + " = ? LIMIT 1;",
+                                    self.__to_db_values([row[countrycol_name], row[locationcol_name]]))
+                        if cur.fetchone() is None:
+                            cur.execute(insert_cmmnd, self.__to_db_values(row.values))
+                        else:
+                            cur.execute(update_cmmnd, self.__to_db_values([row[latcol_name], row[lngcol_name],
+                                                                           row[countrycol_name], row[locationcol_name]]))
+                        cur.execute("RELEASE SAVEPOINT update_entry;")
+                    except sqlite3.DatabaseError as error:
+                        cur.execute("ROLLBACK TO SAVEPOINT update_entry;")
+                        cur.execute("RELEASE SAVEPOINT update_entry;")
+                        row = row.copy()
+                        row['Error'] = str(error).strip()
+                        rejected.append(row)
+                self.connector.connection.commit()
+                print("Committed " + str(len(batch)) + " entries.")
+            cur.close()
+        except (Exception, sqlite3.DatabaseError) as error:
+            self.connector.connection.rollback()
+            print("Updating failed.")
+            print(error)
+
+        if len(rejected) > 0:
+            print(str(len(rejected)) + " entries were rejected.")
+        return pd.DataFrame(rejected)
+
+    def get_table(self, limit=5):
+        """
+        Return a number of rows of the table. If limit=0, return all.
+
+        :param limit:
+        :return:
+        """
+        try:
+            cur = self.connector.connection.cursor()
+            if limit == 0:
+                cur.execute("SELECT * FROM " + self.__ident(self.table_name) + ";")
+            else:
+                cur.execute("SELECT * FROM " + self.__ident(self.table_name) + " LIMIT ?;", (int(limit),))
+            rows = cur.fetchall()
+            cur.close()
+            return rows
+        except (Exception, sqlite3.DatabaseError) as error:
+            print("Fetching table failed.")
+            print(error)
+
+    def table_to_csv(self, file_name, directory=None, fetch_size=10000):
+        """
+        Export the table to a .csv file, fetch_size rows at a time.
+
+        :param file_name: name of the outfile (including the .csv extension).
+        :param directory: outfile directory. Defaults to the package's resources/csv directory.
+        :param fetch_size: number of rows held in memory at once.
+        :return: absolute filepath to the outfile.
+        """
+        if directory is None:
+            directory = path.join(path.dirname(__file__), '..', '..', 'resources', 'csv')
+        file_path = str(path.abspath(path.join(directory, file_name)))
+
+        try:
+            cur = self.connector.connection.cursor()
+            cur.execute("SELECT * FROM " + self.__ident(self.table_name) + ";")
+            with open(file_path, 'w', encoding='utf-8', newline='') as outfile:
+                wr = csv.writer(outfile)
+                wr.writerow([col[0] for col in cur.description])
+                rows = cur.fetchmany(fetch_size)
+                while len(rows) > 0:
+                    wr.writerows(rows)
+                    rows = cur.fetchmany(fetch_size)
+            cur.close()
+            return file_path
+        except (Exception, sqlite3.DatabaseError) as error:
+            print("Exporting table failed.")
+            print(error)
@@ -1,18 +1,53 @@
 import psycopg2 as psy
+from psycopg2 import sql
+from psycopg2.extensions import TRANSACTION_STATUS_INERROR
+from psycopg2.extras import execute_batch
 import pandas as pd
-import xlrd
+import geopandas as gpd
 import csv
+import gzip
+import hashlib
+import io
+import json
+import re
 import numpy as np
-from os import path
+import pyarrow as pa
+import pyarrow.parquet as pq
+from os import path, remove
+from collections import OrderedDict
+from itertools import chain
+from datetime import datetime
 
 from tkinter import Tk, filedialog
 
+from IaaGeoDataCleaning.CleaningUtils.coordinates_validator import check_columns, read_data
+from IaaGeoDataCleaning.CleaningUtils.xlsx_reader import iter_xlsx, read_xlsx
+from IaaGeoDataCleaning.ConnectionUtils.GeocodeCache import GeocodeCache
+
+# Arrow types of the PostgreSQL types (by type OID) exported by table_to_parquet(). Other types are written as text.
+PARQUET_TYPES = {16: pa.bool_(), 17: pa.binary(), 20: pa.int64(), 21: pa.int16(), 23: pa.int32(), 26: pa.int64(),
+                 700: pa.float32(), 701: pa.float64(), 1700: pa.float64(), 1082: pa.date32(),
+                 1083: pa.time64('us'), 1114: pa.timestamp('us'), 1184: pa.timestamp('us', tz='UTC')}
+
+# ISO 8601 dates and times without an offset, the only strings __load_schema() types as timestamps.
+ISO_TIMESTAMP = re.compile(r'^\d{4}-\d{2}-\d{2}([ T]\d{2}:\d{2}(:\d{2}(\.\d{1,6})?)?)?$')
+
 
 class Table:
-    def __init__(self, tableName, databaseConnector):
+    def __init__(self, tableName, databaseConnector, cache_size=0):
+        """
+        :param tableName:
+        :param databaseConnector:
+        :param cache_size: number of lookup results kept in memory. Results are dropped whenever the table is
+                           written to through this Table. 0 disables the cache.
+        """
         self.table_name = tableName
         self.connector = databaseConnector
         self.table = None
+        self.schema_cache = dict()
+        self.cache_size = cache_size
+        self.query_cache = OrderedDict()
+        self.column_cache = dict()
 
         if databaseConnector.connection is None:
             print("Your connection does not exist. Please instantiate a connection using the DatabaseConnector and try again.")
@@ -33,31 +68,51 @@ class Table:
                     cur.execute(command)
                 cur.close()
                 self.connector.connection.commit()
+                self.clear_cache()
         except (Exception, psy.DatabaseError) as error:
             print("Building table failed.")
             print(error)
 
     def xlsx_to_csv(self, file_path):
+        """
+        Convert a .xlsx file to a .csv file next to it, streaming the workbook in batches.
+
+        :param file_path:
+        :return: the converted data.
+        """
         print("Converting .xlsx to .csv")
-        wb = xlrd.open_workbook(file_path)
-        sh = wb.sheet_by_name(wb.sheet_names()[0])
         fileString = file_path[:-5]
         fileString += ".csv"
-        csvfile = open(fileString, 'w', encoding='utf8')
-        wr = csv.writer(csvfile, quoting=csv.QUOTE_ALL)
-
-        for rownum in range(sh.nrows):
-            wr.writerow(sh.row_values(rownum))
+        header = True
+        for batch in iter_xlsx(file_path):
+            batch.to_csv(fileString, mode='w' if header else 'a', header=header, index=False,
+                         quoting=csv.QUOTE_ALL, encoding='utf8')
+            header = False
+        return pd.read_csv(fileString)
+
+    def __read_batches(self, file_path, batch_size=10000):
+        """
+        Stream a .csv or .xlsx file as dataframes of at most batch_size rows.
 
-        csvfile.close()
-        file_path = fileString
-        return pd.read_csv(file_path)
+        :param file_path:
+        :param batch_size:
+        :return:
+        """
+        if file_path.endswith('xlsx'):
+            return iter_xlsx(file_path, batch_size)
+        return pd.read_csv(file_path, chunksize=batch_size)
 
-    def table_from_file(self, file_path=False):
+    def table_from_file(self, file_path=False, chunk_size=None, cache_dir=None, block_size=None, sample_size=1000):
         """
-        Create a table on the database from a .xlsx or .csv file.
+        Create a table on the database from a .xlsx or .csv file. The data is streamed from the client with
+        COPY ... FROM STDIN, so the file does not need to be on the database host.
 
         :param file_path:
+        :param chunk_size: number of rows sent per COPY when loading a .xlsx file.
+        :param block_size: number of bytes read from the file per block when loading a .csv file.
+        :param cache_dir: directory for a cached columnar copy of .xlsx files.
+        :param sample_size: number of rows of a .csv file read to infer the column types. Columns without a value in
+                            them are created as text.
         :return:
         """
         if file_path is False or file_path == '':
@@ -65,84 +120,165 @@ class Table:
             file_path = filedialog.askopenfilename(title='Please select a .csv or .xlsx file')
 
         if file_path.endswith('xlsx'):
-            tableFile = self.xlsx_to_csv(file_path)
-        elif file_path.endswith('csv'):
-            tableFile = pd.read_csv(file_path)
+            tableFile = read_xlsx(file_path, cache_dir=cache_dir)
+        elif file_path.endswith('csv') or file_path.endswith('csv.gz'):
+            # The file itself is streamed to the server, so only a sample is read to infer the column types.
+            tableFile = pd.read_csv(file_path, nrows=sample_size)
         else:
-            print('This tool currently only supports .csv files.')
+            print('This tool currently only supports .csv and .xlsx files.')
             return
 
         print("Constructing query from file.")
-        schemaTuple = self.__load_schema(tableFile)
+        schemaTuple = self.__load_schema(tableFile, sample_size)
         schemaStr = self.__build_schema_string(schemaTuple)
 
         print("Creating table.")
-        schemaStr = "CREATE TABLE " + self.table_name + " " + schemaStr
-        print(schemaStr)
+        schemaStr = sql.SQL("CREATE TABLE {} {}").format(self.__table(), schemaStr)
 
         try:
             cur = self.connector.connection.cursor()
             cur.execute(schemaStr)
-            self.__load_data(cur, file_path)
+            if file_path.endswith('xlsx'):
+                self.__load_data(cur, tableFile, chunk_size=chunk_size)
+            else:
+                self.__load_data(cur, file_path, block_size=block_size)
             cur.close()
             self.connector.connection.commit()
+            self.clear_cache()
         except (Exception, psy.DatabaseError) as error:
+            self.connector.connection.rollback()
             print("Building table failed.")
             print(error)
 
-    def make_spatial(self, lngcol_name='Longitude', latcol_name='Latitude', geomcol_name='geom'):
+    def load_data(self, data, chunk_size=None, block_size=None):
+        """
+        Append data to the existing table by streaming it from the client with COPY ... FROM STDIN.
+
+        :param data: filepath (.csv or .csv.gz extension) or dataframe whose columns are in the table's column order.
+        :type data: str or DataFrame.
+        :param chunk_size: number of rows sent per COPY when loading a dataframe.
+        :type chunk_size: int.
+        :param block_size: number of bytes read from the file per block when loading a file.
+        :type block_size: int.
+        :return:
+        """
+        try:
+            cur = self.connector.connection.cursor()
+            self.__load_data(cur, data, chunk_size, block_size)
+            cur.close()
+            self.connector.connection.commit()
+            self.clear_cache()
+        except (Exception, psy.DatabaseError) as error:
+            self.connector.connection.rollback()
+            print("Failed to load data.")
+            print(error)
+
+    def make_spatial(self, lngcol_name='Longitude', latcol_name='Latitude', geomcol_name='geom', geohashcol_name=None,
+                     geohash_precision=9):
         """
         Add a geometry column and make it spatial.
 
+        :param geohashcol_name: if passed, also add an indexed column with the geohash of every entry's geometry,
+                                kept up to date by the database, for prefix searches with check_by_geohash().
+        :param geohash_precision: number of characters of the geohashes.
         :return:
         """
 
-        addGeom = "ALTER TABLE " + self.table_name + " ADD COLUMN " + geomcol_name + " geometry(POINT, 4326);"
-        updateTable = "UPDATE " + self.table_name + " SET geom = ST_SETSRID(ST_MakePoint(" + lngcol_name + ", " + latcol_name + "), 4326);"
+        addGeom = sql.SQL("ALTER TABLE {} ADD COLUMN {} geometry(POINT, 4326);").format(
+            self.__table(), self.__ident(geomcol_name))
+        updateTable = sql.SQL("UPDATE {} SET {} = ST_SETSRID(ST_MakePoint({}, {}), 4326);").format(
+            self.__table(), self.__ident(geomcol_name), self.__ident(lngcol_name), self.__ident(latcol_name))
+        # The GIST index serves the radius searches, and the one on the geography cast the KNN ordering in nearest().
+        addIndex = sql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} USING GIST ({});").format(
+            self.__ident(self.table_name.split('.')[-1] + '_' + geomcol_name + '_gist'), self.__table(),
+            self.__ident(geomcol_name))
+        addGeogIndex = sql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} USING GIST (({}::geography));").format(
+            self.__ident(self.table_name.split('.')[-1] + '_' + geomcol_name + '_geog_gist'), self.__table(),
+            self.__ident(geomcol_name))
 
         try:
             print("Adding geometry column to table.")
             cur = self.connector.connection.cursor()
             cur.execute(addGeom)
-            cur.close()
-            cur = self.connector.connection.cursor()
             cur.execute(updateTable)
+            cur.execute(addIndex)
+            cur.execute(addGeogIndex)
+            if geohashcol_name:
+                cur.execute(sql.SQL("ALTER TABLE {} ADD COLUMN {} text GENERATED ALWAYS AS (ST_GEOHASH({}, {})) STORED;").format(
+                    self.__table(), self.__ident(geohashcol_name), self.__ident(geomcol_name),
+                    sql.Literal(int(geohash_precision))))
+                # text_pattern_ops lets LIKE 'prefix%' searches use the index.
+                cur.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} ({} text_pattern_ops);").format(
+                    self.__ident(self.table_name.split('.')[-1] + '_' + geohashcol_name + '_idx'), self.__table(),
+                    self.__ident(geohashcol_name)))
+            cur.execute(sql.SQL("ANALYZE {};").format(self.__table()))
             cur.close()
             self.connector.connection.commit()
+            self.clear_cache()
         except (Exception, psy.DatabaseError) as error:
             print("Unable to alter table.")
             print(error)
 
-    def __load_schema(self, table_file):
+    def __load_schema(self, table_file, sample_size=1000):
         """
-        Use the pandas dataframe to generate a list of headers and types.
+        Use the pandas dataframe's column dtypes to generate a list of headers and PostgreSQL types. Object columns
+        are only inspected on a sample of their non-null values, and are typed as timestamps only if every sampled
+        value is a valid ISO 8601 date or time. Columns without any value in the dataframe give no evidence of their
+        type and are typed as text. Schemas are cached per layout (column names and dtypes), so frames of a layout
+        seen before are not inspected again.
 
         :param table_file:
+        :param sample_size: maximum number of values inspected per object column.
         :return:
         """
         names = list(table_file.columns.values)
-        keep_arr = []
-        i = 0
-        for (index, row) in table_file.iterrows():
-            if i == 0:
-                i = i + 1
-                continue
-            elif i == 1:
-                for name in names:
-                    type_str = type(row[name]).__name__.capitalize()
-                    keep_arr.append(type_str)
-                i = i + 1
+        key = tuple((name, str(table_file[name].dtype)) for name in names)
+        if key in self.schema_cache:
+            return names, list(self.schema_cache[key])
+
+        types = []
+        for name in names:
+            col = table_file[name]
+            sample = col.dropna().head(sample_size)
+            if len(sample) == 0:
+                types.append('text')
+            elif pd.api.types.is_bool_dtype(col):
+                types.append('boolean')
+            elif pd.api.types.is_integer_dtype(col):
+                types.append('bigint')
+            elif pd.api.types.is_float_dtype(col):
+                types.append('double precision')
+            elif pd.api.types.is_datetime64_any_dtype(col):
+                types.append('timestamp')
             else:
-                type_arr = []
-                for name in names:
-                    type_str = type(row[name]).__name__.capitalize()
-                    type_arr.append(type_str)
+                kinds = set(self.__value_kind(val) for val in sample)
+                if kinds == {'bool'}:
+                    # Boolean columns with missing values are read in as objects.
+                    types.append('boolean')
+                elif kinds == {'timestamp'}:
+                    types.append('timestamp')
+                else:
+                    types.append('text')
+        self.schema_cache[key] = tuple(types)
+        return names, types
 
-                for i in range(len(keep_arr)):
-                    if keep_arr[i] != type_arr[i]:
-                        keep_arr[i] = "Str"
+    def __value_kind(self, val):
+        """
+        Classify a value of an object column for __load_schema(): 'timestamp' for strings holding a valid ISO 8601
+        date or time, 'str' for other strings, and the type name for anything else.
 
-        return names, keep_arr
+        :param val:
+        :return:
+        """
+        if not isinstance(val, str):
+            return type(val).__name__
+        if ISO_TIMESTAMP.match(val):
+            try:
+                datetime.fromisoformat(val)
+                return 'timestamp'
+            except ValueError:
+                pass
+        return 'str'
 
     def __build_schema_string(self, schema_tuple):
         """
@@ -151,43 +287,42 @@ class Table:
         :param schema_tuple:
         :return:
         """
-        schema_str = """("""
-        for i in range(len(schema_tuple[0])):
-            print(schema_tuple[1][i])
-            if schema_tuple[1][i] == "Int":
-                if not i == len(schema_tuple[0]) - 1:
-                    schema_str += schema_tuple[0][i] + " " + "integer,"
-                else:
-                    schema_str += schema_tuple[0][i] + " " + "integer"
-            elif schema_tuple[1][i] == "Float":
-                if not i == len(schema_tuple[0]) - 1:
-                    schema_str += schema_tuple[0][i] + " " + "numeric,"
-                else:
-                    schema_str += schema_tuple[0][i] + " " + "numeric"
-            else:
-                if not i == len(schema_tuple[0]) - 1:
-                    schema_str += schema_tuple[0][i] + " " + "varchar,"
-                else:
-                    schema_str += schema_tuple[0][i] + " " + "varchar"
-        schema_str += """)"""
-
-        return schema_str
+        cols = [sql.SQL("{} " + schema_tuple[1][i]).format(self.__ident(schema_tuple[0][i]))
+                for i in range(len(schema_tuple[0]))]
+        return sql.SQL("({})").format(sql.SQL(", ").join(cols))
 
-    def __load_data(self, cur, file_path):
+    def __load_data(self, cur, data, chunk_size=None, block_size=None):
         """
-        Load data from a file into an empty table.
+        Load data from a file or dataframe into a table through the client connection.
 
         :param cur:
-        :param file_path:
+        :param data: filepath (.csv or .csv.gz extension) or dataframe.
+        :param chunk_size: number of rows sent per COPY for dataframes.
+        :param block_size: number of bytes read per block for files.
         :return:
         """
-        try:
-            print("Loading data from file.")
-            cur.execute("COPY " + self.table_name + " FROM " + "'" + file_path + "'" + " DELIMITER ',' CSV HEADER")
-            cur.close()
-        except (Exception, psy.DatabaseError) as error:
-            print("Failed to load data.")
-            print(error)
+        print("Loading data.")
+        if isinstance(data, pd.DataFrame):
+            if not chunk_size:
+                chunk_size = len(data)
+            for start in range(0, len(data), max(chunk_size, 1)):
+                buf = io.StringIO()
+                data.iloc[start:start + chunk_size].to_csv(buf, index=False, header=False)
+                buf.seek(0)
+                cur.copy_expert(sql.SQL("COPY {} FROM STDIN WITH CSV").format(self.__table()), buf)
+        else:
+            if data.endswith('.gz'):
+                infile = gzip.open(data, 'rt', encoding='utf-8')
+            else:
+                infile = open(data, 'r', encoding='utf-8')
+            try:
+                command = sql.SQL("COPY {} FROM STDIN WITH CSV HEADER").format(self.__table())
+                if block_size:
+                    cur.copy_expert(command, infile, size=block_size)
+                else:
+                    cur.copy_expert(command, infile)
+            finally:
+                infile.close()
 
     def check_by_latlng(self, lat, lon, search_radius=300000, geomcol_name='geom'):
         """
@@ -203,12 +338,10 @@ class Table:
         try:
             print("Attempting to find entry.")
             if not self.connector.connection is None:
-                cur = self.connector.connection.cursor()
-                command = "SELECT * FROM " + self.table_name + " WHERE ST_DWITHIN(ST_TRANSFORM(ST_GEOMFROMTEXT('POINT(" + str(lon) + " " + str(lat) + ")', 4326),4326)::geography, ST_TRANSFORM(" + geomcol_name + ", 4326)::geography, " + str(search_radius) + ", true);"
-                cur.execute(command)
-                rows = cur.fetchall()
-
-                cur.close()
+                command = sql.SQL("SELECT * FROM {} WHERE ST_DWITHIN(ST_SETSRID(ST_MakePoint(%s, %s), 4326)::geography, "
+                                  "ST_TRANSFORM({}, 4326)::geography, %s, true);").format(
+                    self.__table(), self.__ident(geomcol_name))
+                rows = self.__fetch_rows(command, (float(lon), float(lat), float(search_radius)), prepare=True)
 
                 if len(rows) > 0:
                     print("Found")
@@ -224,6 +357,131 @@ class Table:
 
         return found, rows
 
+    def __nearest_command(self, geomcol_name, max_distance, lateral=False):
+        """
+        Build the KNN query for nearest() and nearest_batch(). Candidates are ordered by the geography <-> operator,
+        which uses the GIST index on the geography cast of the geometry column, and the same value is returned as
+        their distance in meters.
+
+        :param geomcol_name:
+        :param max_distance:
+        :param lateral: build the subquery run per point of the batch form.
+        :return:
+        """
+        if lateral:
+            point = sql.SQL("ST_SETSRID(ST_MakePoint(q.lng, q.lat), 4326)::geography")
+        else:
+            point = sql.SQL("ST_SETSRID(ST_MakePoint(%s, %s), 4326)::geography")
+        where = sql.SQL("")
+        if max_distance is not None:
+            where = sql.SQL(" WHERE ST_DWITHIN(n.{0}::geography, {1}, %s, true)").format(
+                self.__ident(geomcol_name), point)
+        return sql.SQL("SELECT n.*, n.{0}::geography <-> {1} AS distance FROM {2} AS n{3} "
+                       "ORDER BY n.{0}::geography <-> {1} LIMIT %s").format(
+            self.__ident(geomcol_name), point, self.__table(), where)
+
+    def nearest(self, lat, lon, k=1, max_distance=None, geomcol_name='geom'):
+        """
+        Find the k entries closest to the given lat, lon using the spatial index, rather than every entry within a
+        radius as check_by_latlng() does. Entries are ranked by their distance on the globe, which is appended to each
+        returned row in meters. Tables made spatial before the geography index was added to make_spatial() are
+        searched without an index.
+
+        :param lat:
+        :param lon:
+        :param k: maximum number of entries returned.
+        :param max_distance: if passed, only entries within this many meters are returned.
+        :param geomcol_name:
+        :return: rows sorted from nearest to farthest.
+        :rtype: list of tuple.
+        """
+        rows = []
+        try:
+            if not self.connector.connection is None:
+                command = sql.Composed([self.__nearest_command(geomcol_name, max_distance), sql.SQL(";")])
+                point = (float(lon), float(lat))
+                if max_distance is not None:
+                    params = point + point + (float(max_distance),) + point + (int(k),)
+                else:
+                    params = point + point + (int(k),)
+                rows = self.__fetch_rows(command, params, prepare=True)
+            else:
+                print("""No connection open. Did you open a connection using getConnectFromKeywords() 
+                        or getConnectFromConfig()?""")
+        except (Exception, psy.DatabaseError) as error:
+            print("Failed to get entries.")
+            print(error)
+        return rows
+
+    def nearest_batch(self, points, k=1, max_distance=None, geomcol_name='geom', batch_size=1000):
+        """
+        Find the k nearest entries for each of the given (lat, lon) points, sending batch_size points per query.
+
+        :param points: (lat, lon) pairs.
+        :type points: list of tuple of (float, float).
+        :param k: maximum number of entries returned per point.
+        :param max_distance: if passed, only entries within this many meters are returned.
+        :param geomcol_name:
+        :param batch_size: number of points per query.
+        :return: for every passed point, in order, its rows sorted from nearest to farthest as returned by nearest().
+        :rtype: list of list of tuple.
+        """
+        points = [(float(lat), float(lon)) for (lat, lon) in points]
+        found = [[] for _ in points]
+        try:
+            if not self.connector.connection is None:
+                cur = self.connector.connection.cursor()
+                command = sql.SQL("SELECT q.idx, m.* FROM unnest(%s::float8[], %s::float8[]) WITH ORDINALITY "
+                                  "AS q(lat, lng, idx) CROSS JOIN LATERAL ({}) AS m ORDER BY q.idx, m.distance;").format(
+                    self.__nearest_command(geomcol_name, max_distance, lateral=True))
+                for start in range(0, len(points), batch_size):
+                    batch = points[start:start + batch_size]
+                    params = ([point[0] for point in batch], [point[1] for point in batch])
+                    if max_distance is not None:
+                        params += (float(max_distance),)
+                    params += (int(k),)
+                    cur.execute(command, params)
+                    for row in cur.fetchall():
+                        found[start + row[0] - 1].append(row[1:])
+                cur.close()
+            else:
+                print("""No connection open. Did you open a connection using getConnectFromKeywords() 
+                        or getConnectFromConfig()?""")
+        except (Exception, psy.DatabaseError) as error:
+            print("Failed to get entries.")
+            print(error)
+        return found
+
+    def check_by_geohash(self, prefixes, geohashcol_name='geohash'):
+        """
+        Get all entries whose geohash starts with any of the given prefixes, e.g. a cell and its neighbours from
+        geohash.neighbours(). Requires a geohash column added by make_spatial().
+
+        :param prefixes:
+        :type prefixes: str or list of str.
+        :param geohashcol_name:
+        :return:
+        :rtype: list of tuple.
+        """
+        if isinstance(prefixes, str):
+            prefixes = [prefixes]
+        rows = []
+        if len(prefixes) == 0:
+            return rows
+        try:
+            if not self.connector.connection is None:
+                command = sql.SQL("SELECT * FROM {} WHERE {};").format(
+                    self.__table(), sql.SQL(" OR ").join(sql.SQL("{} LIKE %s").format(self.__ident(geohashcol_name))
+                                                          for _ in prefixes))
+                rows = self.__fetch_rows(command, tuple(str(prefix).lower() + '%' for prefix in prefixes))
+            else:
+                print("""No connection open. Did you open a connection using getConnectFromKeywords() 
+                        or getConnectFromConfig()?""")
+        except (Exception, psy.DatabaseError) as error:
+            print("Failed to get entries.")
+            print(error)
+        return rows
+
     def check_by_countryloc(self, country_name, location_name, countrycol_name='country', locationcol_name='location'):
         """
         Check if an entry exists with the given country and location. If so, return all rows that match in a
@@ -236,13 +494,11 @@ class Table:
         try:
             print("Attempting to find entry.")
             if not self.connector.connection is None:
-                cur = self.connector.connection.cursor()
-                command = "SELECT * FROM " + self.table_name + " WHERE " + countrycol_name + " = '" + country_name + "' AND " + locationcol_name + " = '" + location_name + "';"
-                cur.execute(command)
-                rows = cur.fetchall()
+                command = sql.SQL("SELECT * FROM {} WHERE {} = %s AND {} = %s;").format(
+                    self.__table(), self.__ident(countrycol_name), self.__ident(locationcol_name))
+                rows = self.__fetch_rows(command, (country_name, location_name), prepare=True)
                 for row in rows:
                     print(row)
-                cur.close()
                 if len(rows) > 0:
                     return True, rows
                 else:
@@ -255,6 +511,40 @@ class Table:
             print("Failed to get entries.")
             print(error)
 
+    def check_by_countrylocs(self, keys, countrycol_name='country', locationcol_name='location'):
+        """
+        Check which of the given (country, location) pairs already have an entry, using a single query for
+        all of them.
+
+        :param keys: (country, location) pairs.
+        :type keys: list of tuple of (str, str).
+        :param countrycol_name:
+        :param locationcol_name:
+        :return: dictionary mapping every passed pair to True if an entry exists and False if not.
+        :rtype: dict of {tuple: bool}.
+        """
+        keys = [(str(country), str(loc)) for (country, loc) in keys]
+        exists = dict.fromkeys(keys, False)
+        if len(keys) == 0:
+            return exists
+        try:
+            if not self.connector.connection is None:
+                cur = self.connector.connection.cursor()
+                command = sql.SQL("SELECT DISTINCT t.{0}, t.{1} FROM {2} AS t JOIN unnest(%s::text[], %s::text[]) "
+                                  "AS k(country, location) ON t.{0} = k.country AND t.{1} = k.location;").format(
+                    self.__ident(countrycol_name), self.__ident(locationcol_name), self.__table())
+                cur.execute(command, ([key[0] for key in keys], [key[1] for key in keys]))
+                for row in cur.fetchall():
+                    exists[(str(row[0]), str(row[1]))] = True
+                cur.close()
+            else:
+                print("""No connection open. Did you open a connection using getConnectFromKeywords() 
+                        or getConnectFromConfig()?""")
+        except (Exception, psy.DatabaseError) as error:
+            print("Failed to get entries.")
+            print(error)
+        return exists
+
     def change_table(self, new_table):
         """
         Switch to a different table without creating a new DatabaseConnector.
@@ -264,97 +554,265 @@ class Table:
         """
         print("Active table is now " + new_table)
         self.table_name = new_table
+        self.clear_cache()
 
-    def update_entries(self, lngcol_name='longitude', latcol_name='latitude', countrycol_name='country', locationcol_name='location', file_path=False):
+    def update_entries(self, lngcol_name='longitude', latcol_name='latitude', countrycol_name='country', locationcol_name='location', file_path=False, batch_size=10000,
+                       page_size=1000):
         """
-        Insert or update entries from a .csv file.
+        Insert or update entries from a .csv or .xlsx file. The file is streamed in batches of batch_size rows and
+        each batch is written in its own transaction, page_size statements per round trip. If a batch fails, it is
+        rolled back and written again one row at a time under savepoints, so a failing row is reported without losing
+        the rest of its batch.
 
         :param file_path:
-        :return:
+        :param batch_size: number of rows per transaction.
+        :param page_size: number of statements sent to the server at once.
+        :return: the rejected rows with the database error in an 'Error' column.
+        :rtype: DataFrame.
         """
         if file_path is False or file_path == '':
             Tk().withdraw()
             file_path = filedialog.askopenfilename(title='Please select a file')
 
-        if file_path.endswith('xlsx'):
-            tableFile = self.xlsx_to_csv(file_path)
-        elif file_path.endswith('csv'):
-            tableFile = pd.read_csv(file_path)
-        else:
+        if not (file_path.endswith('xlsx') or file_path.endswith('csv')):
             print('This tool currently only supports .csv and .xlsx files.')
             return
+
+        update_cmmnd = sql.SQL("UPDATE {} SET {} = %s, {} = %s, geom = ST_SETSRID(ST_MakePoint(%s, %s), 4326) "
+                               "WHERE {} = %s AND {} = %s;").format(
+            self.__table(), self.__ident(latcol_name), self.__ident(lngcol_name),
+            self.__ident(countrycol_name), self.__ident(locationcol_name)).as_string(self.connector.connection)
+        rejected = []
         try:
-            for (index, row) in tableFile.iterrows():
-                lat = row[latcol_name]
-                long = row[lngcol_name]
-                country_name = row[countrycol_name]
-                loc_name = row[locationcol_name]
-                if not self.check_by_countryloc(country_name, loc_name)[0]:
-                    # Entry does not exist
-                    print("Entry does not exist.")
-                    print("Inserting new entry")
-                    cmnd_arr = []
-                    for item in row.values:
-                        cmnd_arr.append(item)
-                    cmnd = "INSERT INTO " + self.table_name + " VALUES (" + self.__build_insertion_string(cmnd_arr) + " );"
-                    cur = self.connector.connection.cursor()
-                    cur.execute(cmnd)
-                    cur.close()
-                else:
-                    print("Entry exists.")
-                    print("Updating existing entry")
-                    cmmnd = "UPDATE " + self.table_name + " SET " + latcol_name + " = '" + str(lat) + "', " + lngcol_name + " = '" + str(long) + """' WHERE 
-                    """ + countrycol_name + " = '" + country_name + "' AND " + locationcol_name + " = '" + loc_name + "';"
-                    cur = self.connector.connection.cursor()
-                    cur.execute(cmmnd)
-                    cmmnd2 = "UPDATE " + self.table_name + " SET geom = ST_SETSRID(ST_MakePoint(" + lngcol_name + ", " + latcol_name + """), 4326) 
-                    WHERE """ + countrycol_name + " = '" + country_name + "' AND " + locationcol_name + " = '" + loc_name + "';"
-                    cur.execute(cmmnd2)
-                    cur.close()
+            cur = self.connector.connection.cursor()
+            for batch in self.__read_batches(file_path, batch_size):
+                keys = [(str(country), str(loc)) for (country, loc) in zip(batch[countrycol_name], batch[locationcol_name])]
+                exists = self.check_by_countrylocs(keys, countrycol_name, locationcol_name)
+                insert_cmmnd = sql.SQL("INSERT INTO {} VALUES ({});").format(
+                    self.__table(), sql.SQL(", ").join(sql.Placeholder() * len(batch.columns))).as_string(
+                    self.connector.connection)
+
+                # Rows whose key is new are inserted, the rest (including repeats of a new key) update the entry.
+                writes = []
+                for (position, values, key, lat, long, country_name, loc_name) in zip(
+                        range(len(batch)), batch.itertuples(index=False, name=None), keys, batch[latcol_name],
+                        batch[lngcol_name], batch[countrycol_name], batch[locationcol_name]):
+                    if not exists[key]:
+                        writes.append((position, insert_cmmnd, self.__to_db_values(values)))
+                        exists[key] = True
+                    else:
+                        writes.append((position, update_cmmnd,
+                                       self.__to_db_values([lat, long, long, lat, country_name, loc_name])))
+
+                cur.execute("SAVEPOINT update_batch;")
+                try:
+                    execute_batch(cur, insert_cmmnd, [write[2] for write in writes if write[1] is insert_cmmnd],
+                                  page_size=page_size)
+                    execute_batch(cur, update_cmmnd, [write[2] for write in writes if write[1] is update_cmmnd],
+                                  page_size=page_size)
+                    cur.execute("RELEASE SAVEPOINT update_batch;")
+                except psy.DatabaseError:
+                    cur.execute("ROLLBACK TO SAVEPOINT update_batch;")
+                    for (position, command, values) in writes:
+                        cur.execute("SAVEPOINT update_entry;")
+                        try:
+                            cur.execute(command, values)
+                            cur.execute("RELEASE SAVEPOINT update_entry;")
+                        except psy.DatabaseError as error:
+                            cur.execute("ROLLBACK TO SAVEPOINT update_entry;")
+                            row = batch.iloc[position].copy()
+                            row['Error'] = str(error).strip()
+                            rejected.append(row)
+
+                self.connector.connection.commit()
+                print("Committed " + str(len(batch)) + " entries.")
+
+            self.__check_geom_nulls(cur, lngcol_name, latcol_name)
+            cur.close()
             self.connector.connection.commit()
-            self.__check_geom_nulls()
+            self.clear_cache()
         except (Exception, psy.DatabaseError) as error:
+            self.connector.connection.rollback()
             print("Updating failed.")
             print(error)
 
-    def __build_insertion_string(self, vals_arr):
-        vals_str = ''
-        for i in range(len(vals_arr) - 2):
-            if isinstance(vals_arr[i], str):
-                vals_str += "'" + str(vals_arr[i]) + "', "
-            else:
-                if vals_arr[i] is None or pd.isnull(vals_arr[i]) or vals_arr[i] == np.nan:
-                    vals_str += "NULL,"
-                else:
-                    vals_str += str(vals_arr[i]) + ", "
-        if isinstance(vals_arr[len(vals_arr) - 1], str):
-            vals_str += "'" + str(vals_arr[len(vals_arr) - 1]) + "' "
-        else:
-            if vals_arr[len(vals_arr) - 1] is None or pd.isnull(vals_arr[len(vals_arr) - 1]) or vals_arr[len(vals_arr) - 1] == np.nan:
-                vals_str += "NULL"
-            else:
-                vals_str += str(vals_arr[len(vals_str) - 1]) + " "
-        return vals_str
+        if len(rejected) > 0:
+            print(str(len(rejected)) + " entries were rejected.")
+        return pd.DataFrame(rejected)
 
-    def __check_geom_nulls(self, lngcol_name='Longitude', latcol_name='Latitude', geomcol_name='geom'):
+    def sync_entries(self, data, lngcol_name='longitude', latcol_name='latitude', countrycol_name='country',
+                     locationcol_name='location', hashcol_name='row_hash', updatedcol_name='updated_at',
+                     batch_size=10000, page_size=1000):
         """
-        Check for null values in a spatial table and, if they exist, check the lat and lng
-        values to generate geometry.
-
-        :return:
+        Bring the table in line with a local dataset by only writing the entries that are new or changed since the
+        last sync. Every entry's content hash is stored in hashcol_name along with when it last changed in
+        updatedcol_name; the stored hashes of each batch are fetched in one query and compared with the local ones, so
+        unchanged entries are never sent to the database.
+
+        Files are streamed in batches of batch_size rows, and the writes of each batch are sent page_size statements
+        per round trip. If a batch fails, it is rolled back and written again one row at a time under savepoints, as
+        in update_entries().
+
+        :param data: filepath (.csv or .xlsx extension) or dataframe.
+        :type data: str or DataFrame.
+        :param hashcol_name: name of the column holding the content hashes. Created if it does not exist.
+        :param updatedcol_name: name of the column holding the time of the last change. Created if it does not exist.
+        :param batch_size: number of rows compared and written per transaction.
+        :param page_size: number of statements sent to the server at once.
+        :return: the rejected rows with the database error in an 'Error' column.
+        :rtype: DataFrame.
+        :raises TypeError: if the file extension is not .csv or .xlsx.
+        :raises KeyError: if the coordinate, country, or location columns are missing.
         """
+        required = {lngcol_name, latcol_name, countrycol_name, locationcol_name}
+        if isinstance(data, str):
+            if not (data.endswith('.csv') or data.endswith('.xlsx')):
+                raise TypeError('Support is only available for .xlsx and .csv files.')
+            batches = self.__read_batches(data, batch_size)
+        else:
+            df = read_data(data, required)
+            batches = (df.iloc[start:start + batch_size] for start in range(0, len(df), batch_size))
+        first = next(batches, None)
+        if first is None:
+            return pd.DataFrame()
+        check_columns(first, required)
+
+        table_cols = self.get_column_names()
+        skipped = {hashcol_name.lower(), updatedcol_name.lower(), 'geom'}
+        cols = [col for col in first.columns if col.lower() in table_cols and col.lower() not in skipped]
+
+        add_cols = sql.SQL("ALTER TABLE {} ADD COLUMN IF NOT EXISTS {} text, "
+                           "ADD COLUMN IF NOT EXISTS {} timestamptz DEFAULT now();").format(
+            self.__table(), self.__ident(hashcol_name), self.__ident(updatedcol_name))
+        lookup_cmmnd = sql.SQL("SELECT t.{0}, t.{1}, t.{2} FROM {3} AS t JOIN unnest(%s::text[], %s::text[]) "
+                               "AS k(country, location) ON t.{0} = k.country AND t.{1} = k.location;").format(
+            self.__ident(countrycol_name), self.__ident(locationcol_name), self.__ident(hashcol_name), self.__table())
+        insert_cmmnd = sql.SQL("INSERT INTO {} ({}, {}, {}) VALUES ({}, %s, now());").format(
+            self.__table(), sql.SQL(", ").join(self.__ident(col) for col in cols), self.__ident(hashcol_name),
+            self.__ident(updatedcol_name), sql.SQL(", ").join(sql.Placeholder() * len(cols))).as_string(
+            self.connector.connection)
+        assignments = [sql.SQL("{} = %s").format(self.__ident(col)) for col in cols]
+        if self.is_spatial():
+            # Recomputed from the new coordinates by __check_geom_nulls.
+            assignments.append(sql.SQL("geom = NULL"))
+        update_cmmnd = sql.SQL("UPDATE {} SET {}, {} = %s, {} = now() WHERE {} = %s AND {} = %s;").format(
+            self.__table(), sql.SQL(", ").join(assignments), self.__ident(hashcol_name),
+            self.__ident(updatedcol_name), self.__ident(countrycol_name), self.__ident(locationcol_name)).as_string(
+            self.connector.connection)
+
+        total = 0
+        inserted = 0
+        updated = 0
+        rejected = []
         try:
             cur = self.connector.connection.cursor()
-            if self.is_spatial():
-                update_table = "UPDATE " + self.table_name + """ SET """ + geomcol_name + """= ST_SETSRID(ST_MakePoint(""" + lngcol_name + """, 
-                            """ + latcol_name + """), 4326) WHERE """ + geomcol_name + """ IS NULL;"""
-                cur.execute(update_table)
+            cur.execute(add_cols)
+            self.connector.connection.commit()
+            self.clear_cache()
+
+            for batch in chain([first], batches):
+                total += len(batch)
+                keys = [(str(country), str(loc)) for (country, loc) in zip(batch[countrycol_name], batch[locationcol_name])]
+                cur.execute(lookup_cmmnd, ([key[0] for key in keys], [key[1] for key in keys]))
+                stored = dict(((str(row[0]), str(row[1])), row[2]) for row in cur.fetchall())
+
+                # Rows whose key is new are inserted, changed rows (including repeats of a new key) update the entry.
+                writes = []
+                for (position, values, key, row_hash) in zip(range(len(batch)), batch[cols].itertuples(
+                        index=False, name=None), keys, self.__row_hashes(batch[cols])):
+                    if stored.get(key) == row_hash:
+                        continue
+                    if key not in stored:
+                        writes.append((position, insert_cmmnd, self.__to_db_values(values) + [row_hash]))
+                    else:
+                        writes.append((position, update_cmmnd, self.__to_db_values(values) + [row_hash, key[0], key[1]]))
+                    stored[key] = row_hash
+
+                cur.execute("SAVEPOINT sync_batch;")
+                try:
+                    inserts = [write[2] for write in writes if write[1] is insert_cmmnd]
+                    updates = [write[2] for write in writes if write[1] is update_cmmnd]
+                    execute_batch(cur, insert_cmmnd, inserts, page_size=page_size)
+                    execute_batch(cur, update_cmmnd, updates, page_size=page_size)
+                    cur.execute("RELEASE SAVEPOINT sync_batch;")
+                    inserted += len(inserts)
+                    updated += len(updates)
+                except psy.DatabaseError:
+                    cur.execute("ROLLBACK TO SAVEPOINT sync_batch;")
+                    for (position, command, values) in writes:
+                        cur.execute("SAVEPOINT sync_entry;")
+                        try:
+                            cur.execute(command, values)
+                            cur.execute("RELEASE SAVEPOINT sync_entry;")
+                            if command is insert_cmmnd:
+                                inserted += 1
+                            else:
+                                updated += 1
+                        except psy.DatabaseError as error:
+                            cur.execute("ROLLBACK TO SAVEPOINT sync_entry;")
+                            row = batch.iloc[position].copy()
+                            row['Error'] = str(error).strip()
+                            rejected.append(row)
+
+                self.connector.connection.commit()
+
+            self.__check_geom_nulls(cur, lngcol_name, latcol_name)
             cur.close()
             self.connector.connection.commit()
+            self.clear_cache()
+            print("Inserted " + str(inserted) + " and updated " + str(updated) + " of " + str(total) + " entries.")
         except (Exception, psy.DatabaseError) as error:
-            print("Failed to check for nulls.")
+            self.connector.connection.rollback()
+            print("Syncing failed.")
             print(error)
 
+        if len(rejected) > 0:
+            print(str(len(rejected)) + " entries were rejected.")
+        return pd.DataFrame(rejected)
+
+    def __row_hashes(self, frame):
+        """
+        Hash the rows of a dataframe by their values as text, with whole floats written as integers, so that the
+        hashes do not depend on the dtypes pandas infers for each file or batch.
+
+        :param frame:
+        :return:
+        :rtype: Series of str.
+        """
+        text = frame.apply(lambda col: col.map(
+            lambda val: str(int(val)) if isinstance(val, float) and val.is_integer() else str(val)))
+        return pd.util.hash_pandas_object(text, index=False).map('{:016x}'.format)
+
+    def __to_db_values(self, vals_arr):
+        """
+        Convert values to types psycopg2 can adapt, with missing values as NULL.
+
+        :param vals_arr:
+        :return:
+        """
+        vals = []
+        for val in vals_arr:
+            if val is None or (not isinstance(val, str) and np.ndim(val) == 0 and pd.isnull(val)):
+                vals.append(None)
+            elif isinstance(val, np.generic):
+                vals.append(val.item())
+            else:
+                vals.append(val)
+        return vals
+
+    def __check_geom_nulls(self, cur, lngcol_name='Longitude', latcol_name='Latitude', geomcol_name='geom'):
+        """
+        Check for null values in a spatial table and, if they exist, check the lat and lng
+        values to generate geometry. Runs on the caller's cursor and transaction.
+
+        :param cur:
+        :return:
+        """
+        if self.is_spatial(geomcol_name):
+            update_table = sql.SQL("UPDATE {0} SET {1} = ST_SETSRID(ST_MakePoint({2}, {3}), 4326) WHERE {1} IS NULL;").format(
+                self.__table(), self.__ident(geomcol_name), self.__ident(lngcol_name), self.__ident(latcol_name))
+            cur.execute(update_table)
+
     def is_spatial(self, geomcol_name='geom'):
         """
         Check if the given table is spatial.
@@ -362,13 +820,7 @@ class Table:
         :return:
         """
         try:
-            cur = self.connector.connection.cursor()
-            cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name = '" + self.table_name + "' AND column_name = '" + geomcol_name + "';")
-            names = cur.fetchall()
-            cur.close()
-            if len(names) > 0:
-                return True
-            return False
+            return geomcol_name.lower() in self.get_column_names()
         except (Exception, psy.DatabaseError) as error:
             print("Unable to determine if table is spatial.")
             print(error)
@@ -410,22 +862,12 @@ class Table:
                 print("Input column names are invalid.")
                 return False
             else:
-                request_vals = "(SELECT * FROM " + self.table_name + " WHERE "
-                for i in range(len(vals)):
-                    if not i == len(vals) - 1:
-                        request_vals += column_names[i] + "=" + "'" + vals[i] + "' AND "
-                    else:
-                        request_vals += column_names[i] + "=" + "'" + vals[i] + "');"
-                print("Request cmmnd is: " + request_vals)
-                cur = self.connector.connection.cursor()
-                cur.execute(request_vals)
-                try:
-                    rows = cur.fetchall()
-                    cur.close()
-                    print(rows)
-                    return rows
-                except AttributeError:
-                    print("None found")
+                conditions = [sql.SQL("{} = %s").format(self.__ident(name)) for name in column_names]
+                request_vals = sql.SQL("SELECT * FROM {} WHERE {};").format(
+                    self.__table(), sql.SQL(" AND ").join(conditions))
+                rows = self.__fetch_rows(request_vals, tuple(vals))
+                print(rows)
+                return rows
         except (Exception, psy.DatabaseError) as error:
             print("Getting entries failed.")
             print(error)
@@ -441,18 +883,145 @@ class Table:
         if not isinstance(column_names, list):
             print("Names must be passed in as a list of strings.")
         else:
-            cmmnd = "SELECT column_name FROM information_schema.columns WHERE table_name = '" + self.table_name + "';"
-            cur = self.connector.connection.cursor()
-            cur.execute(cmmnd)
-            nameList = list(cur.fetchall())
-            print(nameList)
-            cur.close()
+            nameList = self.get_column_names()
             for name in column_names:
-                print(name)
-                if not (name,) in nameList:
+                if not name.lower() in nameList:
                     return False
         return True
 
+    def get_column_names(self):
+        """
+        Return the names of the table's columns. The list is cached per table until the table is written to
+        through this Table.
+
+        :return:
+        """
+        if self.table_name not in self.column_cache:
+            names = self.table_name.lower().split('.')
+            cur = self.connector.connection.cursor()
+            if len(names) > 1:
+                cur.execute("SELECT column_name FROM information_schema.columns WHERE table_schema = %s AND table_name = %s;",
+                            (names[0], names[-1]))
+            else:
+                cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name = %s;", (names[0],))
+            self.column_cache[self.table_name] = [name[0] for name in cur.fetchall()]
+            cur.close()
+        return self.column_cache[self.table_name]
+
+    def __fetch_rows(self, query, params=None, prepare=False):
+        """
+        Execute a read query and return all of its rows. If the Table was created with a cache_size, results are
+        kept in a least recently used cache until the table is written to.
+
+        :param query:
+        :param params: values bound to the query's placeholders.
+        :param prepare: run the query through a server-side prepared statement.
+        :return:
+        """
+        command = query.as_string(self.connector.connection) if isinstance(query, sql.Composable) else query
+        key = (command, params)
+        if self.cache_size > 0 and key in self.query_cache:
+            self.query_cache.move_to_end(key)
+            return self.query_cache[key]
+
+        cur = self.connector.connection.cursor()
+        if prepare:
+            self.__execute_prepared(cur, command, params)
+        else:
+            cur.execute(command, params)
+        rows = cur.fetchall()
+        cur.close()
+
+        if self.cache_size > 0:
+            self.query_cache[key] = rows
+            if len(self.query_cache) > self.cache_size:
+                self.query_cache.popitem(last=False)
+        return rows
+
+    def __execute_prepared(self, cur, command, params):
+        """
+        Execute a query with %s placeholders through a server-side prepared statement, so that it is parsed and
+        planned once per connection instead of on every call. The statement is prepared on first use by any Table on
+        the connection, and recorded on the connector with the table it reads.
+
+        :param cur:
+        :param command:
+        :param params:
+        :return:
+        """
+        connection = self.connector.connection
+        name = 'iaa_' + hashlib.md5(command.encode('utf-8')).hexdigest()[:16]
+        entry = self.connector.prepared.get(name)
+        if entry is None or entry[0] is not connection or not entry[2]:
+            parts = command.rstrip().rstrip(';').split('%s')
+            statement = parts[0] + ''.join('$' + str(i + 1) + parts[i + 1] for i in range(len(parts) - 1))
+            prepare = "PREPARE " + name + " AS " + statement + ";"
+            if entry is not None and entry[0] is connection:
+                # Left to deallocate by clear_cache() while the transaction had failed.
+                prepare = "DEALLOCATE " + name + "; " + prepare
+            cur.execute(prepare)
+            self.connector.prepared[name] = (connection, self.table_name, True)
+        cur.execute("EXECUTE " + name + " (" + ", ".join(["%s"] * len(params)) + ");", params)
+
+    def __table(self):
+        """
+        Return the active table's name for use in queries.
+
+        :return:
+        """
+        return self.__ident(*self.table_name.split('.'))
+
+    def __ident(self, *names):
+        """
+        Quote a (possibly schema-qualified) name for use in queries. Names are folded to lower case, as PostgreSQL
+        does for unquoted names.
+
+        :param names:
+        :return:
+        """
+        return sql.Identifier(*[str(name).lower() for name in names])
+
+    def clear_cache(self):
+        """
+        Drop all cached lookup results and the cached column names of the active table.
+
+        :return:
+        """
+        self.query_cache.clear()
+        self.column_cache.pop(self.table_name, None)
+
+        # Prepared statements keep the column list of SELECT * from when they were planned, so those of the active
+        # table are dropped for every Table on the connection. PREPARE and DEALLOCATE outlive rollbacks, but cannot run
+        # in a failed transaction, so there they are only marked and deallocated before their next use.
+        connection = self.connector.connection
+        prepared = self.connector.prepared
+        for name in [name for name, entry in prepared.items() if entry[0] is not connection or connection.closed]:
+            del prepared[name]
+        names = [name for name, entry in prepared.items() if entry[1] == self.table_name and entry[2]]
+        if len(names) == 0:
+            return
+        if connection.get_transaction_status() == TRANSACTION_STATUS_INERROR:
+            for name in names:
+                prepared[name] = (connection, self.table_name, False)
+        else:
+            cur = connection.cursor()
+            cur.execute(" ".join("DEALLOCATE " + name + ";" for name in names))
+            cur.close()
+            for name in names:
+                del prepared[name]
+
+    def geocode_cache(self, table_name='geocode_cache'):
+        """
+        Get the geocode cache table in this table's database, creating it if needed. Pass it to geocode_coordinates()
+        to reuse results across runs and workers.
+
+        :param table_name:
+        :return:
+        """
+        cache = GeocodeCache(self.connector, table_name)
+        cache.create()
+        return cache
+
     def get_table(self, limit=5):
         """
         Return a number of rows of the table. If limit=0, return all.
@@ -463,89 +1032,301 @@ class Table:
         try:
             cur = self.connector.connection.cursor()
             if limit == 0:
-                cmmnd = "SELECT * FROM " + self.table_name + ";"
+                cur.execute(sql.SQL("SELECT * FROM {};").format(self.__table()))
             else:
-                cmmnd = "SELECT * FROM " + self.table_name + " LIMIT " + str(limit) + ";"
-            cur.execute(cmmnd)
+                cur.execute(sql.SQL("SELECT * FROM {} LIMIT %s;").format(self.__table()), (int(limit),))
             rows = cur.fetchall()
             return rows
         except (Exception, psy.DatabaseError) as error:
             print("Fetching table failed.")
             print(error)
 
-    def check_validity(self, world_table_name, new_typecol_name='dtype', new_foundcountrycol_name='dbCountry', points_geomcol_name='geom', world_geomcol_name='geom', wolrd_countrycodecol_name='gid_0', points_countrycodecol_name='country_code', world_countrynamecol_name='name_0'):
+    def subdivide_world(self, world_table_name, world_geomcol_name='geom', world_countrycodecol_name='gid_0',
+                        world_countrynamecol_name='name_0', max_vertices=256):
+        """
+        Build a helper table of the world table's polygons split with ST_Subdivide so that no piece has more than
+        max_vertices vertices, and index it with GIST. Each containment test then only touches a small polygon.
+        The helper table is named after the world table with a _subdivided suffix. Its comment records the columns and
+        max_vertices it was built with and a fingerprint of the world table's rows, and it is rebuilt whenever any of
+        them differ.
+
+        :param world_table_name:
+        :param world_geomcol_name:
+        :param world_countrycodecol_name:
+        :param world_countrynamecol_name:
+        :param max_vertices:
+        :return: the name of the helper table.
+        """
+        sub_table_name = world_table_name + "_subdivided"
+        sub_table = self.__ident(*sub_table_name.split('.'))
+        world_table = self.__ident(*world_table_name.split('.'))
+        cur = self.connector.connection.cursor()
+        # Every insert, update, or delete on the world table changes its row count or the sum of its rows' xmin.
+        cur.execute(sql.SQL("SELECT count(*), sum(xmin::text::bigint) FROM {};").format(world_table))
+        (count, xmin_sum) = cur.fetchone()
+        built_from = json.dumps({'geom': world_geomcol_name, 'code': world_countrycodecol_name,
+                                 'name': world_countrynamecol_name, 'max_vertices': int(max_vertices),
+                                 'rows': int(count), 'xmin': str(xmin_sum)}, sort_keys=True)
+        cur.execute("SELECT obj_description(to_regclass(%s), 'pg_class');", (sub_table_name.lower(),))
+        if cur.fetchone()[0] != built_from:
+            print("Subdividing " + world_table_name + ".")
+            cur.execute(sql.SQL("DROP TABLE IF EXISTS {};").format(sub_table))
+            cur.execute(sql.SQL("CREATE TABLE {} AS SELECT {} AS code, {} AS name, ST_Subdivide({}, %s) AS geom FROM {};").format(
+                sub_table, self.__ident(world_countrycodecol_name), self.__ident(world_countrynamecol_name),
+                self.__ident(world_geomcol_name), world_table), (int(max_vertices),))
+            cur.execute(sql.SQL("CREATE INDEX ON {} USING GIST (geom);").format(sub_table))
+            cur.execute(sql.SQL("ANALYZE {};").format(sub_table))
+            cur.execute(sql.SQL("COMMENT ON TABLE {} IS %s;").format(sub_table), (built_from,))
+        cur.close()
+        self.connector.connection.commit()
+        return sub_table_name
+
+    def check_validity(self, world_table_name, new_typecol_name='dtype', new_foundcountrycol_name='dbCountry', points_geomcol_name='geom', world_geomcol_name='geom', wolrd_countrycodecol_name='gid_0', points_countrycodecol_name='country_code', world_countrynamecol_name='name_0',
+                       only_changed=False, new_hashcol_name='dhash', max_vertices=256):
         """
         Validate using data in the database whether the entries in the table
         have the correct country.
 
+        Every point is looked up once against the GIST-indexed, subdivided world polygons (see
+        :meth:`subdivide_world`), and the type and found country columns are written in a single UPDATE. A hash of
+        each entry's geometry and country code is stored alongside, so that with ``only_changed=True`` only entries
+        edited since the last run are revalidated.
+
+        As in :meth:`validate_dataframe`, an entry is 'Invalid' only if its point is in other countries and not in its
+        own, so points on a shared border stay 'Valid'. The found country column holds the entry's own country if the
+        point is in it, and otherwise one of the countries it was found in.
+
         :param world_table_name:
-        :return:
+        :param only_changed: only revalidate entries whose geometry or country code changed since the last run.
+        :param new_hashcol_name: name of the column holding the hash of the last validated geometry and country code.
+        :param max_vertices: maximum number of vertices per subdivided polygon.
+        :return: all entries marked as invalid.
         """
+        sub_table_name = self.subdivide_world(world_table_name, world_geomcol_name, wolrd_countrycodecol_name,
+                                              world_countrynamecol_name, max_vertices)
+        points_geom = self.__ident(points_geomcol_name)
+        points_code = self.__ident(points_countrycodecol_name)
+        points_hash = sql.SQL("md5(coalesce(encode(ST_AsEWKB(p.{}), 'hex'), '') || '|' || coalesce(p.{}::text, ''))").format(
+            points_geom, points_code)
+
         cur = self.connector.connection.cursor()
-        cmmnd1 = "SELECT column_name FROM information_schema.columns WHERE table_name = '" + self.table_name + "' AND column_name = '" + new_typecol_name + "';"
-        cur.execute(cmmnd1)
-        name = cur.fetchall()
+        for col in (new_typecol_name, new_foundcountrycol_name, new_hashcol_name):
+            cur.execute(sql.SQL("ALTER TABLE {} ADD COLUMN IF NOT EXISTS {} varchar;").format(self.__table(), self.__ident(col)))
+
+        print("Validating entries.")
+        cmmnd = sql.SQL("UPDATE {0} AS p SET ({1}, {2}, {3}) = (SELECT CASE WHEN count(*) = 0 OR bool_or(w.code = p.{7}) "
+                        "THEN 'Valid' ELSE 'Invalid' END, coalesce(min(w.name) FILTER (WHERE w.code = p.{7}), min(w.name)), "
+                        "{4} FROM {5} AS w WHERE ST_Intersects(p.{6}, w.geom))").format(
+            self.__table(), self.__ident(new_typecol_name), self.__ident(new_foundcountrycol_name),
+            self.__ident(new_hashcol_name), points_hash, self.__ident(*sub_table_name.split('.')), points_geom, points_code)
+        if only_changed:
+            cmmnd += sql.SQL(" WHERE p.{} IS DISTINCT FROM {}").format(self.__ident(new_hashcol_name), points_hash)
+        cur.execute(cmmnd + sql.SQL(";"))
+        print(str(cur.rowcount) + " entries validated.")
+
+        cur.execute(sql.SQL("SELECT * FROM {} WHERE {} = 'Invalid';").format(self.__table(), self.__ident(new_typecol_name)))
+        rows = cur.fetchall()
         cur.close()
 
-        if len(name) > 0:
-            print("Already validated once. Revalidating.")
-            cur = self.connector.connection.cursor()
-            cmmnd = "UPDATE " + self.table_name + " SET " + new_typecol_name + "='Invalid' FROM " + world_table_name + " WHERE ST_WITHIN(" + self.table_name + "." + points_geomcol_name + ", " + world_table_name + "." + world_geomcol_name + ") AND " + world_table_name + "." + wolrd_countrycodecol_name + "  != " + self.table_name + "." + points_countrycodecol_name + ";"
-            cur.execute(cmmnd)
-            cmmnd = "UPDATE " + self.table_name + " SET " + new_foundcountrycol_name + "=" + world_table_name + "." + world_countrynamecol_name + " FROM " + world_table_name + " WHERE ST_WITHIN(" + self.table_name + "." + points_geomcol_name + ", " + world_table_name + "." + world_geomcol_name + ") AND " + world_table_name + "." + wolrd_countrycodecol_name + "  != " + self.table_name + "." + points_countrycodecol_name + ";"
-            cur.execute(cmmnd)
-            cmmnd = "SELECT * FROM " + self.table_name + ", " + world_table_name + " WHERE ST_WITHIN(" + self.table_name + "." + points_geomcol_name + ", " + world_table_name + "." + world_geomcol_name + ") AND " + world_table_name + "." + wolrd_countrycodecol_name + "  != " + self.table_name + "." + points_countrycodecol_name + ";"
-            cur.execute(cmmnd)
-            rows = cur.fetchall()
-            cur.close()
+        self.connector.connection.commit()
+        self.clear_cache()
+
+        return rows
+
+    def __binary_points(self, row_ids, lats, lngs):
+        """
+        Encode points as a binary COPY payload of (bigint, geometry) tuples, with each geometry as little-endian EWKB
+        in SRID 4326.
+
+        :param row_ids:
+        :param lats:
+        :param lngs:
+        :return:
+        """
+        layout = np.dtype([('nfields', '>i2'), ('id_len', '>i4'), ('id', '>i8'), ('geom_len', '>i4'),
+                           ('byte_order', 'u1'), ('wkb_type', '<u4'), ('srid', '<u4'), ('x', '<f8'), ('y', '<f8')])
+        tuples = np.zeros(len(row_ids), dtype=layout)
+        tuples['nfields'] = 2
+        tuples['id_len'] = 8
+        tuples['id'] = row_ids
+        tuples['geom_len'] = 25
+        tuples['byte_order'] = 1
+        tuples['wkb_type'] = 0x20000001    # Point with an SRID.
+        tuples['srid'] = 4326
+        tuples['x'] = lngs
+        tuples['y'] = lats
+        return b'PGCOPY\n\xff\r\n\x00' + b'\x00' * 8 + tuples.tobytes() + b'\xff\xff'
+
+    def validate_dataframe(self, data, world_table_name, iso3_col='ISO3', lat_col=None, lng_col=None, world_geomcol_name='geom',
+                           world_countrycodecol_name='gid_0', world_countrynamecol_name='name_0',
+                           new_typecol_name='dtype', new_foundcountrycol_name='dbCountry', fetch_size=10000):
+        """
+        Validate a local dataframe against the world table in the database, without exporting it to a file first.
+
+        The coordinates are bulk copied in binary form (WKB points) into a temporary table, each point is matched to
+        the countries containing it with the indexed join used by :meth:`check_validity`, and the matches are
+        streamed back fetch_size rows at a time.
+
+        :param data: filepath (.csv or .xlsx extension) or dataframe.
+        :type data: str, DataFrame, geopandas.GeoDataFrame.
+        :param world_table_name:
+        :param iso3_col: name of the column with the three-letter country code to check against the world table's
+                         codes (GADM's gid_0 by default), such as the ISO3 column added by add_country_code().
+        :param lat_col: name of the latitude column. If it and lng_col are not passed, the point geometries of a
+                        GeoDataFrame are used instead (in their own CRS, which should be EPSG:4326).
+        :param lng_col: name of the longitude column.
+        :param new_typecol_name: name of the verdict column. Entries are 'Invalid' if their point is only in other
+                                 countries, 'Missing' if they have no coordinates, and 'Valid' otherwise, including
+                                 points outside every country, as in :meth:`check_validity`.
+        :param new_foundcountrycol_name: name of the column with the country the point was found in.
+        :param fetch_size: number of matches held in memory at once while streaming them back.
+        :return: a copy of the data with the two verdict columns appended.
+        :rtype: DataFrame or geopandas.GeoDataFrame.
+        """
+        if lat_col is None and lng_col is None and isinstance(data, gpd.GeoDataFrame):
+            df = read_data(data, {iso3_col}).copy()
+            points = df.geometry
+            # .x and .y raise on other geometry types, so only the points are read.
+            is_point = (points.geom_type == 'Point').to_numpy()
+            lats = np.full(len(df), np.nan)
+            lngs = np.full(len(df), np.nan)
+            lats[is_point] = points[is_point].y.to_numpy(dtype='float64')
+            lngs[is_point] = points[is_point].x.to_numpy(dtype='float64')
         else:
-            print("Not validated yet. Generating dtype column.")
+            df = read_data(data, {lat_col, lng_col, iso3_col}).copy()
+            lats = pd.to_numeric(df[lat_col], errors='coerce').to_numpy(dtype='float64')
+            lngs = pd.to_numeric(df[lng_col], errors='coerce').to_numpy(dtype='float64')
+        has_coords = ~(np.isnan(lats) | np.isnan(lngs))
+        row_ids = np.flatnonzero(has_coords)
+
+        df[new_typecol_name] = np.where(has_coords, 'Valid', 'Missing')
+        df[new_foundcountrycol_name] = None
+
+        sub_table_name = self.subdivide_world(world_table_name, world_geomcol_name, world_countrycodecol_name,
+                                              world_countrynamecol_name)
+        points_table = 'iaa_validate_points'
+        try:
             cur = self.connector.connection.cursor()
-            cmmnd = "ALTER TABLE " + self.table_name + " ADD " + new_typecol_name + " varchar;"
-            cur.execute(cmmnd)
-            cmmnd = "ALTER TABLE " + self.table_name + " ADD " + new_foundcountrycol_name + " varchar;"
-            cur.execute(cmmnd)
-            cmmnd = "UPDATE " + self.table_name + " SET " + new_typecol_name + "='Valid'"
-            cur.execute(cmmnd)
-            cmmnd = "UPDATE " + self.table_name + " SET " + new_typecol_name + "='Invalid' FROM " + world_table_name + " WHERE ST_WITHIN(" + self.table_name + "." + points_geomcol_name + ", " + world_table_name + "." + world_geomcol_name + ") AND " + world_table_name + "." + wolrd_countrycodecol_name + "  != " + self.table_name + "." + points_countrycodecol_name + ";"
-            cur.execute(cmmnd)
-            cmmnd = "UPDATE " + self.table_name + " SET " + new_foundcountrycol_name + "=" + world_table_name + "." + world_countrynamecol_name + " FROM " + world_table_name + " WHERE ST_WITHIN(" + self.table_name + "." + points_geomcol_name + ", " + world_table_name + "." + world_geomcol_name + ") AND " + world_table_name + "." + wolrd_countrycodecol_name + "  != " + self.table_name + "." + points_countrycodecol_name + ";"
-            cur.execute(cmmnd)
-            cmmnd = "SELECT * FROM " + self.table_name + ", " + world_table_name + " WHERE ST_WITHIN(" + self.table_name + "." + points_geomcol_name + ", " + world_table_name + "." + world_geomcol_name + ") AND " + world_table_name + "." + wolrd_countrycodecol_name + "  != " + self.table_name + "." + points_countrycodecol_name + ";"
-            cur.execute(cmmnd)
-            rows = cur.fetchall()
+            cur.execute(sql.SQL("CREATE TEMP TABLE {} (row_id bigint, geom geometry(POINT, 4326)) ON COMMIT DROP;").format(
+                sql.Identifier(points_table)))
+            cur.copy_expert(sql.SQL("COPY {} FROM STDIN WITH (FORMAT binary)").format(sql.Identifier(points_table)),
+                            io.BytesIO(self.__binary_points(row_ids, lats[row_ids], lngs[row_ids])))
+            cur.execute(sql.SQL("ANALYZE {};").format(sql.Identifier(points_table)))
             cur.close()
 
-        self.connector.connection.commit()
+            cur = self.connector.connection.cursor(name='iaa_validate_dataframe')
+            cur.itersize = fetch_size
+            cur.execute(sql.SQL("SELECT p.row_id, w.code, w.name FROM {} AS p JOIN {} AS w ON ST_Intersects(p.geom, w.geom);").format(
+                sql.Identifier(points_table), self.__ident(*sub_table_name.split('.'))))
+            found = []
+            rows = cur.fetchmany(fetch_size)
+            while len(rows) > 0:
+                found.append(pd.DataFrame(data=rows, columns=['row_id', 'code', 'name']))
+                rows = cur.fetchmany(fetch_size)
+            cur.close()
+            self.connector.connection.commit()
+        except (Exception, psy.DatabaseError) as error:
+            self.connector.connection.rollback()
+            print("Validating data failed.")
+            print(error)
+            return
 
-        return rows
+        if len(found) > 0:
+            matches = pd.concat(found, ignore_index=True)
+            claimed = df[iso3_col].to_numpy()[matches['row_id'].to_numpy()]
+            matches['valid'] = matches['code'].to_numpy() == claimed
+            # A point on a shared border may match several countries; keep its own country if it is one of them.
+            matches = matches.sort_values('valid', ascending=False).drop_duplicates('row_id')
+            positions = matches['row_id'].to_numpy()
+            df.iloc[positions, df.columns.get_loc(new_foundcountrycol_name)] = matches['name'].to_numpy()
+            df.iloc[positions[~matches['valid'].to_numpy()], df.columns.get_loc(new_typecol_name)] = 'Invalid'
 
-    def table_to_csv(self, file_name):
-        names_list = []
-        vals_list = []
-        cmmnd1 = "SELECT column_name FROM information_schema.columns WHERE table_name = '" + self.table_name + "';"
-        cmmnd2 = "SELECT * FROM " + self.table_name + ";"
+        return df
 
-        cur = self.connector.connection.cursor()
-        cur.execute(cmmnd1)
-        names = cur.fetchall()
-        cur.close()
+    def table_to_csv(self, file_name, directory=None):
+        """
+        Export the table to a .csv file. Rows are streamed from the server with COPY ... TO STDOUT and written
+        straight to disk, so memory use stays flat regardless of the table's size.
 
-        cur = self.connector.connection.cursor()
-        cur.execute(cmmnd2)
-        rows = cur.fetchall()
-        cur.close()
+        :param file_name: name of the outfile (including the .csv extension).
+        :param directory: outfile directory. Defaults to the package's resources/csv directory.
+        :return: absolute filepath to the outfile.
+        """
+        if directory is None:
+            directory = path.join(path.dirname(__file__), '..', '..', 'resources', 'csv')
+        file_path = str(path.abspath(path.join(directory, file_name)))
 
-        for tTuple in names:
-            names_list.append(tTuple[0])
+        try:
+            cur = self.connector.connection.cursor()
+            with open(file_path, 'w', encoding='utf-8', newline='') as outfile:
+                cur.copy_expert(sql.SQL("COPY {} TO STDOUT WITH CSV HEADER").format(self.__table()), outfile)
+            cur.close()
+            return file_path
+        except (Exception, psy.DatabaseError) as error:
+            print("Exporting table failed.")
+            print(error)
 
-        i = 0
-        for row in rows:
-            print(row)
-            vals_list.append(row)
-            i += 1
-        df = pd.DataFrame(data=vals_list, columns=names_list)
-        file_path = str(path.abspath(path.join(path.dirname(__file__), '..', '..', 'resources', 'csv', file_name)))
+    def table_to_parquet(self, file_path, fetch_size=10000):
+        """
+        Export the table to a .parquet file. Rows are read through a named server-side cursor ``fetch_size``
+        rows at a time and each batch is appended to the file as its own row group. The file's schema follows the
+        table's column types, so it does not depend on the values of any one batch. If the export fails, the
+        partial file is removed.
+
+        :param file_path: filepath to the outfile.
+        :param fetch_size: number of rows held in memory at once.
+        :return: absolute filepath to the outfile.
+        """
+        file_path = str(path.abspath(file_path))
+        cur = None
+        writer = None
+        try:
+            cur = self.connector.connection.cursor(name='iaa_table_export')
+            cur.itersize = fetch_size
+            cur.execute(sql.SQL("SELECT * FROM {};").format(self.__table()))
+
+            # A named cursor only describes its columns once rows have been fetched.
+            rows = cur.fetchmany(fetch_size)
+            schema = pa.schema([pa.field(col[0], PARQUET_TYPES.get(col[1], pa.string())) for col in cur.description])
+            writer = pq.ParquetWriter(file_path, schema)
+            while len(rows) > 0:
+                writer.write_table(self.__parquet_batch(rows, schema))
+                rows = cur.fetchmany(fetch_size)
+            writer.close()
+            writer = None
 
-        df.to_csv(file_path, sep=',', encoding='utf-8', index=False)
+            cur.close()
+            self.connector.connection.commit()
+            return file_path
+        except (Exception, psy.DatabaseError) as error:
+            print("Exporting table failed.")
+            print(error)
+            if cur is not None and not cur.closed:
+                cur.close()
+            self.connector.connection.rollback()
+        finally:
+            if writer is not None:
+                writer.close()
+                remove(file_path)
 
+    def __parquet_batch(self, rows, schema):
+        """
+        Convert rows fetched from the database to an Arrow table with the given schema.
+
+        :param rows:
+        :param schema:
+        :return:
+        """
+        arrays = []
+        for i, field in enumerate(schema):
+            values = [row[i] for row in rows]
+            if pa.types.is_string(field.type):
+                values = [val if val is None or isinstance(val, str) else
+                          json.dumps(val) if isinstance(val, (dict, list)) else str(val) for val in values]
+            elif pa.types.is_floating(field.type):
+                # numeric values are fetched as Decimal.
+                values = [None if val is None else float(val) for val in values]
+            elif pa.types.is_binary(field.type):
+                values = [None if val is None else bytes(val) for val in values]
+            arrays.append(pa.array(values, type=field.type))
+        return pa.Table.from_arrays(arrays, schema=schema)
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+from IaaGeoDataCleaning.CleaningUtils.xlsx_reader import iter_xlsx
+
+
+def iter_chunks(data, chunk_size=1000000):
+    """
+    Stream a dataset as dataframes of at most `chunk_size` rows.
+
+    :param data: filepath (.csv or .xlsx extension), dataframe, or iterable of dataframes.
+    :type data: str, DataFrame, or iterable of DataFrame.
+    :param chunk_size:
+    :type chunk_size: int.
+    :return:
+    :rtype: generator of DataFrame.
+    :raises TypeError: if the file extension is not .csv or .xlsx.
+    """
+    if isinstance(data, str):
+        if data.endswith('.csv'):
+            for chunk in pd.read_csv(data, chunksize=chunk_size):
+                yield chunk
+        elif data.endswith('.xlsx'):
+            for chunk in iter_xlsx(data, chunk_size):
+                yield chunk
+        else:
+            raise TypeError('Unsupported file type.')
+    elif isinstance(data, pd.DataFrame):
+        for start in range(0, len(data), chunk_size):
+            yield data.iloc[start:start + chunk_size]
+    else:
+        for chunk in data:
+            yield chunk
+
+
+def grid_counts(data, lat_col, lng_col, cell_size=1.0, chunk_size=1000000):
+    """
+    Count the data points in every cell of a latitude/longitude grid. The data is read and counted one chunk at a
+    time, so memory use depends on the grid size rather than on the number of points.
+
+    :param data: filepath (.csv or .xlsx extension), dataframe, or iterable of dataframes.
+    :type data: str, DataFrame, or iterable of DataFrame.
+    :param lat_col: name of latitude column.
+    :type lat_col: str.
+    :param lng_col: name of longitude column.
+    :type lng_col: str.
+    :param cell_size: width and height of the cells (in degrees).
+    :type cell_size: float.
+    :param chunk_size: number of rows counted at once.
+    :type chunk_size: int.
+    :return: grid of counts, with rows from south to north and columns from west to east.
+    :rtype: numpy.ndarray.
+
+    >>> import pandas as pd
+    >>> df = pd.DataFrame({'Latitude': [28.68, 28.1, 30.01, None], 'Longitude': [77.22, 77.9, 31.13, 10.0]})
+    >>> counts = grid_counts(df, 'Latitude', 'Longitude', cell_size=10)
+    >>> int(counts.sum()), int(counts[11, 25])
+    (3, 2)
+    """
+    n_rows = int(np.ceil(180 / cell_size))
+    n_cols = int(np.ceil(360 / cell_size))
+    counts = np.zeros(n_rows * n_cols, dtype='int64')
+
+    for chunk in iter_chunks(data, chunk_size):
+        lats = pd.to_numeric(chunk[lat_col], errors='coerce').to_numpy(dtype='float64')
+        lngs = pd.to_numeric(chunk[lng_col], errors='coerce').to_numpy(dtype='float64')
+        valid = (lats >= -90) & (lats <= 90) & (lngs >= -180) & (lngs <= 180)
+        rows = np.minimum(((lats[valid] + 90) // cell_size).astype('int64'), n_rows - 1)
+        cols = np.minimum(((lngs[valid] + 180) // cell_size).astype('int64'), n_cols - 1)
+        counts += np.bincount(rows * n_cols + cols, minlength=len(counts))
+
+    return counts.reshape(n_rows, n_cols)
+
+
+def grid_cells(values, cell_size=1.0):
+    """
+    List the non-empty cells of a grid returned by grid_counts().
+
+    :param values: grid of counts or rates.
+    :type values: numpy.ndarray.
+    :param cell_size: width and height of the cells (in degrees).
+    :type cell_size: float.
+    :return: the south and west edges of the cells, their centers, and their values.
+    :rtype: DataFrame.
+    """
+    rows, cols = np.nonzero(values)
+    south = rows * cell_size - 90
+    west = cols * cell_size - 180
+    return pd.DataFrame({'South': south, 'West': west,
+                         'Latitude': np.minimum(south + cell_size / 2, 90),
+                         'Longitude': np.minimum(west + cell_size / 2, 180),
+                         'Value': values[rows, cols]})
@@ -0,0 +1,196 @@
+import numpy as np
+import pandas as pd
+
+MAX_LATITUDE = 85.0511287798
+
+
+def to_mercator(lats, lngs):
+    """
+    Project coordinates (in degrees) to Web Mercator, scaled so that the world spans [0, 1] on both axes.
+
+    :param lats:
+    :param lngs:
+    :return: the x and y coordinates.
+    :rtype: tuple of (numpy.ndarray, numpy.ndarray).
+    """
+    sin = np.sin(np.radians(np.clip(np.asarray(lats, dtype='float64'), -MAX_LATITUDE, MAX_LATITUDE)))
+    x = (np.asarray(lngs, dtype='float64') + 180) / 360
+    y = 0.5 - np.log((1 + sin) / (1 - sin)) / (4 * np.pi)
+    return np.clip(x, 0, 1), np.clip(y, 0, 1)
+
+
+def from_mercator(x, y):
+    """
+    Convert scaled Web Mercator coordinates back to latitudes and longitudes (in degrees).
+
+    :param x:
+    :param y:
+    :return: the latitudes and longitudes.
+    :rtype: tuple of (numpy.ndarray, numpy.ndarray).
+    """
+    lats = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * np.asarray(y, dtype='float64')))))
+    lngs = np.asarray(x, dtype='float64') * 360 - 180
+    return lats, lngs
+
+
+class GridClusters:
+    """
+    Clusters of a dataset's points for every zoom level from 0 to max_zoom, precomputed once.
+
+    At each zoom level the map is divided into square cells `radius` pixels wide and the points in a cell form one
+    cluster placed at their centroid. Cells halve in size with every zoom level, so each level is built by merging the
+    clusters of the level below it. The clusters of a level are sorted by the map tile they fall in, so the clusters in
+    view are found with a binary search per column of tiles.
+    """
+    def __init__(self, lats, lngs, max_zoom=16, radius=40, tile_size=256):
+        """
+        Cluster the points.
+
+        :param lats:
+        :type lats: array-like of float.
+        :param lngs:
+        :type lngs: array-like of float.
+        :param max_zoom: highest zoom level clustered. Higher zoom levels use the clusters of this level.
+        :type max_zoom: int.
+        :param radius: width of the cells (in pixels).
+        :type radius: int or float.
+        :param tile_size: width of the map tiles (in pixels).
+        :type tile_size: int.
+        """
+        self.max_zoom = int(max_zoom)
+        self.radius = radius
+        self.tile_size = tile_size
+        self.levels = dict()
+
+        if lats is None:
+            return
+        lats = pd.to_numeric(pd.Series(lats), errors='coerce').to_numpy(dtype='float64')
+        lngs = pd.to_numeric(pd.Series(lngs), errors='coerce').to_numpy(dtype='float64')
+        has_coords = ~(np.isnan(lats) | np.isnan(lngs))
+        x, y = to_mercator(lats[has_coords], lngs[has_coords])
+
+        cell = float(radius) / (tile_size * 2 ** self.max_zoom)
+        level = self.__merge(np.floor(x / cell).astype('int64'), np.floor(y / cell).astype('int64'),
+                             np.ones(len(x), dtype='int64'), x, y)
+        for zoom in range(self.max_zoom, -1, -1):
+            self.levels[zoom] = self.__tile_index(zoom, level)
+            level = self.__merge(level['ix'] // 2, level['iy'] // 2, level['count'], level['sum_x'], level['sum_y'])
+
+    def __merge(self, ix, iy, count, sum_x, sum_y):
+        """
+        Merge the clusters sharing a cell.
+
+        :return:
+        :rtype: dict of {str: numpy.ndarray}.
+        """
+        if len(ix) == 0:
+            return {'ix': ix, 'iy': iy, 'count': count, 'sum_x': sum_x, 'sum_y': sum_y}
+        cells, inverse = np.unique(ix * (iy.max() + 1) + iy, return_inverse=True)
+        first = np.zeros(len(cells), dtype='int64')
+        first[inverse] = np.arange(len(ix))
+        return {'ix': ix[first], 'iy': iy[first],
+                'count': np.bincount(inverse, weights=count, minlength=len(cells)).astype('int64'),
+                'sum_x': np.bincount(inverse, weights=sum_x, minlength=len(cells)),
+                'sum_y': np.bincount(inverse, weights=sum_y, minlength=len(cells))}
+
+    def __tile_index(self, zoom, level):
+        """
+        Sort the clusters of a zoom level by the key of the tile their centroid falls in, and keep only what is needed
+        to draw them.
+
+        :param zoom:
+        :param level:
+        :return:
+        :rtype: dict of {str: numpy.ndarray}.
+        """
+        tiles = 2 ** zoom
+        x = level['sum_x'] / np.maximum(level['count'], 1)
+        y = level['sum_y'] / np.maximum(level['count'], 1)
+        keys = (np.clip(np.floor(x * tiles), 0, tiles - 1).astype('int64') * tiles +
+                np.clip(np.floor(y * tiles), 0, tiles - 1).astype('int64'))
+        order = np.argsort(keys, kind='stable')
+        lats, lngs = from_mercator(x[order], y[order])
+        return {'key': keys[order], 'lat': lats.astype('float32'), 'lng': lngs.astype('float32'),
+                'count': level['count'][order].astype('int32')}
+
+    def get_clusters(self, zoom, bounds=None):
+        """
+        Get the clusters of a zoom level, optionally only those in view.
+
+        :param zoom: zoom level of the map. Levels above max_zoom use the clusters of max_zoom.
+        :type zoom: int.
+        :param bounds: ((south, west), (north, east)) corners of the view, as returned by a Leaflet map's getBounds().
+                       A view crossing the antimeridian has a west longitude greater than its east longitude.
+        :type bounds: tuple of (tuple of (float, float), tuple of (float, float)).
+        :return: the latitudes, longitudes, and number of points of the clusters.
+        :rtype: tuple of (numpy.ndarray, numpy.ndarray, numpy.ndarray).
+        """
+        zoom = int(min(max(zoom, 0), self.max_zoom))
+        level = self.levels[zoom]
+        if bounds is None:
+            return level['lat'], level['lng'], level['count']
+
+        (south, west), (north, east) = bounds
+        tiles = 2 ** zoom
+        x0, y1 = to_mercator(south, west)
+        x1, y0 = to_mercator(north, east)
+        ty0 = int(min(np.floor(y0 * tiles), tiles - 1))
+        ty1 = int(min(np.floor(y1 * tiles), tiles - 1))
+        tx0 = int(min(np.floor(x0 * tiles), tiles - 1))
+        tx1 = int(min(np.floor(x1 * tiles), tiles - 1))
+        if tx0 <= tx1:
+            columns = range(tx0, tx1 + 1)
+        else:
+            columns = list(range(tx0, tiles)) + list(range(0, tx1 + 1))
+
+        # The clusters of one column of tiles from ty0 to ty1 are a contiguous run of the sorted keys.
+        slices = [slice(np.searchsorted(level['key'], tx * tiles + ty0, side='left'),
+                        np.searchsorted(level['key'], tx * tiles + ty1, side='right')) for tx in columns]
+        found = np.concatenate([np.arange(s.start, s.stop) for s in slices] + [np.array([], dtype='int64')])
+        return level['lat'][found], level['lng'][found], level['count'][found]
+
+    def to_geojson(self, zoom, bounds=None):
+        """
+        Get the clusters of a zoom level as a GeoJSON feature collection, with the number of points of each cluster in
+        its 'count' property.
+
+        :param zoom:
+        :param bounds:
+        :return:
+        :rtype: dict.
+        """
+        lats, lngs, counts = self.get_clusters(zoom, bounds)
+        features = [{'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [round(lng, 6), round(lat, 6)]},
+                     'properties': {'count': count}}
+                    for lat, lng, count in zip(lats.tolist(), lngs.tolist(), counts.tolist())]
+        return {'type': 'FeatureCollection', 'features': features}
+
+    def save(self, file_path):
+        """
+        Save the clusters of every zoom level to a compressed .npz file.
+
+        :param file_path:
+        :return:
+        """
+        arrays = {'meta': np.array([self.max_zoom, self.radius, self.tile_size], dtype='float64')}
+        for zoom, level in self.levels.items():
+            for name, values in level.items():
+                arrays['%d_%s' % (zoom, name)] = values
+        np.savez_compressed(file_path, **arrays)
+
+    @classmethod
+    def load(cls, file_path):
+        """
+        Load clusters saved with save().
+
+        :param file_path:
+        :return:
+        :rtype: GridClusters.
+        """
+        with np.load(file_path) as arrays:
+            max_zoom, radius, tile_size = arrays['meta'].tolist()
+            clusters = cls(None, None, int(max_zoom), radius, int(tile_size))
+            for zoom in range(clusters.max_zoom + 1):
+                clusters.levels[zoom] = dict((name, arrays['%d_%s' % (zoom, name)])
+                                             for name in ('key', 'lat', 'lng', 'count'))
+        return clusters
@@ -1,11 +1,21 @@
-from folium import Map, Marker, Icon, Popup
-from folium.plugins import MarkerCluster
+from folium import Map, Marker, Icon, Popup, CircleMarker, FeatureGroup, GeoJson, GeoJsonTooltip
+from folium.plugins import MarkerCluster, FastMarkerCluster, HeatMap
+from branca.colormap import LinearColormap
+import os
+import hashlib
 import math
+import numpy as np
+from collections import OrderedDict
 from IaaGeoDataCleaning.CleaningUtils.coordinates_validator import *
+from IaaGeoDataCleaning.MapTools import point_index, density
+from IaaGeoDataCleaning.MapTools.grid_clusters import GridClusters
 
 
 class MapTool:
-    def __init__(self, shapedir, shape_geom, shape_iso2):
+    # Tolerances (in degrees) of the simplified country borders, from coarsest to finest.
+    BORDER_TOLERANCES = (0.5, 0.1, 0.02, 0.005)
+
+    def __init__(self, shapedir, shape_geom, shape_iso2, index_cache_size=4, validation_cache_size=4, cache_dir=None):
         """
         Initialize a MapTool object to plot locational data points.
 
@@ -15,6 +25,12 @@ class MapTool:
         :type shape_geom: str.
         :param shape_iso2: name of the two-letter country code column.
         :type shape_iso2: str.
+        :param index_cache_size: number of datasets whose spatial index is kept for radius and nearest queries.
+        :type index_cache_size: int.
+        :param validation_cache_size: number of datasets whose validation results are kept for the plotting methods.
+        :type validation_cache_size: int.
+        :param cache_dir: directory for the simplified country borders. If not passed, they are only kept in memory.
+        :type cache_dir: str.
         """
 
         shape_dict = process_shapefile(shapedir)
@@ -22,6 +38,13 @@ class MapTool:
         self.prj = get_projection(shape_dict['prj'])
         self.shape_geom = shape_geom
         self.shape_iso2 = shape_iso2
+        self.index_cache_size = index_cache_size
+        self.index_cache = OrderedDict()
+        self.validation_cache_size = validation_cache_size
+        self.validation_cache = OrderedDict()
+        self.shape_file = shape_dict['shp']
+        self.cache_dir = cache_dir
+        self.shape_cache = dict()
 
     def create_map(self, center=(0, 0), zoom=2):
         """
@@ -55,20 +78,39 @@ class MapTool:
         """
         Calculate the distance between two geographical points using the haversin formula (in kilometers).
 
+        Any argument may be an array, in which case the distances are computed element-wise.
+
         :param lat0:
         :param lng0:
         :param lat1:
         :param lng1:
         :return: the distance in km.
         """
-        rlat0 = math.radians(lat0)
-        rlat1 = math.radians(lat1)
-        dlat = rlat1 - rlat0
-        dlng = math.radians(lng1 - lng0)
+        return point_index.haversine(lat0, lng0, lat1, lng1)
+
+    def get_point_index(self, df, lat_col, lng_col):
+        """
+        Get the spatial index of the dataset's coordinates. Indexes are built once per dataset and kept for the
+        last ``index_cache_size`` datasets.
 
-        a = math.pow(math.sin(dlat / 2), 2) + math.cos(rlat0) * math.cos(rlat1) * math.pow(math.sin(dlng / 2), 2)
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-        return 6371 * c
+        :param df:
+        :type df: DataFrame.
+        :param lat_col:
+        :param lng_col:
+        :return:
+        :rtype: PointIndex.
+        """
+        key = point_index.fingerprint(df, [lat_col, lng_col])
+        if key in self.index_cache:
+            self.index_cache.move_to_end(key)
+            return self.index_cache[key]
+
+        index = point_index.PointIndex(df[lat_col], df[lng_col])
+        if self.index_cache_size > 0:
+            self.index_cache[key] = index
+            if len(self.index_cache) > self.index_cache_size:
+                self.index_cache.popitem(last=False)
+        return index
 
     def plot_point(self, lat, lng, desc=None, clr='blue'):
         """
@@ -90,7 +132,7 @@ class MapTool:
         return Marker(location=(lat, lng), popup=Popup(desc, parse_html=True),
                       icon=Icon(prefix='fa', color=clr, icon='circle', icon_color='white'))
 
-    def plot_all_data(self, data, loc_col, ctry_col, lat_col, lng_col, clr='blue', as_cluster=True):
+    def plot_all_data(self, data, loc_col, ctry_col, lat_col, lng_col, clr='blue', as_cluster=True, fast=False):
         """
         Create markers for all of the locational data points.
 
@@ -108,11 +150,18 @@ class MapTool:
         :type clr: str.
         :param as_cluster: indicate whether the markers will be saved in a cluster or not.
         :type as_cluster: bool.
+        :param fast: indicate whether to send all of the points to the map as one array that is clustered and drawn
+                     in the browser, for datasets too large for individual markers. ``as_cluster`` is ignored.
+        :type fast: bool.
         :return: all of the created markers.
-        :rtype: list of folium.Marker if ``as_cluster=False`` or a folium.MarkerCluster if ``as_cluster=True``.
+        :rtype: list of folium.Marker if ``as_cluster=False``, a folium.MarkerCluster if ``as_cluster=True``, or a
+                folium.plugins.FastMarkerCluster if ``fast=True``.
         """
         df = read_data(data, {loc_col, ctry_col, lat_col, lng_col})
 
+        if fast:
+            return self.__plot_fast(df, loc_col, ctry_col, lat_col, lng_col, clr)
+
         if as_cluster:
             markers = MarkerCluster()
         else:
@@ -132,7 +181,266 @@ class MapTool:
 
         return markers
 
-    def plot_correct_data(self, data, loc_col, ctry_col, lat_col, lng_col, clr='green', as_cluster=False):
+    def __plot_fast(self, df, loc_col, ctry_col, lat_col, lng_col, clr):
+        """
+        Create one layer holding the coordinates and popup text of every data point as a compact array. Markers are
+        only created in the browser, for the clusters and points in view.
+
+        :param df:
+        :param loc_col:
+        :param ctry_col:
+        :param lat_col:
+        :param lng_col:
+        :param clr:
+        :return:
+        :rtype: folium.plugins.FastMarkerCluster.
+        """
+        lats = pd.to_numeric(df[lat_col], errors='coerce')
+        lngs = pd.to_numeric(df[lng_col], errors='coerce')
+        has_coords = lats.notnull() & lngs.notnull()
+        lats = lats[has_coords]
+        lngs = lngs[has_coords]
+
+        desc = (df.loc[has_coords, loc_col].fillna('').astype(str) + ', ' +
+                df.loc[has_coords, ctry_col].fillna('').astype(str) + ' - (' +
+                lats.map('{:.2f}'.format) + ', ' + lngs.map('{:.2f}'.format) + ')')
+        desc = desc.str.replace('&', '&amp;', regex=False).str.replace('<', '&lt;', regex=False).str.replace(
+            '>', '&gt;', regex=False)
+
+        callback = """function (row) {
+            var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {radius: 6, color: '%s', fillOpacity: 0.8});
+            marker.bindPopup(row[2]);
+            return marker;
+        }""" % clr
+        return FastMarkerCluster(data=list(zip(lats.tolist(), lngs.tolist(), desc.tolist())), callback=callback)
+
+    def cluster_data(self, data, lat_col, lng_col, max_zoom=16, radius=40):
+        """
+        Precompute the clusters of all of the locational data points for every zoom level, so that maps only receive
+        the clusters of the zoom level and area they show.
+
+        :param data: filepath (.csv or .xlsx extension) or dataframe.
+        :type data: str or DataFrame.
+        :param lat_col: name of latitude column.
+        :type lat_col: str.
+        :param lng_col: name of longitude column.
+        :type lng_col: str.
+        :param max_zoom: highest zoom level clustered.
+        :type max_zoom: int.
+        :param radius: width of the clustering cells (in pixels).
+        :type radius: int or float.
+        :return:
+        :rtype: GridClusters.
+        """
+        df = read_data(data, {lat_col, lng_col})
+        return GridClusters(df[lat_col], df[lng_col], max_zoom, radius)
+
+    def plot_clusters(self, clusters, zoom, bounds=None, clr='blue'):
+        """
+        Create circles for the precomputed clusters of a zoom level, sized by their number of data points.
+
+        :param clusters: clusters returned by cluster_data().
+        :type clusters: GridClusters.
+        :param zoom: zoom level of the map.
+        :type zoom: int.
+        :param bounds: ((south, west), (north, east)) corners of the area shown. Defaults to the whole world.
+        :type bounds: tuple of (tuple of (float, float), tuple of (float, float)).
+        :param clr: color of the circles.
+        :type clr: str.
+        :return:
+        :rtype: folium.FeatureGroup.
+        """
+        lats, lngs, counts = clusters.get_clusters(zoom, bounds)
+        layer = FeatureGroup(name='Clusters (zoom %d)' % zoom)
+        for lat, lng, count in zip(lats.tolist(), lngs.tolist(), counts.tolist()):
+            CircleMarker(location=(lat, lng), radius=4 + 3 * math.log10(count), color=clr, fill=True,
+                         fill_opacity=0.6, popup='%d data points' % count).add_to(layer)
+        return layer
+
+    def validate_data(self, data, loc_col, ctry_col, lat_col, lng_col):
+        """
+        Check the coordinates of all of the data points against the shapefile. Results are kept for the last
+        ``validation_cache_size`` datasets, keyed by their contents and the passed column names, so plotting several
+        layers of the same data only validates it once.
+
+        :param data: filepath (.csv or .xlsx extension) or dataframe.
+        :type data: str or DataFrame.
+        :param loc_col:
+        :param ctry_col:
+        :param lat_col:
+        :param lng_col:
+        :return: the data points whose coordinates correspond to their country, and the potential errors.
+        :rtype: tuple of (geopandas.GeoDataFrame, geopandas.GeoDataFrame).
+        """
+        df = read_data(data, {loc_col, ctry_col, lat_col, lng_col})
+        key = (point_index.fingerprint(df, list(df.columns)), loc_col, ctry_col, lat_col, lng_col)
+        if key in self.validation_cache:
+            self.validation_cache.move_to_end(key)
+            return self.validation_cache[key]
+
+        # to_gdf fills missing coordinates in place, which would change the key of the caller's dataframe.
+        gdf = to_gdf(df.copy(), lat_col, lng_col, self.prj)
+        gdf['ISO2'] = coco.convert(list(gdf[ctry_col]), to='ISO2')
+        checked_df = check_data_geom(loc_col, 'ISO2', gdf, self.shape_gdf, self.shape_geom, self.shape_iso2)
+
+        if self.validation_cache_size > 0:
+            self.validation_cache[key] = checked_df
+            if len(self.validation_cache) > self.validation_cache_size:
+                self.validation_cache.popitem(last=False)
+        return checked_df
+
+    def plot_density(self, data, lat_col, lng_col, cell_size=1.0, total_data=None, as_heatmap=True,
+                     chunk_size=1000000, name=None):
+        """
+        Create a layer showing how many data points fall in each cell of a latitude/longitude grid, instead of one
+        marker per point. The data is counted in chunks, so files with millions of points can be passed directly.
+
+        If ``total_data`` is passed, each cell shows the share of its points in ``total_data`` that are in ``data``
+        instead, e.g. the error rate when ``data`` holds the potential errors of ``total_data``.
+
+        :param data: filepath (.csv or .xlsx extension), dataframe, or iterable of dataframes.
+        :type data: str, DataFrame, or iterable of DataFrame.
+        :param lat_col: name of latitude column.
+        :type lat_col: str.
+        :param lng_col: name of longitude column.
+        :type lng_col: str.
+        :param cell_size: width and height of the cells (in degrees).
+        :type cell_size: float.
+        :param total_data: all of the data points, as for ``data``.
+        :type total_data: str, DataFrame, or iterable of DataFrame.
+        :param as_heatmap: indicate whether to draw a heatmap of the cell centers or to color the cells.
+        :type as_heatmap: bool.
+        :param chunk_size: number of rows counted at once.
+        :type chunk_size: int.
+        :param name: name of the layer.
+        :type name: str.
+        :return:
+        :rtype: folium.plugins.HeatMap if ``as_heatmap=True`` or folium.GeoJson if ``as_heatmap=False``.
+        """
+        values = density.grid_counts(data, lat_col, lng_col, cell_size, chunk_size).astype('float64')
+        if total_data is not None:
+            totals = density.grid_counts(total_data, lat_col, lng_col, cell_size, chunk_size)
+            values = np.divide(values, totals, out=np.zeros_like(values), where=totals > 0)
+        cells = density.grid_cells(values, cell_size)
+        max_value = cells['Value'].max() if len(cells) > 0 else 1
+
+        if as_heatmap:
+            return HeatMap(data=np.column_stack((cells['Latitude'], cells['Longitude'],
+                                                 cells['Value'] / max_value)).tolist(), name=name)
+
+        features = [{'type': 'Feature', 'properties': {'value': value},
+                     'geometry': {'type': 'Polygon', 'coordinates': [[[west, south], [west + cell_size, south],
+                                                                      [west + cell_size, south + cell_size],
+                                                                      [west, south + cell_size], [west, south]]]}}
+                    for south, west, value in zip(cells['South'].tolist(), cells['West'].tolist(),
+                                                  cells['Value'].tolist())]
+        colormap = LinearColormap(['yellow', 'orange', 'red'], vmin=0, vmax=max_value)
+        return GeoJson({'type': 'FeatureCollection', 'features': features}, name=name,
+                       style_function=lambda feature: {'fillColor': colormap(feature['properties']['value']),
+                                                       'fillOpacity': 0.6, 'weight': 0})
+
+    def border_tolerance(self, zoom):
+        """
+        Choose the coarsest border tolerance that stays under one pixel at the zoom level.
+
+        :param zoom:
+        :type zoom: int.
+        :return:
+        :rtype: float.
+        """
+        pixel = 360 / (256 * 2 ** zoom)
+        for tolerance in self.BORDER_TOLERANCES:
+            if tolerance <= pixel:
+                return tolerance
+        return self.BORDER_TOLERANCES[-1]
+
+    def get_borders(self, tolerance):
+        """
+        Get the country borders in EPSG:4326, simplified to the tolerance without creating invalid geometries.
+        Simplified borders are kept in memory and, if the MapTool has a cache_dir, saved there for later MapTools
+        using the same shapefile.
+
+        :param tolerance: maximum distance (in degrees) between the simplified and the original borders.
+        :type tolerance: float.
+        :return: the two-letter country code and simplified geometry of every country.
+        :rtype: geopandas.GeoDataFrame.
+        """
+        if tolerance in self.shape_cache:
+            return self.shape_cache[tolerance]
+
+        cache_path = None
+        if self.cache_dir:
+            stat = os.stat(self.shape_file)
+            key = '|'.join((os.path.abspath(self.shape_file), str(stat.st_size), str(stat.st_mtime), self.shape_iso2))
+            digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+            name = os.path.splitext(os.path.basename(self.shape_file))[0]
+            cache_path = os.path.join(self.cache_dir, '%s.%s.%s.geojson' % (name, digest, tolerance))
+
+        if cache_path and os.path.exists(cache_path):
+            borders = gpd.read_file(cache_path)
+        else:
+            borders = self.shape_gdf[[self.shape_iso2, self.shape_geom]].rename(
+                columns={self.shape_geom: 'geometry'}).set_geometry('geometry')
+            if self.prj != 4326:
+                borders = convert_df_crs(borders, 4326)
+            borders['geometry'] = borders.geometry.simplify(tolerance, preserve_topology=True)
+            if cache_path:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                borders.to_file(cache_path, driver='GeoJSON')
+
+        self.shape_cache[tolerance] = borders
+        return borders
+
+    def error_rates(self, data, loc_col, ctry_col, lat_col, lng_col):
+        """
+        Count the data points and potential errors of every country.
+
+        :param data: filepath (.csv or .xlsx extension) or dataframe.
+        :type data: str or DataFrame.
+        :param loc_col:
+        :param ctry_col:
+        :param lat_col:
+        :param lng_col:
+        :return: the number of data points, number of potential errors, and error rate per two-letter country code.
+        :rtype: DataFrame.
+        """
+        correct_df, error_df = self.validate_data(data, loc_col, ctry_col, lat_col, lng_col)
+        outcomes = pd.DataFrame({'ISO2': np.concatenate((correct_df['ISO2'].to_numpy(), error_df['ISO2'].to_numpy())),
+                                 'Error': np.repeat([0, 1], [len(correct_df), len(error_df)])})
+        rates = outcomes.groupby('ISO2')['Error'].agg(['size', 'sum', 'mean'])
+        rates.columns = ['Total', 'Errors', 'Rate']
+        return rates.reset_index()
+
+    def plot_error_rates(self, data, loc_col, ctry_col, lat_col, lng_col, zoom=2, name=None):
+        """
+        Create a choropleth of the share of potential errors among the data points of every country, drawn with
+        borders simplified for the zoom level.
+
+        :param data: filepath (.csv or .xlsx extension) or dataframe.
+        :type data: str or DataFrame.
+        :param loc_col:
+        :param ctry_col:
+        :param lat_col:
+        :param lng_col:
+        :param zoom: zoom level the map is drawn at.
+        :type zoom: int.
+        :param name: name of the layer.
+        :type name: str.
+        :return:
+        :rtype: folium.GeoJson.
+        """
+        rates = self.error_rates(data, loc_col, ctry_col, lat_col, lng_col)
+        borders = self.get_borders(self.border_tolerance(zoom))
+        borders = borders.merge(rates.rename(columns={'ISO2': self.shape_iso2}), how='inner', on=self.shape_iso2)
+        fields = [self.shape_iso2, 'Total', 'Errors', 'Rate']
+
+        colormap = LinearColormap(['green', 'yellow', 'red'], vmin=0, vmax=1)
+        return GeoJson(borders[fields + ['geometry']].to_json(), name=name,
+                       style_function=lambda feature: {'fillColor': colormap(feature['properties']['Rate']),
+                                                       'fillOpacity': 0.6, 'color': 'gray', 'weight': 1},
+                       tooltip=GeoJsonTooltip(fields=fields))
+
+    def plot_correct_data(self, data, loc_col, ctry_col, lat_col, lng_col, clr='green', as_cluster=False, fast=False):
         """
         Create markers for all of the data points whose locational information correspond to their respective country.
 
@@ -143,13 +451,11 @@ class MapTool:
         :param lng_col:
         :param clr:
         :param as_cluster:
+        :param fast:
         :return:
         """
-        df = read_data(data, {loc_col, ctry_col, lat_col, lng_col})
-        gdf = to_gdf(df, lat_col, lng_col, self.prj)
-        gdf['ISO2'] = coco.convert(list(gdf[ctry_col]), to='ISO2')
-        correct_df = check_data_geom(loc_col, 'ISO2', gdf, self.shape_gdf, self.shape_geom, self.shape_iso2)[0]
-        return self.plot_all_data(correct_df, loc_col, ctry_col, lat_col, lng_col, clr, as_cluster)
+        correct_df = self.validate_data(data, loc_col, ctry_col, lat_col, lng_col)[0]
+        return self.plot_all_data(correct_df, loc_col, ctry_col, lat_col, lng_col, clr, as_cluster, fast)
 
     def plot_potential_errors(self, data, loc_col, ctry_col, lat_col, lng_col, clr='lightred', plot_alt=False):
         """
@@ -169,10 +475,7 @@ class MapTool:
         :type plot_alt: bool.
         :return:
         """
-        df = read_data(data, {loc_col, ctry_col, lat_col, lng_col})
-        gdf = to_gdf(df, lat_col, lng_col, self.prj)
-        gdf['ISO2'] = coco.convert(list(gdf[ctry_col]), to='ISO2')
-        checked_df = check_data_geom(loc_col, 'ISO2', gdf, self.shape_gdf, self.shape_geom, self.shape_iso2)
+        checked_df = self.validate_data(data, loc_col, ctry_col, lat_col, lng_col)
 
         potential_errors = checked_df[1]
 
@@ -278,22 +581,60 @@ class MapTool:
         df = read_data(data, {loc_col, ctry_col, lat_col, lng_col})
         if not desc0:
             desc0 = str(tuple(center))
-        markers = []
-        for index, row in df.iterrows():
-            if pd.notnull(row[lat_col]) and pd.notnull(row[lng_col]):
-                lat = row[lat_col]
-                lng = row[lng_col]
-                d = self.haversine(center[0], center[1], lat, lng)
+        positions, distances = self.get_point_index(df, lat_col, lng_col).within(center[0], center[1], radius)
+        markers = self.__plot_found(df, positions, distances, loc_col, ctry_col, lat_col, lng_col, clr1)
+        markers.append(self.plot_point(lat=center[0], lng=center[1], desc=desc0, clr=clr0))
+        return markers
 
-                if d < radius:
-                    location = self.format_popup(row[loc_col], row[ctry_col])
-                    markers.append(self.plot_point(lat=lat, lng=lng, clr=clr1,
-                                                   desc='%s, %s - %s km' % (
-                                                   location[0], location[1], format(d, '.3f'))))
+    def plot_nearest(self, data, center, k, loc_col, ctry_col, lat_col, lng_col,
+                     desc0=None, clr0='blue', clr1='lightblue'):
+        """
+        Create markers for the k data points nearest to the passed center.
 
+        :param data: filepath (.csv or .xlsx extension) or dataframe.
+        :type data: str or DataFrame
+        :param center:
+        :type center: tuple or list of int or float.
+        :param k: number of data points.
+        :type k: int.
+        :param loc_col:
+        :param ctry_col:
+        :param lat_col:
+        :param lng_col:
+        :param desc0: description of the marker for the center.
+        :param clr0: color of the center.
+        :type clr0: str.
+        :param clr1: color of the other markers.
+        :type clr1: str.
+        :return:
+        :rtype: list of folium.Marker.
+        """
+        df = read_data(data, {loc_col, ctry_col, lat_col, lng_col})
+        if not desc0:
+            desc0 = str(tuple(center))
+        positions, distances = self.get_point_index(df, lat_col, lng_col).nearest(center[0], center[1], k)
+        markers = self.__plot_found(df, positions, distances, loc_col, ctry_col, lat_col, lng_col, clr1)
         markers.append(self.plot_point(lat=center[0], lng=center[1], desc=desc0, clr=clr0))
         return markers
 
+    def __plot_found(self, df, positions, distances, loc_col, ctry_col, lat_col, lng_col, clr):
+        """
+        Create markers for the data points found by a spatial index query, describing their distance to the center.
+
+        :param df:
+        :param positions: positions of the data points in the dataframe.
+        :param distances: distances to the center (in kilometers).
+        :return:
+        :rtype: list of folium.Marker.
+        """
+        found = df.iloc[positions]
+        markers = []
+        for lat, lng, loc, ctry, d in zip(found[lat_col], found[lng_col], found[loc_col], found[ctry_col], distances):
+            location = self.format_popup(loc, ctry)
+            markers.append(self.plot_point(lat=lat, lng=lng, clr=clr,
+                                           desc='%s, %s - %s km' % (location[0], location[1], format(d, '.3f'))))
+        return markers
+
     def plot_within_point(self, data, index, radius, loc_col, ctry_col, lat_col, lng_col, clr0='blue', clr1='lightblue'):
         """
         Create markers for all data points within the passed radius of the specified data point.
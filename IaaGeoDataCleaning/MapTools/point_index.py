@@ -0,0 +1,92 @@
+import hashlib
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from IaaGeoDataCleaning.CleaningUtils.distance import EARTH_RADIUS, haversine
+
+
+def to_unit_sphere(lats, lngs):
+    """
+    Convert coordinates (in degrees) to points on the unit sphere.
+
+    :param lats:
+    :param lngs:
+    :return: array with one (x, y, z) row per coordinate.
+    :rtype: numpy.ndarray.
+    """
+    rlats = np.radians(np.asarray(lats, dtype='float64'))
+    rlngs = np.radians(np.asarray(lngs, dtype='float64'))
+    return np.column_stack((np.cos(rlats) * np.cos(rlngs), np.cos(rlats) * np.sin(rlngs), np.sin(rlats)))
+
+
+def fingerprint(df, cols):
+    """
+    Generate a hash of the contents of the given columns, used to recognize a dataset that was seen before.
+
+    :param df:
+    :type df: DataFrame.
+    :param cols: names of the columns.
+    :type cols: list of str.
+    :return:
+    :rtype: str.
+    """
+    digest = hashlib.sha1()
+    digest.update(str(list(cols)).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df[list(cols)], index=True).values.tobytes())
+    return digest.hexdigest()
+
+
+class PointIndex:
+    """
+    KD-tree over the coordinates of a dataset, in unit sphere coordinates so that straight-line distances in the tree
+    are monotonic in great-circle distance. Rows without coordinates are left out.
+    """
+    def __init__(self, lats, lngs):
+        """
+        Build the index.
+
+        :param lats:
+        :type lats: array-like of float.
+        :param lngs:
+        :type lngs: array-like of float.
+        """
+        lats = pd.to_numeric(pd.Series(lats), errors='coerce').to_numpy(dtype='float64')
+        lngs = pd.to_numeric(pd.Series(lngs), errors='coerce').to_numpy(dtype='float64')
+        self.positions = np.flatnonzero(~(np.isnan(lats) | np.isnan(lngs)))
+        self.lats = lats[self.positions]
+        self.lngs = lngs[self.positions]
+        self.tree = cKDTree(to_unit_sphere(self.lats, self.lngs))
+
+    def within(self, lat, lng, radius):
+        """
+        Find all of the points within the radius of the passed center.
+
+        :param lat:
+        :param lng:
+        :param radius: radius of the search circle (in kilometers).
+        :return: positions of the points in the indexed data, in their original order, and their distances in km.
+        :rtype: tuple of (numpy.ndarray, numpy.ndarray).
+        """
+        angle = min(float(radius) / EARTH_RADIUS, np.pi)
+        found = np.sort(np.asarray(self.tree.query_ball_point(to_unit_sphere([lat], [lng])[0],
+                                                              2 * np.sin(angle / 2) + 1e-12),
+                                   dtype='int64'))
+        distances = haversine(lat, lng, self.lats[found], self.lngs[found])
+        inside = distances < radius
+        return self.positions[found[inside]], distances[inside]
+
+    def nearest(self, lat, lng, k=1):
+        """
+        Find the k points nearest to the passed center.
+
+        :param lat:
+        :param lng:
+        :param k:
+        :return: positions of the points in the indexed data, from nearest to farthest, and their distances in km.
+        :rtype: tuple of (numpy.ndarray, numpy.ndarray).
+        """
+        k = min(int(k), len(self.positions))
+        if k == 0:
+            return np.array([], dtype='int64'), np.array([], dtype='float64')
+        found = np.atleast_1d(self.tree.query(to_unit_sphere([lat], [lng])[0], k=k)[1])
+        return self.positions[found], haversine(lat, lng, self.lats[found], self.lngs[found])
@@ -35,7 +35,8 @@ setup(name='IaaGeoDataCleaning',
       package_data={'IaaGeoDataCleaning': data_dirs,
                     'IaaGeoDataCleaniing.CleaningUtils': data_dirs,
                     'IaaGeoDataCleaning.ConnectionUtils': data_dirs},
-      install_requires=['numpy', 'pandas', 'geocoder', 'geopandas', 'fiona', 'gdal', 'psycopg2', 'geopy', 'xlrd',
-                        'folium', 'country_converter', 'sridentify', 'rtree', 'shapely'],
+      install_requires=['numpy', 'pandas', 'geocoder', 'geopandas', 'fiona', 'gdal', 'psycopg2', 'geopy', 'openpyxl',
+                        'folium', 'country_converter', 'sridentify', 'rtree', 'shapely',
+                        'pyarrow', 'scipy'],
       zip_safe=False)
 
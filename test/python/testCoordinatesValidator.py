@@ -0,0 +1,29 @@
+from IaaGeoDataCleaning.CleaningUtils.coordinates_validator import find_duplicates
+import numpy as np
+import pandas as pd
+
+
+def testFindDuplicates():
+    df = pd.DataFrame({'City': ['Nairobi', 'Nairobi City', 'Mombasa', 'Nairobi', 'Null Island', 'Null', 'Unknown'],
+                       'Latitude': [-1.2864, -1.2921, -4.0435, -1.2864, 0, 0, None],
+                       'Longitude': [36.8172, 36.8219, 39.6682, 36.8172, 0, 0, None]})
+    duplicates = find_duplicates(data=df, loc_col='City', lat_col='Latitude', lng_col='Longitude')
+    # Entries at (0, 0) or without coordinates are never duplicates.
+    assert list(duplicates.index) == [0, 1, 3]
+    assert list(duplicates['Duplicate_Group']) == [0, 0, 0]
+
+    duplicates = find_duplicates(data=df, loc_col='City', lat_col='Latitude', lng_col='Longitude', min_similarity=0.9)
+    assert list(duplicates.index) == [0, 3]
+
+
+def testFindDuplicatesDenseCells():
+    rng = np.random.RandomState(0)
+    df = pd.DataFrame({'City': ['Place'] * 3000,
+                       'Latitude': np.concatenate([np.full(1500, 10.0), rng.uniform(-60, 60, 1500)]),
+                       'Longitude': np.concatenate([np.full(1500, 20.0), rng.uniform(-180, 180, 1500)])})
+    expected = find_duplicates(data=df, loc_col='City', lat_col='Latitude', lng_col='Longitude', max_distance=50)
+    # Splitting the pairs into small blocks gives the same groups.
+    blocked = find_duplicates(data=df, loc_col='City', lat_col='Latitude', lng_col='Longitude', max_distance=50,
+                              max_pairs=1000)
+    pd.testing.assert_frame_equal(blocked, expected)
+    assert (expected['Duplicate_Group'] == 0).sum() >= 1500
@@ -0,0 +1,43 @@
+from IaaGeoDataCleaning.CleaningUtils.coordinates_validator import geocode_coordinates
+from IaaGeoDataCleaning.ConnectionUtils.GeocodeCache import normalize_key
+import pandas as pd
+
+
+class FakeCache:
+    """
+    Stands in for a GeocodeCache, holding results in memory.
+    """
+    def __init__(self, results):
+        self.results = results
+        self.stored = []
+
+    def lookup(self, keys, provider=None, max_age=None):
+        return dict((key, self.results[key]) for key in keys if key in self.results)
+
+    def store(self, entries, provider, page_size=1000):
+        self.stored.append(entries)
+
+
+def testNormalizeKey():
+    assert normalize_key('  São   Paulo, ') == 'são paulo'
+    assert normalize_key('SÃO PAULO') == normalize_key('são-paulo') == 'são paulo'
+    assert normalize_key('ﬁji') == 'fiji'
+    assert normalize_key(None) == ''
+
+
+def testGeocodeCoordinatesFromCache():
+    df = pd.DataFrame({'City': ['Toronto', 'Dhaka', 'Atlantis'], 'Country': ['Canada', 'Bangladesh', 'Ocean']})
+    cache = FakeCache({('Toronto', 'Canada'): {'latitude': 43.653963, 'longitude': -79.387207,
+                                                'address': 'Toronto, Ontario, Canada'},
+                       ('Dhaka', 'Bangladesh'): {'latitude': 23.759357, 'longitude': 90.378814,
+                                                 'address': 'Dhaka, Bangladesh'},
+                       ('Atlantis', 'Ocean'): None})
+    gdf, idf = geocode_coordinates(df, 'City', 'Country', cache=cache)
+
+    assert list(gdf.columns) == ['City', 'Country', 'Geocoded_Adr', 'Geocoded_Lat', 'Geocoded_Lng', 'Type']
+    assert list(gdf['City']) == ['Toronto', 'Dhaka']
+    assert list(gdf['Geocoded_Lat']) == [43.653963, 23.759357]
+    assert list(gdf.index) == [0, 1]
+    assert list(idf['City']) == ['Atlantis']
+    # Every location was found in the cache, so nothing new is stored.
+    assert cache.stored == []
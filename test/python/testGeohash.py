@@ -0,0 +1,23 @@
+from IaaGeoDataCleaning.CleaningUtils import geohash
+import pandas as pd
+
+
+def testGeohash():
+    hashes = geohash.encode([57.64911, -25.382708, None, 95], [10.40744, -49.215545, 10, 0], precision=11)
+    assert list(hashes) == ['u4pruydqqvj', '6gmp854r48m', None, None]
+
+    lat, lng, lat_err, lng_err = geohash.decode('u4pruydqqvj')
+    assert abs(lat - 57.64911) <= lat_err
+    assert abs(lng - 10.40744) <= lng_err
+
+    assert sorted(geohash.neighbours('u4pru')) == ['u4pre', 'u4prg', 'u4prs', 'u4prt', 'u4prv', 'u4r25', 'u4r2h',
+                                                   'u4r2j']
+    # Neighbours wrap around the antimeridian.
+    assert len(geohash.neighbours(geohash.encode([0], [179.99], precision=4)[0])) == 8
+
+
+def testGroupByPrefix():
+    df = pd.DataFrame({'Latitude': [57.64911, 57.6492, -25.382708], 'Longitude': [10.40744, 10.4075, -49.215545]})
+    df['Geohash'] = geohash.encode(df['Latitude'], df['Longitude'])
+    groups = geohash.group_by_prefix(df, 'Geohash', 5)
+    assert sorted(len(group) for name, group in groups) == [1, 2]
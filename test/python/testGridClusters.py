@@ -0,0 +1,51 @@
+from IaaGeoDataCleaning.MapTools.grid_clusters import GridClusters
+import pytest
+import numpy as np
+
+
+@pytest.fixture
+def points():
+    rng = np.random.RandomState(0)
+    lats = rng.uniform(-89, 89, 2000)
+    lngs = rng.uniform(-180, 180, 2000)
+    lats[[5, 17]] = np.nan
+    return lats, lngs
+
+
+def testGridClusters(points, tmp_path):
+    lats, lngs = points
+    clusters = GridClusters(lats, lngs, max_zoom=6)
+    for zoom in range(7):
+        counts = clusters.get_clusters(zoom)[2]
+        assert counts.sum() == 1998
+    assert len(clusters.get_clusters(0)[2]) < len(clusters.get_clusters(6)[2])
+    assert np.array_equal(clusters.get_clusters(12)[2], clusters.get_clusters(6)[2])
+
+    clusters.save(str(tmp_path / 'clusters.npz'))
+    loaded = GridClusters.load(str(tmp_path / 'clusters.npz'))
+    for zoom in range(7):
+        for got, expected in zip(loaded.get_clusters(zoom), clusters.get_clusters(zoom)):
+            assert np.array_equal(got, expected)
+
+
+def testGridClustersBounds(points):
+    lats, lngs = points
+    clusters = GridClusters(lats, lngs, max_zoom=6)
+    all_lats, all_lngs, all_counts = clusters.get_clusters(4)
+
+    # Clusters are found by map tile, so the whole tiles overlapping the view are returned.
+    lats, lngs, counts = clusters.get_clusters(4, ((-20, -30), (40, 60)))
+    assert len(counts) > 0
+    assert np.all((lngs >= -45) & (lngs <= 67.5))
+    inside = (all_lats >= -20) & (all_lats <= 40) & (all_lngs >= -30) & (all_lngs <= 60)
+    assert counts.sum() >= all_counts[inside].sum()
+    assert counts.sum() < all_counts.sum()
+
+    # A view crossing the antimeridian.
+    lats, lngs, counts = clusters.get_clusters(4, ((-20, 150), (20, -150)))
+    assert len(counts) > 0
+    assert np.all((lngs >= 135) | (lngs <= -135))
+
+    geojson = clusters.to_geojson(4, ((-20, -30), (40, 60)))
+    assert sum(feature['properties']['count'] for feature in geojson['features']) == clusters.get_clusters(
+        4, ((-20, -30), (40, 60)))[2].sum()
@@ -0,0 +1,104 @@
+from IaaGeoDataCleaning.CleaningUtils.modify_data import Modifier, Rule
+import builtins
+import glob
+import os
+import pytest
+import pandas as pd
+
+
+def writeInputs(directory, correct=('a', 'b'), flipped=('p', 'q', 'r', 's')):
+    directory.mkdir(exist_ok=True)
+    pd.DataFrame({'Location': list(correct), 'Country': ['X'] * len(correct),
+                  'Latitude': [1.0 + i for i in range(len(correct))],
+                  'Longitude': [1.0 + i for i in range(len(correct))]}).to_csv(str(directory / 'correct.csv'),
+                                                                              index=False)
+    pd.DataFrame({'Location': list(flipped), 'Country': ['X'] * len(flipped),
+                  'Latitude': [1.0 + i for i in range(len(flipped))],
+                  'Longitude': [5.0 + i for i in range(len(flipped))],
+                  'Flipped_Lat': [5.0 + i for i in range(len(flipped))],
+                  'Flipped_Lng': [1.0 + i for i in range(len(flipped))],
+                  'Type': ['Flipped'] * len(flipped)}).to_csv(str(directory / 'flipped.csv'), index=False)
+    pd.DataFrame({'Location': ['u', 'v'], 'Country': ['X'] * 2, 'Latitude': [1.0, 2.0], 'Longitude': [5.0, 6.0],
+                  'Geocoded_Lat': [1.001, 9.0], 'Geocoded_Lng': [5.001, 9.0],
+                  'Type': ['Geocoded'] * 2}).to_csv(str(directory / 'geocoded.csv'), index=False)
+    return directory
+
+
+def runModifier(monkeypatch, inputs, output_directory, answers, rules=None):
+    answers = iter(answers)
+    monkeypatch.setattr(builtins, 'input', lambda prompt='': next(answers))
+    printed = []
+    monkeypatch.setattr(builtins, 'print', lambda *args, **kwargs: printed.append(' '.join(map(str, args))))
+    modifier = Modifier(str(inputs / 'flipped.csv'), str(inputs / 'correct.csv'), str(inputs / 'geocoded.csv'))
+    modifier.run(str(output_directory), rules=rules)
+    monkeypatch.undo()
+    return pd.read_csv(printed[-1][len('All rows checked. Confirmed entries are in '):-1])
+
+
+def testModifierJournal(monkeypatch, tmp_path):
+    inputs = writeInputs(tmp_path / 'inputs')
+    out = runModifier(monkeypatch, inputs, tmp_path, ['SAVE', 'EXIT', 'EXIT'])
+    assert list(out['Location']) == ['a', 'b', 'p']
+    assert list(out['Latitude']) == [1.0, 2.0, 5.0]
+
+    # Running again only prompts for the rows without a journaled decision.
+    out = runModifier(monkeypatch, inputs, tmp_path, ['KEEP', 'TOSS', 'SAVE', 'SAVE', 'KEEP'])
+    assert list(out['Location']) == ['a', 'b', 'p', 'q', 'r', 's', 'u', 'v']
+    assert list(out['Latitude']) == [1.0, 2.0, 5.0, 2.0, 3.0, 8.0, 1.001, 2.0]
+    assert list(pd.read_csv(glob.glob(str(tmp_path / 'flipped_updated_*.csv'))[0])['Location']) == ['r']
+    assert len(pd.read_csv(glob.glob(str(tmp_path / 'geocoded_updated_*.csv'))[0])) == 0
+    assert len(glob.glob(str(tmp_path / 'correctlocation_*.csv'))) == 1
+
+
+def testModifierOutputFromJournal(monkeypatch, tmp_path):
+    inputs = writeInputs(tmp_path / 'inputs')
+    expected = runModifier(monkeypatch, inputs, tmp_path, ['SAVE', 'TOSS', 'EXIT', 'EXIT'])
+    output_path = glob.glob(str(tmp_path / 'correctlocation_*.csv'))[0]
+
+    # A missing output, or one cut short between the journal and output writes, is completed from the journal.
+    os.remove(output_path)
+    pd.testing.assert_frame_equal(runModifier(monkeypatch, inputs, tmp_path, ['EXIT', 'EXIT']), expected)
+    with open(output_path) as output_file:
+        text = output_file.read()
+    with open(output_path, 'w') as output_file:
+        output_file.write(text[:-5])
+    pd.testing.assert_frame_equal(runModifier(monkeypatch, inputs, tmp_path, ['EXIT', 'EXIT']), expected)
+
+    # An output that does not match the journal is left as is.
+    with open(output_path, 'w') as output_file:
+        output_file.write('edited\n')
+    pd.testing.assert_frame_equal(runModifier(monkeypatch, inputs, tmp_path, ['EXIT', 'EXIT']), expected)
+    with open(output_path) as output_file:
+        assert output_file.read() == 'edited\n'
+
+
+@pytest.mark.parametrize('other_flipped', [('p', 'q', 'r', 's'), ('p', 'q', 'r')])
+def testModifierSessions(monkeypatch, tmp_path, other_flipped):
+    first = writeInputs(tmp_path / 'first', correct=('a1', 'a2'))
+    second = writeInputs(tmp_path / 'second', correct=('c1', 'c2'), flipped=other_flipped)
+    first_out = runModifier(monkeypatch, first, tmp_path, ['SAVE', 'EXIT', 'EXIT'])
+    second_out = runModifier(monkeypatch, second, tmp_path, ['KEEP', 'EXIT', 'EXIT'])
+
+    # Reviews of different inputs in the same directory keep their own journal and output.
+    assert list(first_out['Location']) == ['a1', 'a2', 'p']
+    assert list(second_out['Location']) == ['c1', 'c2', 'p']
+    assert len(glob.glob(str(tmp_path / 'correctlocation_*.csv'))) == 2
+    assert len(glob.glob(str(tmp_path / 'modifier_journal_*.csv'))) == 2
+    resumed = runModifier(monkeypatch, first, tmp_path, ['EXIT', 'EXIT'])
+    pd.testing.assert_frame_equal(resumed, first_out)
+
+
+def testRuleCommand():
+    with pytest.raises(ValueError):
+        Rule('DROP')
+
+
+def testModifierRules(monkeypatch, tmp_path):
+    inputs = writeInputs(tmp_path / 'inputs')
+    out = runModifier(monkeypatch, inputs, tmp_path, ['EXIT', 'EXIT'],
+                      rules=[Rule('SAVE', row_type='Geocoded', max_distance=1)])
+    # The rule saves the geocoded entry 'u', whose suggestion is about 150 m away, and leaves 'v' for the prompt.
+    assert list(out['Location']) == ['a', 'b', 'u']
+    assert list(out['Latitude']) == [1.0, 2.0, 1.001]
+    assert list(pd.read_csv(glob.glob(str(tmp_path / 'geocoded_updated_*.csv'))[0])['Location']) == ['v']
+    assert len(pd.read_csv(glob.glob(str(tmp_path / 'flipped_updated_*.csv'))[0])) == 4
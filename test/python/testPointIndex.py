@@ -0,0 +1,46 @@
+from IaaGeoDataCleaning.CleaningUtils.distance import haversine
+from IaaGeoDataCleaning.MapTools.point_index import PointIndex, fingerprint
+import pytest
+import numpy as np
+import pandas as pd
+
+
+@pytest.fixture
+def points():
+    rng = np.random.RandomState(0)
+    lats = rng.uniform(-89, 89, 2000)
+    lngs = rng.uniform(-180, 180, 2000)
+    lats[[5, 17]] = np.nan
+    return lats, lngs
+
+
+def testPointIndexWithin(points):
+    lats, lngs = points
+    index = PointIndex(lats, lngs)
+    distances = haversine(10.0, 179.5, lats, lngs)
+    for radius in (100, 1000, 5000):
+        found, found_distances = index.within(10.0, 179.5, radius)
+        expected = np.flatnonzero(distances < radius)
+        assert list(found) == list(expected)
+        assert np.allclose(found_distances, distances[expected])
+
+
+def testPointIndexNearest(points):
+    lats, lngs = points
+    index = PointIndex(lats, lngs)
+    distances = haversine(-45.0, -170.0, lats, lngs)
+    found, found_distances = index.nearest(-45.0, -170.0, k=10)
+    assert list(found) == list(np.argsort(np.where(np.isnan(distances), np.inf, distances))[:10])
+    assert np.all(np.diff(found_distances) >= 0)
+
+    assert len(index.nearest(0, 0, k=5000)[0]) == 1998
+    empty = PointIndex([np.nan], [np.nan])
+    assert len(empty.nearest(0, 0)[0]) == 0
+
+
+def testFingerprint():
+    df = pd.DataFrame({'Latitude': [1.0, 2.0], 'Longitude': [3.0, 4.0]})
+    assert fingerprint(df, ['Latitude', 'Longitude']) == fingerprint(df.copy(), ['Latitude', 'Longitude'])
+    changed = df.copy()
+    changed.loc[1, 'Latitude'] = 2.5
+    assert fingerprint(df, ['Latitude', 'Longitude']) != fingerprint(changed, ['Latitude', 'Longitude'])
@@ -0,0 +1,102 @@
+from IaaGeoDataCleaning.ConnectionUtils.SQLiteConnector import SQLiteConnector, haversine
+from IaaGeoDataCleaning.ConnectionUtils.SQLiteTable import SQLiteTable
+import pytest
+import pandas as pd
+
+
+@pytest.fixture
+def table(tmp_path):
+    entries = pd.DataFrame({'Location': ['Nairobi', 'Mombasa', 'Kisumu', 'Lima', 'Nowhere'],
+                            'Country': ['Kenya', 'Kenya', 'Kenya', 'Peru', 'Kenya'],
+                            'Latitude': [-1.2864, -4.0435, -0.0917, -12.0464, None],
+                            'Longitude': [36.8172, 39.6682, 34.768, -77.0428, None]})
+    entries.to_csv(str(tmp_path / 'entries.csv'), index=False)
+
+    connector = SQLiteConnector()
+    connector.connect_to_file(str(tmp_path / 'entries.db'))
+    tbl = SQLiteTable('entries', connector)
+    tbl.table_from_file(str(tmp_path / 'entries.csv'))
+    yield tbl
+    connector.close_connection()
+
+
+def testHaversine():
+    assert haversine(0, 0, 0, 1) == pytest.approx(111195, rel=1e-3)
+    assert haversine(None, 0, 0, 1) is None
+
+
+def testTableFromFile(table):
+    rows = table.get_table(limit=0)
+    assert len(rows) == 5
+    assert rows[0] == ('Nairobi', 'Kenya', -1.2864, 36.8172)
+    assert rows[4][2] is None
+
+
+def testCheckByLatLng(table):
+    assert not table.is_spatial()
+    assert table.check_by_latlng(-1.3, 36.8) == (False, [])
+
+    table.make_spatial()
+    assert table.is_spatial()
+    found, rows = table.check_by_latlng(-1.3, 36.8, search_radius=10000)
+    assert found
+    assert [row[0] for row in rows] == ['Nairobi']
+    found, rows = table.check_by_latlng(-1.3, 36.8, search_radius=1000000)
+    assert sorted(row[0] for row in rows) == ['Kisumu', 'Mombasa', 'Nairobi']
+
+
+def testCheckByLatLngAfterVacuum(table):
+    table.make_spatial()
+    cur = table.connector.connection.cursor()
+    cur.execute('DELETE FROM "entries" WHERE "location" = \'Nairobi\';')
+    table.connector.connection.commit()
+    cur.execute('VACUUM;')
+    cur.close()
+
+    # The index is keyed on the iaa_id column, whose values survive VACUUM, so it still matches the right rows.
+    found, rows = table.check_by_latlng(-4.0, 39.7, search_radius=10000)
+    assert found
+    assert [row[0] for row in rows] == ['Mombasa']
+    assert table.check_by_latlng(-1.3, 36.8, search_radius=10000) == (False, [])
+
+
+def testUpdateEntries(table, tmp_path):
+    table.make_spatial()
+    pd.DataFrame({'Location': ['Nairobi', 'Cusco'], 'Country': ['Kenya', 'Peru'],
+                  'Latitude': [-1.5, -13.5319], 'Longitude': [37.0, -71.9675]}).to_csv(str(tmp_path / 'new.csv'),
+                                                                                        index=False)
+    rejected = table.update_entries('Longitude', 'Latitude', 'Country', 'Location', str(tmp_path / 'new.csv'),
+                                    batch_size=1)
+    assert len(rejected) == 0
+
+    found, rows = table.check_by_countryloc('Kenya', 'Nairobi')
+    assert found
+    assert rows[0][2:4] == (-1.5, 37.0)
+    assert table.check_by_countryloc('Peru', 'Cusco')[0]
+
+    # The triggers keep the spatial index in sync with the inserts and updates.
+    assert [row[0] for row in table.check_by_latlng(-1.5, 37.0, search_radius=1000)[1]] == ['Nairobi']
+    assert table.check_by_latlng(-1.2864, 36.8172, search_radius=1000) == (False, [])
+    assert [row[0] for row in table.check_by_latlng(-13.5, -72.0, search_radius=10000)[1]] == ['Cusco']
+
+
+def testUpdateEntriesRejectsRows(table, tmp_path):
+    cur = table.connector.connection.cursor()
+    cur.execute('CREATE TRIGGER "no_mars" BEFORE INSERT ON "entries" WHEN NEW."country" = \'Mars\' '
+                'BEGIN SELECT RAISE(ABORT, \'no entries on Mars\'); END;')
+    cur.close()
+    pd.DataFrame({'Location': ['Olympus Mons', 'Eldoret'], 'Country': ['Mars', 'Kenya'],
+                  'Latitude': [18.65, 0.5143], 'Longitude': [-133.8, 35.2698]}).to_csv(str(tmp_path / 'new.csv'),
+                                                                                        index=False)
+    rejected = table.update_entries('Longitude', 'Latitude', 'Country', 'Location', str(tmp_path / 'new.csv'))
+    assert list(rejected['Location']) == ['Olympus Mons']
+    assert 'no entries on Mars' in rejected['Error'].iloc[0]
+    assert table.check_by_countryloc('Kenya', 'Eldoret')[0]
+    assert len(table.get_table(limit=0)) == 6
+
+
+def testTableToCsv(table, tmp_path):
+    file_path = table.table_to_csv('out.csv', directory=str(tmp_path), fetch_size=2)
+    out = pd.read_csv(file_path)
+    assert list(out.columns) == ['location', 'country', 'latitude', 'longitude']
+    assert len(out) == 5
@@ -0,0 +1,388 @@
+from IaaGeoDataCleaning.ConnectionUtils.DatabaseConnector import DatabaseConnector
+from IaaGeoDataCleaning.ConnectionUtils import Table as table_module
+from IaaGeoDataCleaning.ConnectionUtils.Table import Table
+from psycopg2 import extensions
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INERROR
+import psycopg2
+import pytest
+import pyarrow.parquet as pq
+import struct
+from decimal import Decimal
+import numpy as np
+import pandas as pd
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+        self.rowcount = -1
+        self.description = connection.description
+        self.closed = False
+
+    def execute(self, command, params=None):
+        if not isinstance(command, str):
+            command = command.as_string(self.connection)
+        self.connection.executed.append((command, params))
+        if params is not None and self.connection.reject in params:
+            raise psycopg2.DataError('rejected ' + str(self.connection.reject))
+        if command.startswith(('SELECT', 'EXECUTE')):
+            self.rows = self.connection.results.pop(0) if self.connection.results else []
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if len(self.rows) > 0 else None
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def copy_expert(self, command, infile, size=None):
+        self.connection.executed.append((command.as_string(self.connection), infile.read()))
+        if self.connection.copy_error is not None:
+            raise self.connection.copy_error
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    """
+    Stands in for a psycopg2 connection, recording the statements run on it and returning the queued results of its
+    queries.
+    """
+    def __init__(self):
+        self.executed = []
+        self.results = []
+        self.closed = 0
+        self.status = TRANSACTION_STATUS_IDLE
+        self.copy_error = None
+        self.rollbacks = 0
+        self.description = None
+        self.reject = object()
+
+    def cursor(self, name=None):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        return self.status
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = TRANSACTION_STATUS_IDLE
+
+
+@pytest.fixture
+def connector(monkeypatch):
+    monkeypatch.setattr(extensions, 'quote_ident', lambda name, scope: '"' + name.replace('"', '""') + '"')
+    connector = DatabaseConnector()
+    connector.connection = FakeConnection()
+    return connector
+
+
+def statements(connector, keyword):
+    return [command for command, params in connector.connection.executed if keyword in command]
+
+
+def testPreparedStatementsSharedByConnection(connector):
+    first = Table('places', connector)
+    second = Table('places', connector)
+    first.check_by_countryloc('Kenya', 'Nairobi')
+    second.check_by_countryloc('Kenya', 'Nairobi')
+    # The statement is prepared once for the connection, not once per Table.
+    assert len(statements(connector, 'PREPARE')) == 1
+    assert len(statements(connector, 'EXECUTE')) == 2
+
+    # Clearing one Table's cache deallocates the statements of the table for every Table on the connection.
+    first.clear_cache()
+    assert len(statements(connector, 'DEALLOCATE')) == 1
+    second.check_by_countryloc('Kenya', 'Nairobi')
+    assert len(statements(connector, 'PREPARE')) == 2
+
+
+def testClearCacheInFailedTransaction(connector):
+    table = Table('places', connector)
+    table.check_by_countryloc('Kenya', 'Nairobi')
+    connector.connection.status = TRANSACTION_STATUS_INERROR
+    table.change_table('places')
+    assert statements(connector, 'DEALLOCATE') == []
+
+    # The statement is deallocated before it is prepared again.
+    connector.connection.rollback()
+    table.check_by_countryloc('Kenya', 'Nairobi')
+    assert statements(connector, 'DEALLOCATE')[0].startswith('DEALLOCATE iaa_')
+    assert 'PREPARE' in statements(connector, 'DEALLOCATE')[0]
+
+    # Statements prepared on an earlier connection are forgotten.
+    connector.connection = FakeConnection()
+    table.check_by_countryloc('Kenya', 'Nairobi')
+    assert len(statements(connector, 'PREPARE')) == 1
+    assert statements(connector, 'DEALLOCATE') == []
+
+
+def testLoadSchema(connector, monkeypatch):
+    table = Table('places', connector)
+    df = pd.DataFrame({'Name': ['a', 'b', None], 'Count': [1, 2, 3], 'Share': [0.5, None, 1.5],
+                       'Seen': ['2018-07-12', '2018-07-13 10:00:00', None], 'Bad_Date': ['2018-13-45', None, None],
+                       'Flag': [True, None, False], 'Empty': [np.nan, np.nan, np.nan]})
+    names, types = table._Table__load_schema(df)
+    assert names == list(df.columns)
+    assert types == ['text', 'bigint', 'double precision', 'timestamp', 'text', 'boolean', 'text']
+
+    # Frames of a layout seen before are not sampled again.
+    def fail(self, val):
+        raise AssertionError('sampled again')
+    monkeypatch.setattr(Table, '_Table__value_kind', fail)
+    assert table._Table__load_schema(df.iloc[::-1].copy()) == (names, types)
+    with pytest.raises(AssertionError):
+        table._Table__load_schema(df.rename(columns={'Name': 'Location'}))
+
+
+def testTableFromFileRollsBack(connector, tmp_path):
+    pd.DataFrame({'Count': list(range(5)) + ['many']}).to_csv(str(tmp_path / 'counts.csv'), index=False)
+    table = Table('counts', connector)
+    connector.connection.copy_error = psycopg2.DataError('invalid input syntax for type bigint: "many"')
+    table.table_from_file(str(tmp_path / 'counts.csv'), sample_size=3)
+    assert statements(connector, 'CREATE TABLE') == ['CREATE TABLE "counts" ("count" bigint)']
+    assert connector.connection.rollbacks == 1
+
+    # The whole file is streamed to the server, not just the sample.
+    assert statements(connector, 'COPY')[0] == 'COPY "counts" FROM STDIN WITH CSV HEADER'
+    assert connector.connection.executed[-1][1].splitlines()[-1] == 'many'
+
+
+@pytest.fixture
+def batches(connector, monkeypatch):
+    """
+    Record the pages sent with execute_batch, failing the first one if connection.batch_error is set.
+    """
+    sent = []
+    connector.connection.batch_error = None
+
+    def execute_batch(cur, command, rows, page_size=100):
+        if connector.connection.batch_error is not None:
+            error, connector.connection.batch_error = connector.connection.batch_error, None
+            raise error
+        sent.append((command, list(rows)))
+    monkeypatch.setattr(table_module, 'execute_batch', execute_batch)
+    monkeypatch.setattr(Table, 'get_column_names', lambda self: ['location', 'country', 'latitude', 'longitude'])
+    return sent
+
+
+def testSyncEntries(connector, batches, tmp_path, capsys):
+    pd.DataFrame({'Location': ['Nairobi', 'Mombasa', 'Kisumu'], 'Country': ['Kenya'] * 3,
+                  'Latitude': [-1.0, -4.0435, -0.0917], 'Longitude': [36.0, 39.6682, 34.768]}).to_csv(
+        str(tmp_path / 'entries.csv'), index=False)
+    table = Table('places', connector)
+    # The stored hash of Nairobi matches although the values were read with other dtypes.
+    stored = table._Table__row_hashes(pd.DataFrame({'Location': ['Nairobi'], 'Country': ['Kenya'], 'Latitude': [-1],
+                                                    'Longitude': [36]}))[0]
+    connector.connection.results = [[('Kenya', 'Nairobi', stored), ('Kenya', 'Mombasa', 'outdated')], []]
+    rejected = table.sync_entries(str(tmp_path / 'entries.csv'), 'Longitude', 'Latitude', 'Country', 'Location',
+                                  batch_size=2)
+    assert len(rejected) == 0
+    assert 'Inserted 1 and updated 1 of 3 entries.' in capsys.readouterr().out
+
+    # Each batch of the file is looked up in one query and written in pages under one savepoint.
+    assert len(statements(connector, 'unnest')) == 2
+    assert [[row[0] for row in rows] for command, rows in batches] == [[], ['Mombasa'], ['Kisumu'], []]
+    assert batches[1][0].startswith('UPDATE "places" SET "location" = %s')
+    assert batches[2][0].startswith('INSERT INTO "places" ("location", "country", "latitude", "longitude"')
+    assert len(statements(connector, 'SAVEPOINT sync_batch')) == 4
+    assert statements(connector, 'sync_entry') == []
+
+
+def testSyncEntriesReplaysFailedBatch(connector, batches):
+    df = pd.DataFrame({'Location': ['Nairobi', 'Mombasa'], 'Country': ['Kenya'] * 2, 'Latitude': [-1.2864, -4.0435],
+                       'Longitude': [36.8172, 39.6682]})
+    connector.connection.batch_error = psycopg2.DataError('value too long')
+    table = Table('places', connector)
+    assert len(table.sync_entries(df, 'Longitude', 'Latitude', 'Country', 'Location')) == 0
+
+    # The failed batch is rolled back and written again one row at a time.
+    assert statements(connector, 'ROLLBACK TO SAVEPOINT sync_batch') == ['ROLLBACK TO SAVEPOINT sync_batch;']
+    assert len(statements(connector, 'RELEASE SAVEPOINT sync_entry')) == 2
+    assert [params[0] for command, params in connector.connection.executed if command.startswith('INSERT')] == [
+        'Nairobi', 'Mombasa']
+
+
+def testSubdivideWorld(connector):
+    table = Table('places', connector)
+    connector.connection.results = [[(250, 9000)], [(None,)]]
+    assert table.subdivide_world('gadm.world') == 'gadm.world_subdivided'
+    assert statements(connector, 'CREATE TABLE') == [
+        'CREATE TABLE "gadm"."world_subdivided" AS SELECT "gid_0" AS code, "name_0" AS name, '
+        'ST_Subdivide("geom", %s) AS geom FROM "gadm"."world";']
+    (comment,) = [params[0] for command, params in connector.connection.executed if command.startswith('COMMENT')]
+
+    # The helper table is reused only while it was built from the same columns and world table rows.
+    connector.connection.results = [[(250, 9000)], [(comment,)]]
+    table.subdivide_world('gadm.world')
+    assert len(statements(connector, 'CREATE TABLE')) == 1
+    connector.connection.results = [[(250, 9000)], [(comment,)]]
+    table.subdivide_world('gadm.world', world_countrycodecol_name='iso_a3')
+    connector.connection.results = [[(250, 9001)], [(comment,)]]
+    table.subdivide_world('gadm.world')
+    assert len(statements(connector, 'CREATE TABLE')) == 3
+    assert len(statements(connector, 'DROP TABLE IF EXISTS "gadm"."world_subdivided"')) == 3
+
+
+def testCheckValidityPrefersOwnCountry(connector, monkeypatch):
+    monkeypatch.setattr(Table, 'subdivide_world', lambda self, *args: 'world_subdivided')
+    Table('places', connector).check_validity('world')
+    (update,) = statements(connector, 'UPDATE')
+    # Points are matched against every country, so a border point in its own country is not 'Invalid'.
+    assert 'WHERE ST_Intersects(p."geom", w.geom))' in update
+    assert 'bool_or(w.code = p."country_code")' in update
+    assert 'min(w.name) FILTER (WHERE w.code = p."country_code")' in update
+
+
+def testTableToParquet(connector, tmp_path):
+    connector.connection.description = [('id', 20), ('name', 25), ('score', 1700), ('tags', 3802)]
+    connector.connection.results = [[(1, 'a', Decimal('1.5'), {'k': 1}), (2, None, None, None), (3, 'c', 2, ['x'])]]
+    table = Table('places', connector)
+    file_path = table.table_to_parquet(str(tmp_path / 'places.parquet'), fetch_size=2)
+
+    # The types follow the columns' type OIDs, and each fetched batch is its own row group.
+    parquet = pq.ParquetFile(file_path)
+    assert [str(field.type) for field in parquet.schema_arrow] == ['int64', 'string', 'double', 'string']
+    assert parquet.num_row_groups == 2
+    out = parquet.read().to_pydict()
+    assert out['score'] == [1.5, None, 2.0]
+    assert out['tags'] == ['{"k": 1}', None, '["x"]']
+
+
+def testLoadDataChunks(connector, tmp_path):
+    table = Table('places', connector)
+    table.load_data(pd.DataFrame({'Location': ['a', 'b', 'c'], 'Count': [1, 2, 3]}), chunk_size=2)
+    # Each chunk of a dataframe is sent as its own headerless COPY.
+    assert [payload for command, payload in connector.connection.executed] == ['a,1\nb,2\n', 'c,3\n']
+    assert statements(connector, 'COPY') == ['COPY "places" FROM STDIN WITH CSV'] * 2
+
+    pd.DataFrame({'Location': ['d'], 'Count': [4]}).to_csv(str(tmp_path / 'more.csv.gz'), index=False)
+    table.load_data(str(tmp_path / 'more.csv.gz'))
+    assert connector.connection.executed[-1] == ('COPY "places" FROM STDIN WITH CSV HEADER', 'Location,Count\nd,4\n')
+
+
+def testCheckByCountrylocs(connector):
+    connector.connection.results = [[('Kenya', 'Nairobi')]]
+    exists = Table('places', connector).check_by_countrylocs([('Kenya', 'Nairobi'), ('Kenya', 'Mombasa')])
+    assert exists == {('Kenya', 'Nairobi'): True, ('Kenya', 'Mombasa'): False}
+    # All the keys are looked up in one query.
+    assert connector.connection.executed == [(
+        'SELECT DISTINCT t."country", t."location" FROM "places" AS t JOIN unnest(%s::text[], %s::text[]) '
+        'AS k(country, location) ON t."country" = k.country AND t."location" = k.location;',
+        (['Kenya', 'Kenya'], ['Nairobi', 'Mombasa']))]
+
+
+def testQueryCache(connector):
+    table = Table('places', connector, cache_size=2)
+    connector.connection.results = [[('Nairobi', 'Kenya')]]
+    assert table.check_by_countryloc('Kenya', 'Nairobi') == (True, [('Nairobi', 'Kenya')])
+    assert table.check_by_countryloc('Kenya', 'Nairobi') == (True, [('Nairobi', 'Kenya')])
+    assert len(statements(connector, 'EXECUTE')) == 1
+
+    # The least recently used result is dropped once the cache is full.
+    table.check_by_countryloc('Kenya', 'Mombasa')
+    table.check_by_countryloc('Kenya', 'Nairobi')
+    table.check_by_countryloc('Kenya', 'Kisumu')
+    table.check_by_countryloc('Kenya', 'Nairobi')
+    assert len(statements(connector, 'EXECUTE')) == 3
+    table.check_by_countryloc('Kenya', 'Mombasa')
+    assert len(statements(connector, 'EXECUTE')) == 4
+
+    # Writing to the table through the Table drops its cached results.
+    table.load_data(pd.DataFrame({'Location': ['Eldoret'], 'Country': ['Kenya']}))
+    table.check_by_countryloc('Kenya', 'Nairobi')
+    assert len(statements(connector, 'EXECUTE')) == 5
+
+
+def testUpdateEntries(connector, batches, tmp_path):
+    pd.DataFrame({'Location': ['Nairobi', 'Eldoret', 'Eldoret', 'Kisumu'], 'Country': ['Kenya'] * 4,
+                  'Latitude': [-1.2864, 0.5143, 0.52, -0.0917], 'Longitude': [36.8172, 35.2698, 35.27, 34.768]}).to_csv(
+        str(tmp_path / 'entries.csv'), index=False)
+    connector.connection.results = [[('Kenya', 'Nairobi')], []]
+    table = Table('places', connector)
+    rejected = table.update_entries('Longitude', 'Latitude', 'Country', 'Location', str(tmp_path / 'entries.csv'),
+                                    batch_size=3)
+    assert len(rejected) == 0
+
+    # New keys are inserted once and later rows with the same key update the entry.
+    assert [[row[-1] if command.startswith('UPDATE') else row[0] for row in rows] for command, rows in batches] == [
+        ['Eldoret'], ['Nairobi', 'Eldoret'], ['Kisumu'], []]
+    assert statements(connector, 'update_entry') == []
+
+
+def testUpdateEntriesRejectsRows(connector, batches, tmp_path):
+    pd.DataFrame({'Location': ['Olympus Mons', 'Eldoret'], 'Country': ['Mars', 'Kenya'], 'Latitude': [18.65, 0.5143],
+                  'Longitude': [-133.8, 35.2698]}).to_csv(str(tmp_path / 'entries.csv'), index=False)
+    connector.connection.batch_error = psycopg2.DataError('no entries on Mars')
+    connector.connection.reject = 'Mars'
+    table = Table('places', connector)
+    rejected = table.update_entries('Longitude', 'Latitude', 'Country', 'Location', str(tmp_path / 'entries.csv'))
+
+    # Only the failing row of the batch is rejected; the rest are written one at a time.
+    assert list(rejected['Location']) == ['Olympus Mons']
+    assert list(rejected['Error']) == ['rejected Mars']
+    assert statements(connector, 'ROLLBACK TO SAVEPOINT') == ['ROLLBACK TO SAVEPOINT update_batch;',
+                                                             'ROLLBACK TO SAVEPOINT update_entry;']
+    assert [params[0] for command, params in connector.connection.executed if command.startswith('INSERT')] == [
+        'Olympus Mons', 'Eldoret']
+
+
+def testBinaryPoints(connector):
+    payload = Table('places', connector)._Table__binary_points(np.array([0, 7]), np.array([-1.5, 2.0]),
+                                                                np.array([36.8, -77.0]))
+    assert payload[:19] == b'PGCOPY\n\xff\r\n\x00' + b'\x00' * 8
+    assert payload[-2:] == b'\xff\xff'
+    assert len(payload) == 19 + 2 * 43 + 2
+
+    # Each tuple is a big-endian bigint field and a little-endian EWKB point with SRID 4326.
+    tuples = [payload[19 + 43 * i:19 + 43 * (i + 1)] for i in range(2)]
+    assert struct.unpack('>hiqi', tuples[1][:18]) == (2, 8, 7, 25)
+    assert struct.unpack('<BIIdd', tuples[1][18:]) == (1, 0x20000001, 4326, -77.0, 2.0)
+    assert struct.unpack('<dd', tuples[0][27:]) == (36.8, -1.5)
+
+
+def testValidateDataframe(connector, monkeypatch):
+    monkeypatch.setattr(Table, 'subdivide_world', lambda self, *args: 'world_subdivided')
+    df = pd.DataFrame({'Location': ['Nowhere', 'Busia', 'Arusha', 'Sea'], 'ISO3': ['KEN', 'UGA', 'KEN', 'KEN'],
+                       'Latitude': [None, 0.46, -3.37, -5.0], 'Longitude': [None, 34.09, 36.68, 41.0]})
+    connector.connection.results = [[(1, 'KEN', 'Kenya'), (1, 'UGA', 'Uganda'), (2, 'TZA', 'Tanzania')]]
+    out = Table('places', connector).validate_dataframe(df, 'world', lat_col='Latitude', lng_col='Longitude',
+                                                        fetch_size=2)
+
+    # A point on a border keeps its own country; points outside every country are not 'Invalid'.
+    assert list(out['dtype']) == ['Missing', 'Valid', 'Invalid', 'Valid']
+    assert list(out['dbCountry']) == [None, 'Uganda', 'Tanzania', None]
+    # Only the rows with coordinates are copied, keyed on their position.
+    (command, payload) = [entry for entry in connector.connection.executed if entry[0].startswith('COPY')][0]
+    assert command == 'COPY "iaa_validate_points" FROM STDIN WITH (FORMAT binary)'
+    assert len(payload) == 19 + 3 * 43 + 2
+
+
+def testNearest(connector):
+    table = Table('places', connector)
+    table.nearest(-1.3, 36.8, k=3, max_distance=5000)
+    (prepare,) = statements(connector, 'PREPARE')
+    assert prepare.endswith(
+        'AS SELECT n.*, n."geom"::geography <-> ST_SETSRID(ST_MakePoint($1, $2), 4326)::geography AS distance '
+        'FROM "places" AS n WHERE ST_DWITHIN(n."geom"::geography, ST_SETSRID(ST_MakePoint($3, $4), 4326)::geography, '
+        '$5, true) ORDER BY n."geom"::geography <-> ST_SETSRID(ST_MakePoint($6, $7), 4326)::geography LIMIT $8;')
+    assert connector.connection.executed[-1][1] == (36.8, -1.3, 36.8, -1.3, 5000.0, 36.8, -1.3, 3)
+
+
+def testNearestBatch(connector):
+    connector.connection.results = [[(1, 'Nairobi', 10.0), (1, 'Thika', 40000.0), (3, 'Lima', 5.0)], [(1, 'Cusco', 1.0)]]
+    found = Table('places', connector).nearest_batch([(-1.3, 36.8), (0, 0), (-12.0, -77.0), (-13.5, -72.0)], k=2,
+                                                     batch_size=3)
+    # Rows are returned per point in the order of the points, including points without any match.
+    assert found == [[('Nairobi', 10.0), ('Thika', 40000.0)], [], [('Lima', 5.0)], [('Cusco', 1.0)]]
+    (command, params) = connector.connection.executed[0]
+    assert 'CROSS JOIN LATERAL (SELECT n.*, n."geom"::geography <-> ST_SETSRID(ST_MakePoint(q.lng, q.lat), 4326)' in command
+    assert params == ([-1.3, 0.0, -12.0], [36.8, 0.0, -77.0], 2)
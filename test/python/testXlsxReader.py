@@ -0,0 +1,21 @@
+from IaaGeoDataCleaning.CleaningUtils.xlsx_reader import iter_xlsx
+from openpyxl import Workbook
+
+
+def testIterXlsxBlankRows(tmp_path):
+    wb = Workbook()
+    sh = wb.active
+    sh.append(['Location', 'Latitude'])
+    sh.append(['a', 1.0])
+    for i in range(5):
+        sh.append([None, None])
+    sh.append(['b', 2.0])
+    sh.append(['c', 3.0])
+    sh.append([None, None])
+    sh.append(['d', 4.0])
+    wb.save(str(tmp_path / 'blank_rows.xlsx'))
+
+    batches = list(iter_xlsx(str(tmp_path / 'blank_rows.xlsx'), batch_size=1))
+    assert [list(batch['Location']) for batch in batches] == [['a'], ['b'], ['c'], ['d']]
+    batches = list(iter_xlsx(str(tmp_path / 'blank_rows.xlsx'), batch_size=3))
+    assert [len(batch) for batch in batches] == [3, 1]